@@ -0,0 +1,204 @@
+"""Synthetic artists, works, subreddits and submissions at a chosen scale.
+
+Scale 1 is roughly a year of one user's posting: 1,000 artists, a tenth of
+them aliases in chains up to three deep, 5,000 works, a tenth of them albums
+and a fifth not yet uploaded, 20 subreddits with a mix of rules, and one to
+four submissions per work, most of them posted. Artists, works and
+submissions grow linearly with the scale; subreddits with its square root.
+
+Rows go in through the schema's own constraints and triggers, so the counts
+and last submission times come out as they would in use.
+
+Usage: python bench/dataset.py URL [--scale N] [--seed N]
+
+"""
+import argparse
+import math
+import time
+
+import psycopg2
+
+ARTISTS = 1000
+WORKS = 5000
+SUBREDDITS = 20
+SUBMISSIONS_PER_WORK = 4
+
+# Works whose submissions are inserted in one transaction
+BATCH = 5000
+
+# Shares of the artists that are aliases, and of the works that are albums
+# or haven't been uploaded
+ALIAS_SHARE = 0.1
+ALBUM_SHARE = 0.1
+NOT_UPLOADED_SHARE = 0.2
+
+ARTISTS_SQL = """INSERT INTO public.artists (id, name)
+    SELECT n, 'Artist ' || n FROM generate_series(1, %(canonical)s) AS n"""
+
+# Every third alias points at an artist, the next two at the alias before
+# them, which makes chains three deep
+ALIASES_SQL = """INSERT INTO public.artists (id, name, alias_of)
+    SELECT n, 'Alias ' || n,
+        CASE WHEN (n - %(canonical)s) %% 3 = 1
+            THEN 1 + (n * 7919) %% %(canonical)s ELSE n - 1 END
+    FROM generate_series(%(canonical)s + 1, %(artists)s) AS n ORDER BY n"""
+
+SUBREDDITS_SQL = """INSERT INTO public.subreddits (id, name, flair_id,
+        require_flair, require_tag, require_series, sfw_only, disabled,
+        crosspost_from)
+    SELECT n, 'bench_' || n,
+        CASE WHEN n %% 10 = 3 THEN 'flair' END,
+        n %% 10 = 3, n %% 10 = 4, n %% 10 = 5, n %% 5 = 1, n %% 20 = 7,
+        n = 2
+    FROM generate_series(1, %(subreddits)s) AS n"""
+
+# Squaring the random number gives a few artists most of the works. The
+# lateral subquery refers to n so it's drawn again for every row
+WORKS_SQL = """INSERT INTO public.works (id, title, series, nsfw, source_url,
+        source_image_url, source_image_urls, is_album, imgur_id, imgur_url,
+        artist_id)
+    SELECT n, 'Work ' || n,
+        CASE WHEN random() < 0.4 THEN 'Series ' || n %% 200 END,
+        random() < 0.3,
+        'https://www.artstation.com/artwork/' || n,
+        CASE WHEN NOT album THEN 'https://cdn.artstation.com/' || n || '.png' END,
+        CASE WHEN album THEN ARRAY['https://cdn.artstation.com/' || n || '-1.png',
+            'https://cdn.artstation.com/' || n || '-2.png',
+            'https://cdn.artstation.com/' || n || '-3.png'] END,
+        album,
+        CASE WHEN uploaded THEN 'img' || n END,
+        CASE WHEN uploaded THEN 'https://i.imgur.com/img' || n || '.png' END,
+        1 + floor(%(canonical)s * random() ^ 2)::integer
+    FROM generate_series(1, %(works)s) AS n
+    CROSS JOIN LATERAL (SELECT random() < %(album_share)s AS album,
+        random() >= %(not_uploaded_share)s AS uploaded WHERE n > 0) AS r"""
+
+# Submissions only go to subreddits whose rules the work meets; uploaded works
+# are mostly posted, at times spread over the past year
+#
+# They go in a batch of works per transaction. Every posted row updates its
+# subreddit's last submission time, and a row updated over and over in one
+# transaction gets slower each time, so one big insert would be quadratic
+SUBMISSIONS_SQL = """INSERT INTO public.submissions (work_id, subreddit_id,
+        custom_tag, reddit_id, submitted_on)
+    SELECT works.id, subreddits.id,
+        CASE WHEN require_tag THEN 'tag' END,
+        CASE WHEN posted THEN 'r' || works.id || '_' || subreddits.id END,
+        CASE WHEN posted THEN timezone('utc', now())
+            - random() * INTERVAL '365 days' END
+    FROM works
+    CROSS JOIN LATERAL generate_series(0, works.id %% %(per_work)s) AS j
+    INNER JOIN subreddits
+        ON subreddits.id = 1 + (works.id * 7 + j * 13) %% %(subreddits)s
+    CROSS JOIN LATERAL (SELECT imgur_id IS NOT NULL AND random() < 0.9
+        AS posted) AS p
+    WHERE works.id BETWEEN %(first)s AND %(last)s
+    AND (NOT sfw_only OR NOT nsfw) AND (NOT require_series OR series IS NOT NULL)
+    ON CONFLICT ON CONSTRAINT already_exists DO NOTHING"""
+
+SEQUENCES = (
+    ("artists", "artists_id_seq1"),
+    ("works", "works_id_seq"),
+    ("subreddits", "subreddits_id_seq"),
+)
+
+
+def sizes(scale):
+    artists = max(round(ARTISTS * scale), 10)
+
+    return {
+        "artists": artists,
+        "canonical": artists - round(artists * ALIAS_SHARE),
+        "works": max(round(WORKS * scale), 10),
+        "subreddits": max(round(SUBREDDITS * math.sqrt(scale)), 5),
+        "per_work": SUBMISSIONS_PER_WORK,
+        "album_share": ALBUM_SHARE,
+        "not_uploaded_share": NOT_UPLOADED_SHARE,
+    }
+
+
+def generate(con, scale=1, seed=0, log=print):
+    """Fill the empty database behind ``con`` and return the row counts."""
+    params = sizes(scale)
+
+    with con.cursor() as cursor:
+        # Both random() and the row order are the same from run to run
+        cursor.execute("SELECT setseed(%s)", (seed / (2**31),))
+        cursor.execute("SET max_parallel_workers_per_gather = 0")
+
+        for table, statement in (
+            ("artists", ARTISTS_SQL),
+            ("aliases", ALIASES_SQL),
+            ("subreddits", SUBREDDITS_SQL),
+            ("works", WORKS_SQL),
+        ):
+            start = time.perf_counter()
+            cursor.execute(statement, params)
+            log(
+                "{:<12} {:>9} rows in {:.2f}s".format(
+                    table, cursor.rowcount, time.perf_counter() - start
+                )
+            )
+
+        con.commit()
+
+        start = time.perf_counter()
+        rows = 0
+
+        for first in range(1, params["works"] + 1, BATCH):
+            cursor.execute(
+                SUBMISSIONS_SQL, dict(params, first=first, last=first + BATCH - 1)
+            )
+            con.commit()
+
+            rows += cursor.rowcount
+
+        log(
+            "{:<12} {:>9} rows in {:.2f}s".format(
+                "submissions", rows, time.perf_counter() - start
+            )
+        )
+
+        for table, sequence in SEQUENCES:
+            cursor.execute(
+                "SELECT setval('public.{}', (SELECT max(id) FROM public.{}))".format(
+                    sequence, table
+                )
+            )
+
+        cursor.execute("RESET max_parallel_workers_per_gather")
+
+        counts = {}
+
+        for table in ("artists", "works", "subreddits", "submissions"):
+            cursor.execute("SELECT count(*) FROM public.{}".format(table))
+            counts[table] = cursor.fetchone()[0]
+
+    con.commit()
+
+    # Fresh statistics, or the planner guesses from an empty table
+    con.autocommit = True
+    with con.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    con.autocommit = False
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("url", help="An empty errantbot database")
+    parser.add_argument("--scale", type=float, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    con = psycopg2.connect(args.url)
+
+    try:
+        print(generate(con, args.scale, args.seed))
+    finally:
+        con.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Disposable Postgres databases for the benchmarks."""
+import os
+from urllib.parse import urlparse
+
+import psycopg2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DSN = os.environ.get("BENCH_DSN", "postgresql://postgres@127.0.0.1:5432/postgres")
+
+
+def database_url(dsn, name):
+    """``dsn`` pointed at database ``name``."""
+    return urlparse(dsn)._replace(path="/" + name).geturl()
+
+
+def create_database(dsn, name, template=None):
+    """Create ``name`` through the admin connection ``dsn`` and load the schema.
+
+    Given a ``template``, the database is cloned from it instead, for servers
+    without pg_trgm or to start from a larger dataset. Returns its URL.
+
+    """
+    admin = psycopg2.connect(dsn)
+    admin.autocommit = True
+
+    with admin.cursor() as cursor:
+        cursor.execute(
+            "CREATE DATABASE {}{}".format(
+                name, " TEMPLATE {}".format(template) if template else ""
+            )
+        )
+
+    admin.close()
+
+    url = database_url(dsn, name)
+
+    if not template:
+        con = psycopg2.connect(url)
+        con.autocommit = True
+
+        with con.cursor() as cursor, open(os.path.join(ROOT, "schema.sql")) as schema:
+            cursor.execute(schema.read())
+
+        con.close()
+
+    return url
+
+
+def drop_database(dsn, name):
+    admin = psycopg2.connect(dsn)
+    admin.autocommit = True
+
+    with admin.cursor() as cursor:
+        cursor.execute("DROP DATABASE IF EXISTS {}".format(name))
+
+    admin.close()
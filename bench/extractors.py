@@ -0,0 +1,114 @@
+"""Extractor speed and correctness, replayed offline from a cassette.
+
+Record the pages to cover once, with the network:
+
+    python -m errantbot --record extractors.jsonl.gz extract URL
+
+then replay them as often as needed:
+
+    python bench/extractors.py extractors.jsonl.gz URL... [--runs N]
+           [--expected PATH] [--update]
+
+Each URL is extracted --runs times from the cassette and timed. The works
+extracted are compared with the ones saved in --expected, which is written on
+the first run or with --update; any difference fails the run, so a changed
+extractor can be checked against pages it used to handle. Pixiv isn't covered,
+since its client library doesn't go through errantbot's session.
+
+Run it where secrets.toml is, for the sites that need cookies.
+
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from errantbot import cassette, extract, net  # noqa: E402
+
+
+def extract_all(urls, runs):
+    """Time ``runs`` extractions of each URL; returns the works and timings."""
+    works = {}
+    timings = {}
+
+    for url in urls:
+        times = []
+
+        for _ in range(runs):
+            start = time.perf_counter()
+            work = extract.auto(url)
+            times.append((time.perf_counter() - start) * 1000)
+
+        # Through JSON, so tuples compare equal to the lists read back
+        works[url] = json.loads(json.dumps(work._asdict()))
+        timings[url] = (min(times), statistics.median(times))
+
+    return works, timings
+
+
+def expected_beside(cassette_path):
+    """``dir/name.expected.json`` for a cassette at ``dir/name.jsonl.gz``."""
+    directory, name = os.path.split(cassette_path)
+
+    while True:
+        name, extension = os.path.splitext(name)
+
+        if not extension:
+            return os.path.join(directory, name + ".expected.json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("cassette")
+    parser.add_argument("urls", nargs="+", metavar="url")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument(
+        "--expected", help="Works to compare with; defaults to beside the cassette"
+    )
+    parser.add_argument("--update", action="store_true", help="Save these works")
+    args = parser.parse_args()
+
+    expected_path = args.expected or expected_beside(args.cassette)
+
+    net.cassette = cassette.Cassette(args.cassette, replay=True)
+
+    works, timings = extract_all(args.urls, args.runs)
+
+    expected = {}
+    if os.path.exists(expected_path) and not args.update:
+        with open(expected_path) as expected_file:
+            expected = json.load(expected_file)
+
+    failed = False
+
+    print("{:<60} {:>9} {:>10}  {}".format("", "best ms", "median ms", "result"))
+
+    for url, (best, median) in timings.items():
+        if url not in expected:
+            result = "saved"
+        elif works[url] == expected[url]:
+            result = "ok"
+        else:
+            failed = True
+            result = "changed: " + ", ".join(
+                field
+                for field in works[url]
+                if works[url][field] != expected[url].get(field)
+            )
+
+        print("{:<60} {:>9.3f} {:>10.3f}  {}".format(url, best, median, result))
+
+    if not failed:
+        with open(expected_path, mode="w") as expected_file:
+            json.dump(dict(expected, **works), expected_file, indent=2)
+            expected_file.write("\n")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
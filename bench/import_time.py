@@ -0,0 +1,104 @@
+"""Startup import budget for the CLI.
+
+Runs ``python -X importtime -m errantbot ...`` for a few cheap invocations and
+fails if they import more than the budget allows, or load a heavy dependency
+they have no use for.
+
+Usage: python bench/import_time.py [--budget-ms N] [--runs N]
+
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Milliseconds of import time allowed on top of a bare interpreter
+BUDGET_MS = 60
+
+# Modules that must never be loaded just to parse argv or print help
+HEAVY = ("sqlalchemy", "praw", "prawcore", "psycopg2", "bs4", "tldextract", "tomlkit")
+
+INVOCATIONS = (
+    ("--help",),
+    ("extract", "--help"),
+    ("add", "--help"),
+    ("list-works", "--help"),
+)
+
+
+def top_level(args):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    proc = subprocess.run(
+        (sys.executable, "-X", "importtime") + args,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+
+    top = {}
+    loaded = set()
+
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or line.count("|") != 2:
+            continue
+
+        _, cumulative, name = line.split("|")
+
+        if not cumulative.strip().isdigit():
+            continue
+
+        loaded.add(name.strip())
+
+        # Top-level imports are indented by exactly one space after the bar
+        if not name[1:].startswith(" "):
+            top[name.strip()] = int(cumulative)
+
+    return top, loaded
+
+
+def measure(args, baseline, runs):
+    best = None
+    loaded = set()
+
+    for _ in range(runs):
+        top, loaded = top_level(("-m", "errantbot") + args)
+        total = sum(us for name, us in top.items() if name not in baseline)
+        best = total if best is None else min(best, total)
+
+    return best / 1000, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    baseline, _ = top_level(("-c", "pass"))
+
+    failed = False
+
+    for invocation in INVOCATIONS:
+        ms, loaded = measure(invocation, baseline, args.runs)
+        heavy = sorted(m for m in HEAVY if m in loaded)
+
+        status = "ok"
+        if ms > args.budget_ms:
+            status = "over budget"
+            failed = True
+        if heavy:
+            status = "loaded " + ", ".join(heavy)
+            failed = True
+
+        print(
+            "errantbot {:<20} {:>7.1f} ms  {}".format(" ".join(invocation), ms, status)
+        )
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
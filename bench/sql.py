@@ -0,0 +1,369 @@
+"""How the schema and errantbot's heaviest queries hold up as the data grows.
+
+For each scale, fills a disposable database with dataset.py and times:
+- post_submissions' pending query, for the first chunk and the whole backlog;
+- upload_to_imgur's selection, the same way;
+- list-srs --ready;
+- bulk inserts of works and of pending and posted submissions, which fire the
+  CHECK constraints and the count and last submission triggers;
+- each CHECK-constraint function, called over every row it guards.
+
+Each result is the best and median of several runs. Runs are appended to
+bench/results/sql.jsonl and compared with the last run at the same scale, so
+a change to the schema or a query can be measured before and after.
+
+Usage: python bench/sql.py [--dsn URL] [--template DB] [--scales 1,10,100]
+       [--repeat N] [--rows N] [--results PATH]
+
+--dsn is an admin connection, used to create and drop the databases.
+--template clones an empty errantbot database instead of loading schema.sql,
+for servers without pg_trgm.
+
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import psycopg2
+import sqlalchemy as sa
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import dataset  # noqa: E402
+import db  # noqa: E402
+
+sys.path.insert(0, db.ROOT)
+
+from errantbot import helper  # noqa: E402
+
+RESULTS = os.path.join(db.ROOT, "bench", "results", "sql.jsonl")
+
+CHUNK = " WHERE works.id > :after ORDER BY works.id LIMIT :size"
+
+# The queries retry-all and retry-all-uploads walk through
+POST_CANDIDATES, PENDING_POSTS = helper.pending_post_queries()
+PENDING_UPLOADS = sa.text(helper.PENDING_UPLOADS + CHUNK)
+
+# The query list-srs --ready builds
+READY_SUBREDDITS = sa.text(
+    """SELECT * FROM subreddits WHERE NOT disabled
+    AND (NOT space_out OR last_submission_on IS NULL
+        OR last_submission_on < now() AT TIME ZONE 'utc' - INTERVAL '1 hour' * :wait)
+    ORDER BY id"""
+)
+
+NEW_WORKS = sa.text(
+    """INSERT INTO works (title, source_url, source_image_url, imgur_id,
+        imgur_url, artist_id)
+    SELECT 'New ' || n, 'https://www.artstation.com/artwork/new' || n,
+        'https://cdn.artstation.com/new' || n || '.png',
+        'new' || n, 'https://i.imgur.com/new' || n || '.png',
+        (SELECT id FROM artists WHERE alias_of IS NULL ORDER BY id LIMIT 1)
+    FROM generate_series(1, :rows) AS n"""
+)
+
+# One submission per new work, to whichever subreddits they cycle through;
+# the tag and flair meet any subreddit's rules but requiring a series
+NEW_SUBMISSIONS = sa.text(
+    """INSERT INTO submissions (work_id, subreddit_id, custom_tag, flair_id,
+        reddit_id, submitted_on)
+    SELECT works.id, subreddits.id, 'tag', 'flair',
+        CASE WHEN :posted THEN 'new' || works.id END,
+        CASE WHEN :posted THEN now() AT TIME ZONE 'utc' END
+    FROM works INNER JOIN (SELECT id, row_number() OVER (ORDER BY id) - 1 AS n,
+            count(*) OVER () AS total
+        FROM subreddits WHERE NOT require_series) AS subreddits
+    ON subreddits.n = works.id % subreddits.total
+    WHERE works.id > (SELECT max(id) FROM works) - :rows"""
+)
+
+CHECKS = (
+    ("submissions", "check_require_flair(flair_id, subreddit_id)"),
+    ("submissions", "check_require_series(work_id, subreddit_id)"),
+    ("submissions", "check_require_tag(custom_tag, subreddit_id)"),
+    ("submissions", "check_sfw_only(work_id, subreddit_id)"),
+    ("works", "artist_not_alias(artist_id)"),
+)
+
+
+def query(conn, statement, **params):
+    def run():
+        return len(conn.execute(statement, **params).fetchall())
+
+    return run
+
+
+def walk(conn, statement, key):
+    """Every row of a backlog query, a chunk at a time as the CLI takes them."""
+
+    def run():
+        after = 0
+        total = 0
+
+        while True:
+            rows = conn.execute(
+                statement, after=after, size=helper.CHUNK_SIZE
+            ).fetchall()
+
+            if not rows:
+                return total
+
+            total += len(rows)
+            after = rows[-1][key]
+
+    return run
+
+
+def first_posts(conn):
+    def run():
+        ids = [
+            row["work_id"]
+            for row in conn.execute(POST_CANDIDATES, after=0, size=helper.CHUNK_SIZE)
+        ]
+
+        return len(conn.execute(PENDING_POSTS, ids=ids).fetchall())
+
+    return run
+
+
+def walk_posts(conn):
+    """The pending posts backlog, a chunk of work IDs at a time as retry-all does."""
+
+    def run():
+        after = 0
+        total = 0
+
+        while True:
+            ids = [
+                row["work_id"]
+                for row in conn.execute(
+                    POST_CANDIDATES, after=after, size=helper.CHUNK_SIZE
+                )
+            ]
+
+            if not ids:
+                return total
+
+            total += len(conn.execute(PENDING_POSTS, ids=ids).fetchall())
+            after = ids[-1]
+
+    return run
+
+
+def check(conn, table, call):
+    """Call a CHECK function over every row of ``table``."""
+    statement = sa.text("SELECT count(*) FROM {} WHERE {}".format(table, call))
+    rows = sa.text("SELECT count(*) FROM {}".format(table))
+
+    def run():
+        conn.execute(statement).scalar()
+        return conn.execute(rows).scalar()
+
+    return run
+
+
+def rolled_back(conn, statement, setup=None, **params):
+    """Run ``statement`` in a transaction that's then rolled back.
+
+    Returns how long the statement alone took, leaving out ``setup``.
+
+    """
+
+    def run():
+        transaction = conn.begin()
+
+        try:
+            if setup is not None:
+                conn.execute(setup, **params)
+
+            start = time.perf_counter()
+            count = conn.execute(statement, **params).rowcount
+
+            return count, time.perf_counter() - start
+        finally:
+            transaction.rollback()
+
+    run.timed = True
+
+    return run
+
+
+def benchmarks(conn, rows):
+    """(name, function) pairs; each function returns how many rows it saw."""
+    yield "pending posts, first chunk", first_posts(conn)
+    yield "pending posts, whole backlog", walk_posts(conn)
+    yield "pending uploads, first chunk", query(
+        conn, PENDING_UPLOADS, after=0, size=helper.CHUNK_SIZE
+    )
+    yield "pending uploads, whole backlog", walk(conn, PENDING_UPLOADS, "id")
+    yield "list-srs --ready", query(conn, READY_SUBREDDITS, wait=18)
+
+    yield "insert works", rolled_back(conn, NEW_WORKS, rows=rows)
+
+    for posted in (False, True):
+        yield "insert {} submissions".format(
+            "posted" if posted else "pending"
+        ), rolled_back(conn, NEW_SUBMISSIONS, NEW_WORKS, rows=rows, posted=posted)
+
+    for table, call in CHECKS:
+        yield call.split("(")[0], check(conn, table, call)
+
+
+def measure(function, repeat):
+    times = []
+
+    for _ in range(repeat):
+        if getattr(function, "timed", False):
+            count, seconds = function()
+        else:
+            start = time.perf_counter()
+            count = function()
+            seconds = time.perf_counter() - start
+
+        times.append(seconds * 1000)
+
+    return {
+        "rows": count,
+        "best_ms": round(min(times), 3),
+        "median_ms": round(statistics.median(times), 3),
+    }
+
+
+def run_scale(dsn, template, scale, repeat, rows):
+    name = "errantbot_sql_{}_{:g}".format(os.getpid(), scale).replace(".", "_")
+    url = db.create_database(dsn, name, template)
+
+    try:
+        con = psycopg2.connect(url)
+
+        try:
+            start = time.perf_counter()
+            counts = dataset.generate(con, scale, log=lambda line: None)
+            generated = time.perf_counter() - start
+        finally:
+            con.close()
+
+        print(
+            "Scale {:g}: {} ({:.1f}s to generate)".format(
+                scale,
+                ", ".join("{} {}".format(n, table) for table, n in counts.items()),
+                generated,
+            )
+        )
+
+        engine = sa.create_engine(url)
+
+        try:
+            with engine.connect() as conn:
+                results = {
+                    bench: measure(function, repeat)
+                    for bench, function in benchmarks(conn, rows)
+                }
+        finally:
+            engine.dispose()
+    finally:
+        db.drop_database(dsn, name)
+
+    return counts, results
+
+
+def previous_run(path, scale):
+    """The last recorded run at ``scale``, or None."""
+    last = None
+
+    if os.path.exists(path):
+        with open(path) as results:
+            for line in results:
+                run = json.loads(line)
+
+                if run["scale"] == scale:
+                    last = run
+
+    return last
+
+
+def commit():
+    result = subprocess.run(
+        ("git", "rev-parse", "--short", "HEAD"),
+        cwd=db.ROOT,
+        capture_output=True,
+        text=True,
+    )
+
+    return result.stdout.strip() or None
+
+
+def report(results, previous):
+    print(
+        "    {:<32} {:>9} {:>10} {:>10} {:>9}".format(
+            "", "rows", "best ms", "median ms", "change"
+        )
+    )
+
+    for bench, result in results.items():
+        before = previous and previous["results"].get(bench)
+        change = ""
+
+        if before and before["median_ms"]:
+            change = "{:+.0%}".format(result["median_ms"] / before["median_ms"] - 1)
+
+        print(
+            "    {:<32} {:>9} {:>10.2f} {:>10.2f} {:>9}".format(
+                bench, result["rows"], result["best_ms"], result["median_ms"], change
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--dsn", default=db.DSN)
+    parser.add_argument("--template")
+    parser.add_argument("--scales", default="1,10,100")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--rows", type=int, default=1000, help="Rows per insert")
+    parser.add_argument("--results", default=RESULTS)
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+
+    for scale in (float(scale) for scale in args.scales.split(",")):
+        counts, results = run_scale(
+            args.dsn, args.template, scale, args.repeat, args.rows
+        )
+
+        previous = previous_run(args.results, scale)
+
+        if previous:
+            print(
+                "    compared with {} at {}".format(
+                    previous["time"], previous["commit"] or "an unknown commit"
+                )
+            )
+
+        report(results, previous)
+
+        with open(args.results, mode="a") as results_file:
+            results_file.write(
+                json.dumps(
+                    {
+                        "time": datetime.now(timezone.utc).isoformat(
+                            timespec="seconds"
+                        ),
+                        "commit": commit(),
+                        "scale": scale,
+                        "counts": counts,
+                        "repeat": args.repeat,
+                        "results": results,
+                    }
+                )
+                + "\n"
+            )
+
+
+if __name__ == "__main__":
+    main()
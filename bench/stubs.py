@@ -0,0 +1,346 @@
+"""Local stand-ins for Reddit, Imgur and the art sites, for benchmarks.
+
+One HTTP server answers for every host, telling them apart by the Host header
+that errantbot's host remapping keeps. Only the endpoints errantbot calls are
+imitated, with just the fields it reads. Every response can be delayed, and a
+share of them replaced by 503s, to see how throughput holds up.
+
+Usage: python bench/stubs.py [--port N] [--latency-ms N] [--error-rate P]
+       [--host-latency HOST=MS ...]
+
+and run errantbot with ERRANTBOT_REMAP=*=http://127.0.0.1:PORT
+
+"""
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Hosts whose requests the stand-ins answer, by the site they belong to
+REDDIT = ("oauth.reddit.com", "www.reddit.com")
+IMGUR = ("api.imgur.com",)
+
+# What art pages the stand-ins serve look like, by extractor
+PAGES = {
+    "artstation": "https://www.artstation.com/artwork/{}",
+    "deviantart": "https://www.deviantart.com/bench/art/work-{}",
+    "hentai-foundry": "https://www.hentai-foundry.com/pictures/user/bench/{}/work",
+    "furaffinity": "https://www.furaffinity.net/view/{}/",
+}
+
+HENTAI_FOUNDRY = """<html><body><div id="page"><a href="/">Home</a>
+<a href="/user/bench">Artist {n}</a></div>
+<main><span class="titleSemantic">Work {n}</span></main>
+<div class="categoryBreadcrumbs"><a>Original</a></div>
+<div class="ratings_box"></div>
+<div id="picBox"><div class="boxbody">
+<img src="//pictures.hentai-foundry.com/b/bench/{n}.png"></div></div>
+</body></html>"""
+
+FURAFFINITY = """<html><body id="pageid-submission">
+<table class="maintable"><tr><td><table class="maintable"><tr>
+<td class="cat"><b>Work {n}</b> by <a href="/user/bench">Artist {n}</a></td>
+</tr></table></td></tr></table>
+<div class="stats-container"><img alt="General rating"></div>
+<a href="//d.furaffinity.net/art/bench/{n}.png">Download</a>
+</body></html>"""
+
+
+def json_response(data):
+    return 200, "application/json", json.dumps(data)
+
+
+class Stubs:
+    """The stand-ins' state: IDs handed out and requests answered."""
+
+    def __init__(self, latency=0.0, error_rate=0.0, host_latency=None, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.host_latency = host_latency or {}
+        self.random = random.Random(seed)
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.errors = Counter()
+
+    def next_id(self):
+        with self.lock:
+            return "{:x}".format(next(self.ids))
+
+    def handle(self, method, host, path, query, form):
+        """Return (status, content type, body) for a request."""
+        delay = self.host_latency.get(host, self.latency)
+        if delay:
+            time.sleep(delay)
+
+        with self.lock:
+            self.requests[host] += 1
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.errors[host] += 1
+
+        if failed:
+            return 503, "text/plain", "Injected failure"
+
+        if host in REDDIT:
+            return self.reddit(method, path, form)
+        if host in IMGUR:
+            return self.imgur(method, path, form)
+
+        return self.site(host, path, query)
+
+    def reddit(self, method, path, form):
+        if path == "/api/v1/access_token":
+            return json_response(
+                {
+                    "access_token": "bench-" + self.next_id(),
+                    "token_type": "bearer",
+                    "expires_in": 86400,
+                    "scope": "identity flair submit read edit modposts",
+                }
+            )
+
+        if path.startswith("/api/submit"):
+            post_id = self.next_id()
+            return json_response(
+                {
+                    "json": {
+                        "errors": [],
+                        "data": {
+                            "id": post_id,
+                            "name": "t3_" + post_id,
+                            "url": "https://www.reddit.com/comments/" + post_id,
+                        },
+                    }
+                }
+            )
+
+        match = re.match(r"/comments/(\w+)", path)
+        if match:
+            post_id = match[1]
+            post = {
+                "id": post_id,
+                "name": "t3_" + post_id,
+                "title": "Bench post",
+                "permalink": "/r/bench/comments/{}/bench_post/".format(post_id),
+                "created_utc": time.time(),
+                "score": 1,
+                "num_comments": 0,
+            }
+
+            return json_response(
+                [
+                    {
+                        "kind": "Listing",
+                        "data": {
+                            "children": [{"kind": "t3", "data": post}],
+                            "after": None,
+                            "before": None,
+                        },
+                    },
+                    {
+                        "kind": "Listing",
+                        "data": {"children": [], "after": None, "before": None},
+                    },
+                ]
+            )
+
+        if path.startswith("/api/comment"):
+            comment_id = self.next_id()
+            return json_response(
+                {
+                    "json": {
+                        "errors": [],
+                        "data": {
+                            "things": [
+                                {
+                                    "kind": "t1",
+                                    "data": {
+                                        "id": comment_id,
+                                        "name": "t1_" + comment_id,
+                                        "body": form.get("text", ""),
+                                        "parent_id": form.get("thing_id"),
+                                        "link_id": form.get("thing_id"),
+                                    },
+                                }
+                            ]
+                        },
+                    }
+                }
+            )
+
+        if re.match(r"/r/\w+/about", path):
+            return json_response(
+                {
+                    "kind": "t5",
+                    "data": {"display_name": "bench", "subreddit_type": "public"},
+                }
+            )
+
+        if method == "POST":
+            # marknsfw, del and the other actions that only acknowledge
+            return json_response({})
+
+        return 404, "text/plain", "Not imitated"
+
+    def imgur(self, method, path, form):
+        item_id = self.next_id()
+
+        if path == "/oauth2/token":
+            return json_response(
+                {
+                    "access_token": "bench-" + item_id,
+                    "refresh_token": "bench",
+                    "token_type": "bearer",
+                    "expires_in": 86400,
+                }
+            )
+        if path == "/3/album":
+            return json_response({"data": {"id": item_id}, "success": True})
+        if path == "/3/image":
+            return json_response(
+                {
+                    "data": {
+                        "id": item_id,
+                        "link": "https://i.imgur.com/{}.png".format(item_id),
+                    },
+                    "success": True,
+                }
+            )
+
+        return 404, "text/plain", "Not imitated"
+
+    def site(self, host, path, query):
+        match = re.search(r"(\d+)", path)
+        n = match[1] if match else "0"
+
+        if host.endswith("artstation.com"):
+            return json_response(
+                {
+                    "title": "Work " + n,
+                    "user": {"full_name": "Artist " + n},
+                    "adult_content": False,
+                    "assets": [
+                        {"image_url": "https://cdn.artstation.com/{}.png".format(n)}
+                    ],
+                }
+            )
+
+        if host == "backend.deviantart.com":
+            # Pages reach it in their fav.me form, the ID in base 36
+            n = str(int(query.get("url", [""])[0].rsplit("/d", 1)[1], 36))
+            return json_response(
+                {
+                    "title": "Work " + n,
+                    "author_name": "Artist " + n,
+                    "safety": "nonadult",
+                    "url": "https://images.wixmp.com/f/bench/{}.png".format(n),
+                }
+            )
+
+        if host.endswith("hentai-foundry.com"):
+            return 200, "text/html", HENTAI_FOUNDRY.format(n=n)
+
+        if host.endswith("furaffinity.net"):
+            return 200, "text/html", FURAFFINITY.format(n=n)
+
+        return 404, "text/plain", "Not imitated"
+
+
+def handler(stubs):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def respond(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length).decode("utf-8", "replace")
+
+            form = {}
+            if "x-www-form-urlencoded" in self.headers.get("Content-Type", ""):
+                form = {key: values[0] for key, values in parse_qs(body).items()}
+
+            parts = urlparse(self.path)
+            host = self.headers.get("Host", "").split(":")[0]
+
+            status, content_type, text = stubs.handle(
+                self.command, host, parts.path, parse_qs(parts.query), form
+            )
+
+            data = text.encode("utf-8")
+
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+
+            if host in IMGUR:
+                self.send_header("X-RateLimit-UserRemaining", "12500")
+                self.send_header("X-RateLimit-ClientRemaining", "12500")
+                self.send_header("X-Post-Rate-Limit-Remaining", "1250")
+
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_POST = do_DELETE = respond
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start(stubs, port=0):
+    """Serve ``stubs`` from a background thread; returns the server."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler(stubs))
+    server.daemon_threads = True
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def parse_host_latency(values):
+    latency = {}
+
+    for value in values:
+        host, ms = value.split("=", 1)
+        latency[host] = float(ms) / 1000
+
+    return latency
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--host-latency", action="append", default=[])
+    args = parser.parse_args()
+
+    stubs = Stubs(
+        args.latency_ms / 1000,
+        args.error_rate,
+        parse_host_latency(args.host_latency),
+    )
+    server = start(stubs, args.port)
+
+    print(
+        "Serving on port {}; run errantbot with "
+        "ERRANTBOT_REMAP=*=http://127.0.0.1:{}".format(
+            server.server_port, server.server_port
+        )
+    )
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""End-to-end throughput of the add, retry-all-uploads and retry-all flows.
+
+Runs the real CLI against a disposable Postgres database, with every outbound
+request sent to the stand-ins in stubs.py, and reports works per minute and
+per-stage latency from the CLI's own metrics. Pixiv isn't covered, since its
+client library doesn't go through errantbot's session.
+
+Usage: python bench/throughput.py [--dsn URL] [--template DB] [--works N]
+       [--latency-ms N] [--error-rate P] [--host-latency HOST=MS ...] [--keep]
+
+--dsn is an admin connection, used to create and drop the database. --template
+clones an existing database instead of loading schema.sql, for servers without
+pg_trgm or to start from a larger dataset.
+
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from urllib.parse import urlparse
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import db  # noqa: E402
+import stubs  # noqa: E402
+
+SUBREDDIT = "errantbot_bench"
+
+# Valid for a day, so the CLI never has to refresh
+TOKEN_LIFETIME = 86400
+
+BUCKET = re.compile(r'^errantbot_(\w+)_seconds_bucket\{(.*),le="([^"]+)"\} (\d+)$')
+LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+# Labels that split a stage too finely to be worth reporting separately
+IGNORED_LABELS = ("outcome", "subreddit")
+
+
+def add_subreddit(url):
+    con = psycopg2.connect(url)
+    con.autocommit = True
+
+    with con.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO public.subreddits (name, space_out) VALUES (%s, false)",
+            (SUBREDDIT,),
+        )
+
+    con.close()
+
+
+def write_config(directory, dsn, name):
+    """secrets.toml and fresh token files, so the CLI runs without prompting."""
+    parts = urlparse(dsn)
+
+    with open(os.path.join(directory, "secrets.toml"), mode="w") as secrets:
+        secrets.write(
+            """[database]
+user = "{user}"
+password = "{password}"
+host = "{host}"
+name = "{name}"
+
+[reddit]
+client_id = "bench"
+client_secret = "bench"
+
+[imgur]
+client_id = "bench"
+client_secret = "bench"
+
+[furaffinity]
+cookies = {{ a = "bench" }}
+""".format(
+                user=parts.username or "",
+                password=parts.password or "",
+                host=parts.netloc.rsplit("@", 1)[-1],
+                name=name,
+            )
+        )
+
+    expires_at = time.time() + TOKEN_LIFETIME
+
+    for service, token in (
+        ("reddit", {"refresh_token": "bench", "scope": "identity submit"}),
+        ("imgur", {"refresh_token": "bench", "token_type": "Bearer"}),
+    ):
+        token.update(access_token="bench", expires_at=expires_at)
+
+        with open(os.path.join(directory, service + "_token.json"), mode="w") as f:
+            json.dump(token, f)
+
+
+def run(directory, env, metrics, *args):
+    subprocess.run(
+        (sys.executable, "-m", "errantbot", "--metrics", metrics) + args,
+        cwd=directory,
+        env=env,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def ok(outcome):
+    """Whether an outcome label means success; HTTP ones are status codes."""
+    return outcome == "ok" or (outcome.isdigit() and int(outcome) < 400)
+
+
+def read_buckets(paths):
+    """Sum the histogram buckets of several Prometheus metric files."""
+    stages = defaultdict(lambda: defaultdict(int))
+    errors = defaultdict(int)
+
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+
+        with open(path) as metrics:
+            for line in metrics:
+                match = BUCKET.match(line.strip())
+
+                if not match:
+                    continue
+
+                name, labels, bound, count = match.groups()
+                labels = dict(LABEL.findall(labels))
+
+                stage = " ".join(
+                    [name]
+                    + [
+                        value
+                        for key, value in sorted(labels.items())
+                        if key not in IGNORED_LABELS
+                    ]
+                )
+
+                bound = float("inf") if bound == "+Inf" else float(bound)
+                stages[stage][bound] += int(count)
+
+                if bound == float("inf") and not ok(labels.get("outcome")):
+                    errors[stage] += int(count)
+
+    return stages, errors
+
+
+def quantile(buckets, q):
+    total = buckets[float("inf")]
+
+    for bound in sorted(buckets):
+        if buckets[bound] >= q * total:
+            return bound
+
+
+def report(flow, count, seconds, paths):
+    print(
+        "{:<20} {:>6} works in {:>7.2f}s  {:>8.1f} works/min".format(
+            flow, count, seconds, count / seconds * 60
+        )
+    )
+
+    stages, errors = read_buckets(paths)
+
+    for stage, buckets in sorted(stages.items()):
+        print(
+            "    {:<34} {:>6}x  p50 <= {:<6g} p95 <= {:<6g} {}".format(
+                stage,
+                buckets[float("inf")],
+                quantile(buckets, 0.5),
+                quantile(buckets, 0.95),
+                "({} not ok)".format(errors[stage]) if errors[stage] else "",
+            )
+        )
+
+
+def bench_add(directory, env, works):
+    sites = sorted(stubs.PAGES)
+    paths = []
+
+    start = time.perf_counter()
+
+    for n in range(works):
+        url = stubs.PAGES[sites[n % len(sites)]].format(n)
+        paths.append(os.path.join(directory, "add-{}.prom".format(n)))
+
+        run(directory, env, paths[-1], "add", url, SUBREDDIT, "--wait", "0")
+
+    report("add", works, time.perf_counter() - start, paths)
+
+
+def bench_retries(directory, env, works):
+    # Named apart from the works add made, so their image URLs don't clash
+    with open(os.path.join(directory, "works.csv"), mode="w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            ("title", "artist", "source_url", "source_image_url", "submissions")
+        )
+
+        for n in range(works):
+            writer.writerow(
+                (
+                    "Bulk {}".format(n),
+                    "Artist {}".format(n % 50),
+                    "https://www.artstation.com/artwork/bulk{}".format(n),
+                    "https://cdn.artstation.com/bulk{}.png".format(n),
+                    SUBREDDIT,
+                )
+            )
+
+    run(directory, env, os.path.join(directory, "import.prom"), "import", "works.csv")
+
+    for flow, args in (
+        ("retry-all-uploads", ("retry-all-uploads", "--restart")),
+        ("retry-all", ("retry-all", "--restart", "--wait", "0")),
+    ):
+        path = os.path.join(directory, flow + ".prom")
+
+        start = time.perf_counter()
+        run(directory, env, path, *args)
+
+        report(flow, works, time.perf_counter() - start, [path])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--dsn", default=db.DSN)
+    parser.add_argument("--template")
+    parser.add_argument("--works", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--host-latency", action="append", default=[])
+    parser.add_argument("--keep", action="store_true", help="Keep the database")
+    args = parser.parse_args()
+
+    name = "errantbot_bench_{}".format(os.getpid())
+
+    server = stubs.start(
+        stubs.Stubs(
+            args.latency_ms / 1000,
+            args.error_rate,
+            stubs.parse_host_latency(args.host_latency),
+            seed=0,
+        )
+    )
+
+    add_subreddit(db.create_database(args.dsn, name, args.template))
+
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            write_config(directory, args.dsn, name)
+
+            env = dict(
+                os.environ,
+                PYTHONPATH=db.ROOT,
+                ERRANTBOT_REMAP="*=http://127.0.0.1:{}".format(server.server_port),
+            )
+
+            print(
+                "{} works, {:g} ms latency, {:g} error rate".format(
+                    args.works, args.latency_ms, args.error_rate
+                )
+            )
+
+            bench_add(directory, env, args.works)
+            bench_retries(directory, env, args.works)
+    finally:
+        if args.keep:
+            print("Kept database", name)
+        else:
+            db.drop_database(args.dsn, name)
+
+
+if __name__ == "__main__":
+    main()
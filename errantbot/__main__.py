@@ -1,15 +1,31 @@
+import itertools
 import logging
 import warnings
 
 import click
-import validators as val
-from praw.models import Submission
-from sqlalchemy import sql
-from tabulate import tabulate
 
-from . import extract
-from . import helper as h
+from . import output
 from . import paramtypes as types
+from .lazy import lazy_import
+
+audit = lazy_import("errantbot.audit")
+bulk = lazy_import("errantbot.bulk")
+cassette = lazy_import("errantbot.cassette")
+extract = lazy_import("errantbot.extract")
+h = lazy_import("errantbot.helper")
+jobs = lazy_import("errantbot.jobs")
+metrics = lazy_import("errantbot.metrics")
+net = lazy_import("errantbot.net")
+pipeline = lazy_import("errantbot.pipeline")
+plan = lazy_import("errantbot.plan")
+praw = lazy_import("praw")
+profiling = lazy_import("errantbot.profiling")
+sa = lazy_import("sqlalchemy")
+search = lazy_import("errantbot.search")
+stats = lazy_import("errantbot.stats")
+sync = lazy_import("errantbot.sync")
+tabulate = lazy_import("tabulate")
+val = lazy_import("validators")
 
 
 class EBFormatter(logging.Formatter):
@@ -33,11 +49,64 @@ log = logging.getLogger("errantbot.cli")
 
 
 @click.group()
+@click.option(
+    "--metrics",
+    "metrics_file",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write metrics here on exit; Prometheus format for .prom, JSON otherwise",
+)
+@click.option("--metrics-port", type=int, help="Serve Prometheus metrics on this port")
+@click.option(
+    "--profile",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Save a cProfile of the command here and log where the time went",
+)
+@click.option(
+    "--slow-queries",
+    type=float,
+    metavar="MS",
+    help="Log statements taking at least this many milliseconds",
+)
+@click.option(
+    "--record",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Add every HTTP response to this cassette (gzipped JSON lines)",
+)
+@click.option(
+    "--replay",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Answer every HTTP request from this cassette, without the network",
+)
 @click.pass_context
-def cli(ctx):
+def cli(ctx, metrics_file, metrics_port, profile, slow_queries, record, replay):
     warnings.filterwarnings("ignore", r"Could not parse CHECK constraint text")
+    warnings.filterwarnings("ignore", r"Skipped unsupported reflection")
+    warnings.filterwarnings("ignore", r"Predicate of partial index")
+
+    if record and replay:
+        raise click.UsageError("--record and --replay can't be used together")
+
+    if record:
+        net.cassette = cassette.Cassette(record)
+        ctx.call_on_close(net.cassette.save)
+    if replay:
+        net.cassette = cassette.Cassette(replay, replay=True)
+
+    if profile:
+        ctx.with_resource(profiling.Profile(profile))
+    if slow_queries is not None:
+        profiling.slow_query = slow_queries / 1000
+
     ctx.obj = h.Connections()
 
+    if metrics_file or metrics_port:
+        metrics.enable()
+
+    if metrics_port:
+        metrics.serve(metrics_port)
+    if metrics_file:
+        ctx.call_on_close(lambda: metrics.write(metrics_file))
+
 
 @cli.command()
 @click.pass_obj
@@ -70,32 +139,105 @@ def add(
 ):
     submissions = h.Submissions(submissions)
 
+    old_id = h.find_work(con, source_url)
+
+    if old_id:
+        log.error("This page has already been added with ID %s", old_id)
+        return
+
     if add_sr:
         h.edit_subreddits(
             con, tuple(n_f_t.name for n_f_t in submissions.n_f_t), upsert=False
         )
 
     work = extract.auto(source_url, index=index, album=album, username=username)
+    images = h.probe_images(con, submissions, work.image_url)
+
+    with con.transaction():
+        work_id = h.save_work(
+            con,
+            title or work.title,
+            series or work.series,
+            (artist,) + work.artists if artist else work.artists,
+            work.source_url,
+            nsfw or work.nsfw,
+            work.image_url,
+        )
 
-    work_id = h.save_work(
-        con,
-        title or work.title,
-        series or work.series,
-        (artist,) + work.artists if artist else work.artists,
-        work.source_url,
-        nsfw or work.nsfw,
-        work.image_url,
-    )
+        if work_id:
+            h.add_submissions(con, work_id, submissions, images)
 
     if work_id:
-        h.add_submissions(con, work_id, submissions)
-
         h.upload_to_imgur(con, work_id)
 
         if not no_post:
             h.post_submissions(con, work_id, wait=wait)
 
 
+@cli.command("plan")
+@click.pass_obj
+@click.argument("names", nargs=-1, type=types.subreddit)
+@click.option("--wait", "-w", type=int, default=18)
+@click.option("--summary", "-S", is_flag=True, help="One row per subreddit")
+@click.option("--limit", "-l", type=int, help="Show at most this many rows")
+@click.option(
+    "--format", "-F", "fmt", type=click.Choice(output.FORMATS), default="table"
+)
+def _plan(con, names, wait, summary, limit, fmt):
+    planned = plan.plan(con, wait)
+
+    if names:
+        planned = (row for row in planned if row.subreddit in names)
+
+    if summary:
+        rows = plan.summarize(planned)
+        headers = ("subreddit", "pending", "first", "last")
+    else:
+        rows = planned
+        headers = plan.Planned._fields
+
+    output.write_rows(itertools.islice(rows, limit), headers, fmt)
+
+
+@cli.command("sync")
+@click.pass_obj
+@click.option("--limit", "-l", type=int, help="Sync at most this many submissions")
+@click.option("--all", "-a", "everything", is_flag=True, help="Include fresh ones")
+def _sync(con, limit, everything):
+    sync.sync(con, limit, everything)
+
+
+@cli.command("audit")
+@click.pass_obj
+@click.option("--limit", "-l", type=int, help="Check at most this many links")
+@click.option("--all", "-a", "everything", is_flag=True, help="Include recent checks")
+@click.option(
+    "--age", type=float, default=168, help="Hours before a link is checked again"
+)
+@click.option("--concurrency", "-c", type=int, default=64, help="Checks at once")
+@click.option("--per-host", type=int, default=8, help="Checks at once per host")
+def _audit(con, limit, everything, age, concurrency, per_host):
+    audit.audit(con, limit, everything, age, concurrency, per_host)
+
+
+@cli.command()
+@click.pass_obj
+@click.argument("file", type=click.File(), default="-")
+@click.option("--no-post", "-P", is_flag=True)
+@click.option("--wait", "-w", type=int, default=18)
+@click.option(
+    "--queue-size", "-q", type=int, default=4, help="Works waiting between steps"
+)
+def add_batch(con, file, no_post, wait, queue_size):
+    pipeline.add_batch(
+        con,
+        pipeline.read_lines(file),
+        post=not no_post,
+        wait=wait,
+        queue_size=queue_size,
+    )
+
+
 @cli.command()
 @click.pass_obj
 @click.argument("title", required=True)
@@ -120,12 +262,17 @@ def add_custom(
     wait,
 ):
     submissions = h.Submissions(submissions)
+    images = h.probe_images(con, submissions, source_image_url)
 
-    work_id = h.save_work(
-        con, title, series, (artist,), source_url, nsfw, source_image_url
-    )
+    with con.transaction():
+        work_id = h.save_work(
+            con, title, series, (artist,), source_url, nsfw, source_image_url
+        )
 
-    h.add_submissions(con, work_id, submissions)
+        if not work_id:
+            return
+
+        h.add_submissions(con, work_id, submissions, images)
 
     h.upload_to_imgur(con, work_id)
 
@@ -145,6 +292,12 @@ def add_custom(
 @click.option("--require-tag", "-t", is_flag=True)
 @click.option("--sfw-only", "-N", is_flag=True)
 @click.option("--tag-series", "-s", is_flag=True)
+@click.option("--min-width", type=int, help="Smallest image width in pixels")
+@click.option("--min-height", type=int, help="Smallest image height in pixels")
+@click.option("--min-aspect", type=float, help="Smallest width / height")
+@click.option("--max-aspect", type=float, help="Largest width / height")
+@click.option("--max-bytes", type=int, help="Largest image file size")
+@click.option("--account", "-A", help="Reddit account in secrets.toml that posts here")
 def sr(
     con,
     names,
@@ -157,6 +310,12 @@ def sr(
     sfw_only,
     no_space_out,
     tag_series,
+    min_width,
+    min_height,
+    min_aspect,
+    max_aspect,
+    max_bytes,
+    account,
 ):
     h.edit_subreddits(
         con,
@@ -170,6 +329,12 @@ def sr(
         sfw_only,
         not no_space_out,
         tag_series,
+        min_width=min_width,
+        min_height=min_height,
+        min_aspect=min_aspect,
+        max_aspect=max_aspect,
+        max_bytes=max_bytes,
+        account=account,
     )
 
 
@@ -228,16 +393,63 @@ def retry(con, work_ids, last, wait):
 @cli.command()
 @click.pass_obj
 @click.option("--wait", "-w", type=int, default=18)
-def retry_all(con, wait):
+@click.option(
+    "--restart", "-r", is_flag=True, help="Ignore the checkpoint of an earlier run"
+)
+def retry_all(con, wait, restart):
+    if restart:
+        h.clear_checkpoint(con, "retry-all")
+
     h.post_submissions(con, do_all=True, wait=wait)
 
 
 @cli.command()
 @click.pass_obj
-def retry_all_uploads(con, no_wait):
+@click.option(
+    "--restart", "-r", is_flag=True, help="Ignore the checkpoint of an earlier run"
+)
+def retry_all_uploads(con, restart):
+    if restart:
+        h.clear_checkpoint(con, "retry-all-uploads")
+
     h.upload_to_imgur(con, do_all=True)
 
 
+@cli.command()
+@click.pass_obj
+@click.argument("work-ids", type=int, nargs=-1)
+@click.option(
+    "--kind", "-k", type=click.Choice(jobs.KINDS), multiple=True, help="Default: all"
+)
+def enqueue(con, work_ids, kind):
+    jobs.enqueue(con, kind or jobs.KINDS, work_ids)
+
+
+@cli.command()
+@click.pass_obj
+@click.option(
+    "--kind", "-k", type=click.Choice(jobs.KINDS), multiple=True, help="Default: all"
+)
+@click.option("--wait", "-w", type=int, default=18)
+@click.option("--lease", type=int, default=300, help="Seconds a claimed job is held")
+@click.option("--poll", type=int, default=30, help="Seconds between empty polls")
+@click.option("--once", "-1", is_flag=True, help="Exit once no jobs are due")
+def worker(con, kind, wait, lease, poll, once):
+    jobs.work(con, kind or jobs.KINDS, lease=lease, wait=wait, poll=poll, once=once)
+
+
+@cli.command("jobs")
+@click.pass_obj
+@click.option("--failed", "-f", is_flag=True, help="Only jobs that gave up")
+@click.option(
+    "--format", "-F", "fmt", type=click.Choice(output.FORMATS), default="table"
+)
+def _jobs(con, failed, fmt):
+    result = jobs.list_jobs(con, failed)
+
+    output.write_rows(result, result.keys(), fmt)
+
+
 @cli.command()
 @click.pass_obj
 @click.argument("work-ids", type=int, nargs=-1)
@@ -262,7 +474,7 @@ def flairs(con, subreddit_name):
         columns = map(
             lambda flair: (flair["text"], flair["id"]), sub.flair.link_templates
         )
-        click.echo(tabulate(columns, headers=["Text", "ID"]))
+        click.echo(tabulate.tabulate(columns, headers=["Text", "ID"]))
 
 
 @cli.command("extract")
@@ -280,107 +492,205 @@ def _extract(url, index, album, username):
         click.echo("{}:\t{}".format(field, attr))
 
 
+@cli.command("import")
+@click.pass_obj
+@click.argument("file", type=click.File(encoding="utf-8"), required=True)
+@click.option("--format", "-f", "fmt", type=click.Choice(["csv", "jsonl"]))
+def _import(con, file, fmt):
+    if fmt is None:
+        fmt = "jsonl" if file.name.endswith((".jsonl", ".json")) else "csv"
+
+    records = bulk.read_jsonl(file) if fmt == "jsonl" else bulk.read_csv(file)
+
+    work_count, submission_count, problems = bulk.import_works(con, records)
+
+    log.info("Imported %s works and %s submissions", work_count, submission_count)
+
+    if problems:
+        log.warning("%s rows or submissions were skipped", len(problems))
+        click.echo(
+            tabulate.tabulate(problems, headers=["Line", "Subreddit", "Problem"])
+        )
+
+
+def output_options(command):
+    command = click.option("--limit", "-l", type=click.IntRange(min=0))(command)
+    command = click.option(
+        "--after", "-A", type=int, help="Only show rows with an ID above this"
+    )(command)
+    command = click.option(
+        "--format", "-F", "fmt", type=click.Choice(output.FORMATS), default="table"
+    )(command)
+
+    return command
+
+
+def stream(con, query):
+    """Execute a query on a server-side cursor, yielding rows as they arrive."""
+    return con.db.execution_options(stream_results=True).execute(query)
+
+
 @cli.command()
 @click.pass_obj
 @click.argument("names", nargs=-1, type=types.subreddit)
 @click.option("--ready/--not-ready", "-r/-R", default=None)
-def list_srs(con, names, ready):
+@click.option("--wait", "-w", type=int, default=18)
+@output_options
+def list_srs(con, names, ready, wait, limit, after, fmt):
     sr_table = con.meta.tables["subreddits"]
-    sub_table = con.meta.tables["submissions"]
 
-    query = (
-        sql.select(
-            sr_table.c
-            + [
-                sql.select([sql.func.count()])
-                .select_from(sub_table)
-                .where(sub_table.c.subreddit_id == sr_table.c.id)
-                .label("post_count")
-            ]
-        )
-        .select_from(sr_table)
-        .order_by("id")
-    )
+    query = sa.select(sr_table.c).order_by(sr_table.c.id).limit(limit)
 
     if len(names) > 0:
         query = query.where(sr_table.c.name.in_(names))
-    if ready is True:
-        query = query.where(
-            sr_table.c.last_submission_on
-            < sql.func.now() - sql.text("INTERVAL '1 day'")
-        )
-    if ready is False:
-        query = query.where(
-            sr_table.c.last_submission_on
-            > sql.func.now() - sql.text("INTERVAL '1 day'")
+    if after is not None:
+        query = query.where(sr_table.c.id > after)
+    if ready is not None:
+        # The same test do_post makes before submitting
+        since = sa.literal_column("now() AT TIME ZONE 'utc'") - sa.literal_column(
+            "INTERVAL '1 hour'"
+        ) * sa.bindparam("wait", wait)
+        is_ready = sa.and_(
+            sa.not_(sr_table.c.disabled),
+            sa.or_(
+                sa.not_(sr_table.c.space_out),
+                sr_table.c.last_submission_on.is_(None),
+                sr_table.c.last_submission_on < since,
+            ),
         )
 
-    result = con.db.execute(query)
+        query = query.where(is_ready if ready else sa.not_(is_ready))
+
+    result = stream(con, query)
 
-    click.echo(tabulate(result.fetchall(), headers=result.keys()))
+    output.write_rows(result, result.keys(), fmt)
 
 
 @cli.command()
 @click.pass_obj
-def list_works(con):
-    query = sql.text(
-        """SELECT title, artists.name as artist, series, imgur_url, source_url
-        FROM works INNER JOIN artists ON artist_id = artists.id"""
+@click.option("--artist", "-a", help="Artist name or alias")
+@click.option("--series", "-s")
+@click.option("--nsfw/--sfw", "-n/-N", default=None)
+@click.option("--uploaded/--not-uploaded", "-u/-U", default=None)
+@output_options
+def list_works(con, artist, series, nsfw, uploaded, limit, after, fmt):
+    works = con.meta.tables["works"]
+    artists = con.meta.tables["artists"]
+
+    query = (
+        sa.select(
+            [
+                works.c.id,
+                works.c.title,
+                artists.c.name.label("artist"),
+                works.c.series,
+                works.c.imgur_url,
+                works.c.source_url,
+            ]
+        )
+        .select_from(works.join(artists, works.c.artist_id == artists.c.id))
+        .order_by(works.c.id)
+        .limit(limit)
     )
 
-    result = con.db.execute(query)
+    if artist is not None:
+        aliases = sa.select([artists.c.alias_of]).where(artists.c.name == artist)
+        query = query.where(sa.or_(artists.c.name == artist, artists.c.id.in_(aliases)))
+    if series is not None:
+        query = query.where(works.c.series == series)
+    if nsfw is not None:
+        query = query.where(works.c.nsfw == nsfw)
+    if uploaded is True:
+        query = query.where(works.c.imgur_url.isnot(None))
+    if uploaded is False:
+        query = query.where(works.c.imgur_url.is_(None))
+    if after is not None:
+        query = query.where(works.c.id > after)
 
-    click.echo(tabulate(result.fetchall(), headers=result.keys()))
+    result = stream(con, query)
 
+    output.write_rows(result, result.keys(), fmt)
 
-@cli.command()
+
+@cli.command("search")
 @click.pass_obj
-@click.option("--reddit-id", "-r", "id_type", flag_value="reddit", default=True)
-@click.option("--submission-id", "-s", "id_type", flag_value="submission")
-@click.option("--from-reddit", "-r", is_flag=True)
-@click.argument("post-id", type=int)
-def delete_post(con, id_type, from_reddit, post_id):
-    submissions = con.meta.tables["submissions"]
+@click.argument("query", required=True)
+@click.option("--limit", "-l", type=click.IntRange(min=1), default=20)
+@click.option("--threshold", "-t", type=click.FloatRange(0, 1))
+@click.option(
+    "--format", "-F", "fmt", type=click.Choice(output.FORMATS), default="table"
+)
+def _search(con, query, limit, threshold, fmt):
+    headers, rows = search.search(con, query, limit, threshold)
 
-    use_reddit = id_type == "submission"
+    if not rows:
+        log.info("No works match '%s'", query)
+        return
 
-    if not use_reddit:
-        submission_id = post_id
+    output.write_rows(rows, headers, fmt)
 
-        query = sql.select([submissions.c.reddit_id]).where(
-            submissions.c.id == submission_id
-        )
-        row = con.db.execute(query).first()
 
-        if row is None:
-            log.error("Submission %s does not exist", submission_id)
-            return
+@cli.command("stats")
+@click.pass_obj
+@click.option("--artists", "-a", "top_artists", type=int, help="Show the top N artists")
+@click.option("--backfill", "-b", is_flag=True)
+@click.option("--check", "-c", is_flag=True)
+@click.option("--wait", "-w", type=int, default=18)
+@click.option(
+    "--format", "-F", "fmt", type=click.Choice(output.FORMATS), default="table"
+)
+def _stats(con, top_artists, backfill, check, wait, fmt):
+    if backfill:
+        stats.backfill(con)
+
+    if check:
+        drift = stats.check(con)
+
+        if drift:
+            log.warning("%s counters are inconsistent; run with --backfill", len(drift))
+            output.write_rows(
+                drift, ["Kind", "Name", "Counter", "Stored", "Actual"], fmt
+            )
+        else:
+            log.info("All counters are consistent")
 
-        reddit_id = row["reddit_id"]
-    else:
-        reddit_id = post_id
+        return
 
-        if val.url(reddit_id):
-            reddit_id = Submission.id_from_url(reddit_id)
+    if top_artists:
+        result = stats.artists(con, top_artists)
+    else:
+        result = stats.subreddits(con, wait)
 
-    if from_reddit and reddit_id:
-        sub = con.reddit.submission(reddit_id)
+    output.write_rows(result, result.keys(), fmt)
 
-        sub.delete()
 
-        sub.comments.replace_more(limit=None)
+@cli.command()
+@click.pass_obj
+def canonicalize(con):
+    log.info("Canonicalized %s source URLs", h.canonicalize_works(con))
 
-        for comment in sub.comments.list():
-            if comment.author == con.reddit.user.me():
-                comment.delete()
 
-    query = submissions.update().values(reddit_id=None, submitted_on=None)
-    if use_reddit:
-        query = query.where(submissions.c.reddit_id == reddit_id)
+@cli.command()
+@click.pass_obj
+@click.option("--reddit-id", "-r", "id_type", flag_value="reddit", default=True)
+@click.option("--submission-id", "-s", "id_type", flag_value="submission")
+@click.option("--from-reddit", "-R", is_flag=True)
+@click.argument("post-ids", nargs=-1, required=True)
+def delete_post(con, id_type, from_reddit, post_ids):
+    if id_type == "submission":
+        try:
+            submission_ids = tuple(map(int, post_ids))
+        except ValueError:
+            raise click.BadParameter("submission IDs must be numbers")
+
+        h.delete_posts(con, submission_ids=submission_ids, from_reddit=from_reddit)
     else:
-        query = query.where(submissions.c.id == submission_id)
+        reddit_ids = tuple(
+            praw.models.Submission.id_from_url(post_id) if val.url(post_id) else post_id
+            for post_id in post_ids
+        )
 
-    con.db.execute(query)
+        h.delete_posts(con, reddit_ids=reddit_ids, from_reddit=from_reddit)
 
 
 @cli.command()
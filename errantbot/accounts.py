@@ -0,0 +1,168 @@
+import logging
+import threading
+import time
+from functools import partial
+
+from . import net
+from .lazy import lazy_import
+
+apis = lazy_import("errantbot.apis")
+
+log = logging.getLogger(__name__)
+
+# Credits Imgur charges for one upload, against both the user and client budgets
+UPLOAD_COST = 10
+
+# Seconds an account that ran dry is set aside when Imgur doesn't say
+DEFAULT_RESET = 3600
+
+
+class OutOfBudget(net.CircuitOpen):
+    def __init__(self, until):
+        super().__init__("api.imgur.com", until)
+
+        self.args = (
+            "Every Imgur account is out of uploads for another {:.0f}s".format(
+                until - time.time()
+            ),
+        )
+
+
+def credentials(secrets, service):
+    """Map account names to a service's credentials from secrets.toml.
+
+    The service's own table is the default account, named None. Each table
+    under its ``accounts`` adds another, taking any keys it leaves out from the
+    default, so accounts authorised through the same app only need a name.
+
+    """
+    default = dict(secrets[service])
+    others = default.pop("accounts", {})
+
+    found = {None: default}
+
+    for name, values in others.items():
+        found[name] = dict(default, **values)
+
+    return found
+
+
+def token_file(service, account=None):
+    if account is None:
+        return "{}_token.json".format(service)
+
+    return "{}_token.{}.json".format(service, account)
+
+
+def uploads_left(response):
+    """How many more uploads an Imgur response's rate limit headers allow."""
+    left = []
+
+    for header, cost in (
+        ("X-RateLimit-UserRemaining", UPLOAD_COST),
+        ("X-RateLimit-ClientRemaining", UPLOAD_COST),
+        ("X-Post-Rate-Limit-Remaining", 1),
+    ):
+        try:
+            left.append(int(response.headers[header]) // cost)
+        except (KeyError, ValueError):
+            pass
+
+    return min(left) if left else None
+
+
+def reset_at(response):
+    """When an account that ran dry can upload again, as a timestamp."""
+    resets = []
+
+    try:
+        resets.append(int(response.headers["X-RateLimit-UserReset"]))
+    except (KeyError, ValueError):
+        pass
+
+    try:
+        resets.append(time.time() + int(response.headers["X-Post-Rate-Limit-Reset"]))
+    except (KeyError, ValueError):
+        pass
+
+    return max(resets) if resets else time.time() + DEFAULT_RESET
+
+
+class ImgurPool:
+    """Imgur clients for every configured account, picked by uploads left.
+
+    Budgets are learnt from the rate limit headers of each account's responses;
+    an account that hasn't answered yet is tried first, so every account gets
+    measured.
+
+    """
+
+    def __init__(self, secrets):
+        self.clients = {
+            name: apis.Imgur(
+                values["client_id"],
+                values["client_secret"],
+                token_file("imgur", name),
+            )
+            for name, values in credentials(secrets, "imgur").items()
+        }
+
+        self.left = dict.fromkeys(self.clients)
+        self.until = dict.fromkeys(self.clients, 0)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.clients)
+
+    def authenticate(self):
+        for name, client in self.clients.items():
+            client.authenticate()
+            client.session.hooks["response"].append(partial(self.update, name))
+
+    def update(self, name, response, *args, **kwargs):
+        left = uploads_left(response)
+
+        if left is None:
+            return
+
+        with self.lock:
+            self.left[name] = left
+
+            if left == 0:
+                self.until[name] = reset_at(response)
+
+                log.warning(
+                    "Imgur account %s is out of uploads for %.0fs",
+                    name or "default",
+                    self.until[name] - time.time(),
+                )
+
+    def pick(self):
+        """Return the client with the most uploads left, reserving one of them.
+
+        Raises OutOfBudget when every account has run dry.
+
+        """
+        with self.lock:
+            now = time.time()
+
+            for name, until in self.until.items():
+                if self.left[name] == 0 and until <= now:
+                    self.left[name] = None
+
+            ready = [name for name, left in self.left.items() if left != 0]
+
+            if not ready:
+                raise OutOfBudget(min(self.until.values()))
+
+            name = max(
+                ready,
+                key=lambda n: float("inf") if self.left[n] is None else self.left[n],
+            )
+
+            # Spreads concurrent uploads until the headers say otherwise; the
+            # last upload is left for a response to account for
+            if self.left[name] is not None and self.left[name] > 1:
+                self.left[name] -= 1
+
+        return self.clients[name]
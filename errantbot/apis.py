@@ -1,13 +1,15 @@
-import json
-import os
 import secrets
 import socket
 from urllib.parse import quote, urlparse
 
 import click
 
-import praw
-from requests_oauthlib import OAuth2Session
+from .lazy import lazy_import
+
+credentials = lazy_import("errantbot.credentials")
+net = lazy_import("errantbot.net")
+praw = lazy_import("praw")
+requests_oauthlib = lazy_import("requests_oauthlib")
 
 
 def receive_connection():
@@ -32,22 +34,21 @@ def send_message(client, message):
 
 
 class Reddit:
-    def __init__(self, secrets):
+    def __init__(self, secrets, token_file="reddit_token.json"):
         self.secrets = secrets
+        self.token_file = token_file
 
     def authenticate(self):
-        token = None
-
-        if os.path.isfile("reddit_token.json"):
-            with open("reddit_token.json") as token_file:
-                token = json.load(token_file)["refresh_token"]
+        store = credentials.TokenStore(self.token_file)
+        token = store.load()
 
         self.reddit = praw.Reddit(
             client_id=self.secrets["client_id"],
             client_secret=self.secrets["client_secret"],
             redirect_uri="http://localhost:8080",
-            refresh_token=token,
+            refresh_token=token and token["refresh_token"],
             user_agent="ErrantBot",
+            requestor_kwargs={"session": net.session()},
         )
 
         if not token:
@@ -77,13 +78,12 @@ class Reddit:
                     "Error authenticating with Reddit: " + params["error"]
                 )
 
-            refresh_token = self.reddit.auth.authorize(params["code"])
-
-            with open("reddit_token.json", mode="w") as token_file:
-                json.dump({"refresh_token": refresh_token}, token_file)
+            self.reddit.auth.authorize(params["code"])
 
             send_message(client, "ErrantBot's authenticated!")
 
+        credentials.share_reddit_token(self.reddit, store, token)
+
         return self.reddit
 
 
@@ -92,18 +92,17 @@ class Imgur:
     token_url = "https://api.imgur.com/oauth2/token"
     refresh_url = "https://api.imgur.com/oauth2/token"
 
-    def __init__(self, client_id, client_secret):
+    def __init__(self, client_id, client_secret, token_file="imgur_token.json"):
         self.client_id = client_id
         self.client_secret = client_secret
+        self.token_file = token_file
 
     def authenticate(self):
-        token = None
+        store = credentials.TokenStore(self.token_file)
+        token = store.load()
 
-        if os.path.isfile("imgur_token.json"):
-            with open("imgur_token.json") as token_file:
-                token = json.load(token_file)
-        else:
-            initial_session = OAuth2Session(self.client_id)
+        if token is None:
+            initial_session = requests_oauthlib.OAuth2Session(self.client_id)
 
             new_auth_url, state = initial_session.authorization_url(self.auth_url)
 
@@ -117,21 +116,20 @@ class Imgur:
                 authorization_response=callback_url,
             )
 
-            Imgur.token_saver(token)
+            store.save(token)
 
         client_data = {"client_id": self.client_id, "client_secret": self.client_secret}
 
-        self.session = OAuth2Session(
+        self.session = requests_oauthlib.OAuth2Session(
             self.client_id,
             token=token,
             auto_refresh_url=self.refresh_url,
             auto_refresh_kwargs=client_data,
-            token_updater=self.token_saver,
         )
 
-    def token_saver(token):
-        with open("imgur_token.json", mode="w") as token_file:
-            json.dump(token, token_file)
+        credentials.share_oauth2_token(self.session, store)
+
+        net.mount(self.session)
 
     def upload_url(self, url, title=None, description=None, album_id=None):
         # Quote for Unicode in path
@@ -0,0 +1,311 @@
+import logging
+import queue
+import threading
+import time
+from collections import Counter, deque, namedtuple
+from urllib.parse import urlparse
+
+from .lazy import lazy_import
+
+jobs = lazy_import("errantbot.jobs")
+metrics = lazy_import("errantbot.metrics")
+net = lazy_import("errantbot.net")
+requests = lazy_import("requests")
+sa = lazy_import("sqlalchemy")
+
+log = logging.getLogger(__name__)
+
+Link = namedtuple("Link", ["work_id", "kind", "url", "etag", "last_modified"])
+Check = namedtuple(
+    "Check", ["link", "status", "healthy", "error", "etag", "last_modified"]
+)
+
+# Checks in flight at once, overall and against any one host
+CONCURRENCY = 64
+PER_HOST = 8
+
+# Connect and read timeouts; a HEAD has nothing to download
+TIMEOUT = (5, 15)
+
+# Checks saved per statement
+BATCH_SIZE = 500
+
+# Seconds between progress messages
+PROGRESS_INTERVAL = 10
+
+# Statuses that mean the file is gone for good; anything else above 400 may
+# be passing, so the link's health is left unknown
+GONE = frozenset((404, 410))
+
+# Where Imgur redirects requests for images it has removed
+IMGUR_REMOVED = "/removed.png"
+
+# Every stored link once, with the validators of its last check. Links whose
+# health couldn't be told are due again straight away
+LINKS = """SELECT links.work_id, links.kind, links.url, etag, last_modified
+    FROM (SELECT id AS work_id, 'imgur' AS kind, imgur_url AS url FROM works
+            WHERE imgur_url IS NOT NULL
+        UNION SELECT id, 'source', source_image_url FROM works
+            WHERE source_image_url IS NOT NULL
+        UNION SELECT id, 'source', unnest(source_image_urls) FROM works
+            WHERE source_image_urls IS NOT NULL) AS links
+    LEFT JOIN link_checks ON link_checks.work_id = links.work_id
+        AND link_checks.url = links.url
+    WHERE :everything OR healthy IS NULL
+        OR checked_on < now() AT TIME ZONE 'utc' - INTERVAL '1 hour' * :age
+    ORDER BY links.work_id LIMIT :limit"""
+
+SAVE = """INSERT INTO link_checks (work_id, url, kind, status, healthy, error,
+        etag, last_modified, checked_on)
+    SELECT *, now() AT TIME ZONE 'utc' FROM unnest(CAST(:work_ids AS integer[]),
+        CAST(:urls AS varchar[]), CAST(:kinds AS varchar[]),
+        CAST(:statuses AS integer[]), CAST(:healthy AS boolean[]),
+        CAST(:errors AS varchar[]), CAST(:etags AS varchar[]),
+        CAST(:last_modified AS varchar[]))
+    ON CONFLICT (work_id, url) DO UPDATE SET kind = excluded.kind,
+        status = excluded.status, healthy = excluded.healthy,
+        error = excluded.error,
+        etag = COALESCE(excluded.etag, link_checks.etag),
+        last_modified = COALESCE(excluded.last_modified, link_checks.last_modified),
+        checked_on = excluded.checked_on"""
+
+# Only while the work still has the upload that was checked
+FORGET_UPLOADS = """UPDATE works SET imgur_id = NULL, imgur_url = NULL
+    FROM unnest(CAST(:work_ids AS integer[]), CAST(:urls AS varchar[]))
+        AS dead(work_id, url)
+    WHERE works.id = dead.work_id AND works.imgur_url = dead.url
+    RETURNING works.id"""
+
+
+class Scheduler:
+    """Hands out links round-robin by host, never more than ``per_host`` at once.
+
+    A host with many links can't hold up the others, and a worker only waits
+    when every host with links left is at its limit.
+
+    """
+
+    def __init__(self, links, per_host):
+        self.per_host = per_host
+        self.pending = {}
+        self.active = Counter()
+        self.condition = threading.Condition()
+
+        for link in links:
+            self.pending.setdefault(urlparse(link.url).hostname, deque()).append(link)
+
+        self.hosts = deque(self.pending)
+
+    def take(self):
+        """The next (host, link) to check, or None once all are handed out."""
+        with self.condition:
+            while self.hosts:
+                for _ in range(len(self.hosts)):
+                    host = self.hosts[0]
+                    self.hosts.rotate(-1)
+
+                    if self.active[host] >= self.per_host:
+                        continue
+
+                    link = self.pending[host].popleft()
+
+                    if not self.pending[host]:
+                        # Just rotated to the end
+                        self.hosts.pop()
+                        del self.pending[host]
+
+                    self.active[host] += 1
+
+                    return host, link
+
+                self.condition.wait()
+
+            return None
+
+    def done(self, host):
+        with self.condition:
+            self.active[host] -= 1
+            self.condition.notify()
+
+
+def check(session, link):
+    """HEAD a link, conditionally on what its last check saw."""
+    headers = {}
+    if link.etag:
+        headers["If-None-Match"] = link.etag
+    if link.last_modified:
+        headers["If-Modified-Since"] = link.last_modified
+
+    try:
+        response = session.head(
+            link.url, headers=headers, timeout=TIMEOUT, allow_redirects=True
+        )
+
+        if response.status_code == 405:
+            # Servers that don't take HEAD; the body is never read
+            with session.get(
+                link.url, headers=headers, timeout=TIMEOUT, stream=True
+            ) as response:
+                pass
+    except requests.exceptions.RequestException as e:
+        return Check(link, None, None, str(e), None, None)
+
+    status = response.status_code
+
+    if status in GONE or (
+        link.kind == "imgur" and urlparse(response.url).path == IMGUR_REMOVED
+    ):
+        healthy = False
+    elif status < 400:
+        healthy = True
+    else:
+        healthy = None
+
+    return Check(
+        link,
+        status,
+        healthy,
+        None if healthy is not None else response.reason,
+        response.headers.get("ETag"),
+        response.headers.get("Last-Modified"),
+    )
+
+
+def run_checks(links, concurrency, per_host):
+    """Check ``links`` from a pool of threads, yielding Checks as they finish."""
+    scheduler = Scheduler(links, per_host)
+    results = queue.Queue()
+
+    session = net.mount(
+        requests.Session(),
+        pool_connections=max(len(scheduler.hosts), 1),
+        pool_maxsize=per_host,
+    )
+
+    def work():
+        while True:
+            taken = scheduler.take()
+
+            if taken is None:
+                return
+
+            host, link = taken
+
+            try:
+                results.put(check(session, link))
+            except Exception as e:
+                results.put(Check(link, None, None, str(e), None, None))
+            finally:
+                scheduler.done(host)
+
+    for n in range(min(concurrency, len(links))):
+        threading.Thread(target=work, name="audit-{}".format(n), daemon=True).start()
+
+    for _ in links:
+        yield results.get()
+
+
+def save(con, checks):
+    """Record a batch of checks and forget the uploads found dead.
+
+    Returns the IDs of the works whose uploads were forgotten.
+
+    """
+    with con.transaction() as connection:
+        connection.execute(
+            sa.text(SAVE),
+            work_ids=[c.link.work_id for c in checks],
+            urls=[c.link.url for c in checks],
+            kinds=[c.link.kind for c in checks],
+            statuses=[c.status for c in checks],
+            healthy=[c.healthy for c in checks],
+            errors=[c.error for c in checks],
+            etags=[c.etag for c in checks],
+            last_modified=[c.last_modified for c in checks],
+        )
+
+        dead = [c.link for c in checks if c.link.kind == "imgur" and c.healthy is False]
+
+        if not dead:
+            return []
+
+        return [
+            row["id"]
+            for row in connection.execute(
+                sa.text(FORGET_UPLOADS),
+                work_ids=[link.work_id for link in dead],
+                urls=[link.url for link in dead],
+            )
+        ]
+
+
+def audit(
+    con,
+    limit=None,
+    everything=False,
+    age=168,
+    concurrency=CONCURRENCY,
+    per_host=PER_HOST,
+):
+    """Check stored Imgur and source image links, recording their health.
+
+    Links checked in the last ``age`` hours are skipped unless
+    ``everything``. Works whose Imgur upload is gone have it forgotten and are
+    queued for a fresh upload. Returns a Counter of results.
+
+    """
+    links = [
+        Link(*row)
+        for row in con.db.execute(
+            sa.text(LINKS), everything=everything, age=age, limit=limit
+        )
+    ]
+
+    if not links:
+        log.info("No links are due for a check")
+        return Counter()
+
+    log.info("Checking %s links", len(links))
+
+    results = Counter()
+    batch = []
+    reupload = []
+    reported = time.monotonic()
+
+    for n, result in enumerate(run_checks(links, concurrency, per_host), start=1):
+        outcome = {True: "healthy", False: "dead", None: "unknown"}[result.healthy]
+
+        results[outcome] += 1
+        metrics.inc("links", kind=result.link.kind, result=outcome)
+
+        if result.healthy is False:
+            log.warning(
+                "Work %s: %s is gone (%s)",
+                result.link.work_id,
+                result.link.url,
+                result.status,
+            )
+
+        batch.append(result)
+
+        if len(batch) >= BATCH_SIZE or n == len(links):
+            reupload += save(con, batch)
+            batch = []
+
+        if time.monotonic() - reported >= PROGRESS_INTERVAL:
+            log.info("Checked %s of %s links", n, len(links))
+            reported = time.monotonic()
+
+    if reupload:
+        jobs.enqueue(con, ("upload",), reupload)
+
+    log.info(
+        "Checked %s links: %s healthy, %s dead, %s unknown; %s uploads to redo",
+        len(links),
+        results["healthy"],
+        results["dead"],
+        results["unknown"],
+        len(reupload),
+    )
+
+    return results
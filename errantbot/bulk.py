@@ -0,0 +1,365 @@
+import csv
+import io
+import json
+import logging
+from collections import namedtuple
+
+from . import paramtypes as types
+from .lazy import lazy_import
+
+canonical = lazy_import("errantbot.canonical")
+h = lazy_import("errantbot.helper")
+rules = lazy_import("errantbot.rules")
+sa = lazy_import("sqlalchemy")
+
+log = logging.getLogger(__name__)
+
+Problem = namedtuple("Problem", ["line", "subreddit", "problem"])
+
+COLUMNS = (
+    "line",
+    "title",
+    "artist",
+    "series",
+    "nsfw",
+    "source_url",
+    "source_image_url",
+    "source_image_urls",
+    "subreddit_ids",
+    "flair_ids",
+    "custom_tags",
+)
+
+REQUIRED = ("title", "artist", "source_url", "source_image_url")
+
+TRUE = ("1", "t", "true", "y", "yes", "nsfw")
+
+
+class ChunkReader:
+    """Minimal file object over an iterator of strings, for COPY FROM STDIN."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ""
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+
+        if size < 0:
+            size = len(self.buffer)
+
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+
+        return data
+
+
+def parse_specifier(value):
+    """Split 'name@flair_id+tag' without contacting Reddit.
+
+    Flair text can't be looked up offline, so only flair IDs are accepted.
+
+    """
+    name = types.Subreddit.process(
+        types.compiled(types.Submission.find_name).search(value)[0]
+    )
+    if not name:
+        raise ValueError("'{}' is not a valid subreddit specifier".format(value))
+
+    flair_id = types.compiled(types.Submission.find_flair_id).search(value)
+    if flair_id:
+        flair_id = types.FlairID.process(flair_id[1])
+        if not flair_id:
+            raise ValueError("'{}' does not contain a valid flair ID".format(value))
+
+    tag = types.compiled(types.Submission.find_tag).search(value)
+
+    return name, flair_id or None, tag[1] if tag else None
+
+
+def as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return value.split()
+    return list(value)
+
+
+def read_csv(stream):
+    """Read works from a CSV file with a header row.
+
+    Columns are title, artist, series, nsfw, source_url, source_image_url and
+    submissions. Several space-separated image URLs make an album, and
+    submissions are space-separated specifiers like ``name@flair_id+tag``.
+
+    """
+    reader = csv.DictReader(stream)
+
+    for record in reader:
+        yield reader.line_num, record
+
+
+def read_jsonl(stream):
+    """Read works from JSON lines with the same keys as read_csv's columns.
+
+    ``artist``, ``source_image_url`` and ``submissions`` may also be lists. A
+    line that isn't valid JSON is passed on as the ValueError it raised, for
+    normalize to report.
+
+    """
+    for line, text in enumerate(stream, start=1):
+        if text.strip():
+            try:
+                yield line, json.loads(text)
+            except ValueError as e:
+                yield line, e
+
+
+def normalize(line, record, sr_rules, problems):
+    """Turn one input record into a staging row, or None if it's unusable.
+
+    Submissions are checked against ``sr_rules`` here, so only those that will
+    pass reach the staging table.
+
+    """
+    if isinstance(record, ValueError):
+        problems.append(Problem(line, None, "invalid JSON: {}".format(record)))
+        return None
+
+    if not isinstance(record, dict):
+        problems.append(Problem(line, None, "not a JSON object"))
+        return None
+
+    record = {k: v if v != "" else None for k, v in record.items()}
+
+    missing = [field for field in REQUIRED if not record.get(field)]
+    if missing:
+        problems.append(Problem(line, None, "missing " + ", ".join(missing)))
+        return None
+
+    artist = record["artist"]
+    if not isinstance(artist, str):
+        artist = artist[0]
+
+    image_urls = as_list(record["source_image_url"])
+
+    nsfw = record.get("nsfw")
+    if isinstance(nsfw, str):
+        nsfw = nsfw.strip().lower() in TRUE
+
+    specifiers = []
+    for value in as_list(record.get("submissions")):
+        try:
+            specifiers.append(parse_specifier(value))
+        except ValueError as e:
+            problems.append(Problem(line, None, str(e)))
+
+    accepted, rejected = rules.validate(
+        sr_rules, record.get("series"), bool(nsfw), specifiers
+    )
+
+    problems.extend(Problem(line, r.name, rules.PROBLEMS[r.problem]) for r in rejected)
+
+    return {
+        "line": line,
+        "title": record["title"],
+        "artist": artist,
+        "series": record.get("series"),
+        "nsfw": bool(nsfw),
+        "source_url": canonical.canonical(record["source_url"]),
+        "source_image_url": image_urls[0] if len(image_urls) == 1 else None,
+        "source_image_urls": image_urls if len(image_urls) > 1 else None,
+        "subreddit_ids": [a.subreddit_id for a in accepted],
+        "flair_ids": [a.flair_id for a in accepted],
+        "custom_tags": [a.tag for a in accepted],
+    }
+
+
+def array_literal(values):
+    if values is None:
+        return None
+
+    def element(value):
+        if value is None:
+            return "NULL"
+        return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+    return "{" + ",".join(map(element, values)) + "}"
+
+
+def copy_value(value):
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, list):
+        return array_literal([v if v is None else str(v) for v in value])
+    return value
+
+
+def copy_lines(rows):
+    """Encode staging rows as COPY CSV, a row at a time."""
+    out = io.StringIO()
+    writer = csv.writer(out)
+
+    for row in rows:
+        writer.writerow(copy_value(row[column]) for column in COLUMNS)
+
+        yield out.getvalue()
+
+        out.seek(0)
+        out.truncate()
+
+
+def import_works(con, records):
+    """Bulk-load works and their submissions in one transaction.
+
+    ``records`` yields ``(line, dict)`` pairs. Rows are streamed into a staging
+    table with COPY, then artists and duplicates are resolved set-wise.
+    Subreddit rules are loaded once and checked in memory as rows stream in.
+
+    Returns ``(work_count, submission_count, problems)``; a row that can't be
+    imported becomes a Problem rather than an exception.
+
+    """
+    problems = []
+
+    with con.transaction() as connection:
+        sr_rules = rules.load(con)
+
+        rows = (normalize(line, record, sr_rules, problems) for line, record in records)
+        rows = (row for row in rows if row is not None)
+
+        connection.execute(
+            """CREATE TEMPORARY TABLE import_rows (
+                line integer PRIMARY KEY,
+                title varchar,
+                artist varchar,
+                series varchar,
+                nsfw boolean,
+                source_url varchar,
+                source_image_url varchar,
+                source_image_urls varchar[],
+                subreddit_ids integer[],
+                flair_ids varchar[],
+                custom_tags varchar[],
+                artist_id integer,
+                work_id integer,
+                problem varchar
+            ) ON COMMIT DROP"""
+        )
+
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(
+            "COPY import_rows ({}) FROM STDIN WITH (FORMAT csv)".format(
+                ", ".join(COLUMNS)
+            ),
+            ChunkReader(copy_lines(rows)),
+        )
+        cursor.close()
+
+        connection.execute("ANALYZE import_rows")
+
+        # Duplicates within the file: the first occurrence wins. Albums are
+        # compared by their whole list of images
+        connection.execute(
+            """UPDATE import_rows SET problem = 'duplicate of line ' || first
+            FROM (SELECT line, min(line) OVER (PARTITION BY
+                COALESCE(source_image_url, source_image_urls::varchar)) AS first
+                FROM import_rows) AS duplicates
+            WHERE import_rows.line = duplicates.line
+            AND duplicates.first <> duplicates.line"""
+        )
+
+        connection.execute(
+            """UPDATE import_rows SET problem = 'already added with ID ' || works.id
+            FROM works WHERE problem IS NULL
+            AND COALESCE(works.source_image_url, works.source_image_urls::varchar)
+            = COALESCE(import_rows.source_image_url,
+                import_rows.source_image_urls::varchar)"""
+        )
+
+        connection.execute(
+            """INSERT INTO artists (name)
+            SELECT DISTINCT artist FROM import_rows WHERE problem IS NULL
+            ON CONFLICT (name) DO NOTHING"""
+        )
+
+        # Work IDs are allocated along with the artist so that submissions can be
+        # tied back to their lines
+        connection.execute(
+            sa.text(
+                """WITH RECURSIVE chain AS (
+                    SELECT name AS start, id, alias_of, 1 AS depth FROM artists
+                    WHERE name IN (SELECT artist FROM import_rows)
+                    UNION ALL
+                    SELECT chain.start, artists.id, artists.alias_of, chain.depth + 1
+                    FROM artists INNER JOIN chain ON artists.id = chain.alias_of
+                    WHERE chain.depth < :max_depth
+                ) UPDATE import_rows SET artist_id = chain.id,
+                    work_id = nextval(pg_get_serial_sequence('works', 'id'))
+                FROM chain WHERE chain.alias_of IS NULL
+                AND chain.start = import_rows.artist AND problem IS NULL"""
+            ),
+            max_depth=h.MAX_ALIAS_DEPTH,
+        )
+
+        connection.execute(
+            """UPDATE import_rows SET problem = 'artist alias chain is broken'
+            WHERE artist_id IS NULL AND problem IS NULL"""
+        )
+
+        work_count = connection.execute(
+            """INSERT INTO works (id, title, series, nsfw, source_url,
+                source_image_url, source_image_urls, is_album, artist_id)
+            SELECT work_id, title, series, nsfw, source_url, source_image_url,
+                source_image_urls, source_image_urls IS NOT NULL, artist_id
+            FROM import_rows WHERE problem IS NULL ORDER BY line"""
+        ).rowcount
+
+        # The schema's CHECK constraints are evaluated up front, so a submission
+        # the rules in memory let through, such as one to a subreddit whose
+        # rules changed since they were loaded, is reported rather than
+        # aborting the whole import
+        connection.execute(
+            """CREATE TEMPORARY TABLE import_submissions ON COMMIT DROP AS
+            SELECT line, work_id, s.subreddit_id, s.flair_id, s.custom_tag,
+                CASE WHEN NOT check_require_flair(s.flair_id, s.subreddit_id)
+                    THEN 'require_flair'
+                WHEN NOT check_require_series(work_id, s.subreddit_id)
+                    THEN 'require_series'
+                WHEN NOT check_require_tag(s.custom_tag, s.subreddit_id)
+                    THEN 'require_tag'
+                WHEN NOT check_sfw_only(work_id, s.subreddit_id)
+                    THEN 'sfw_only' END AS problem
+            FROM import_rows, unnest(subreddit_ids, flair_ids, custom_tags)
+                AS s(subreddit_id, flair_id, custom_tag)
+            WHERE problem IS NULL"""
+        )
+
+        submission_count = connection.execute(
+            """INSERT INTO submissions (work_id, subreddit_id, flair_id, custom_tag)
+            SELECT work_id, subreddit_id, flair_id, custom_tag
+            FROM import_submissions WHERE problem IS NULL ORDER BY line"""
+        ).rowcount
+
+        problems.extend(
+            Problem(row["line"], row["name"], rules.PROBLEMS[row["problem"]])
+            for row in connection.execute(
+                """SELECT line, name, problem FROM import_submissions
+                INNER JOIN subreddits ON subreddits.id = subreddit_id
+                WHERE problem IS NOT NULL"""
+            )
+        )
+
+        problems.extend(
+            Problem(row["line"], None, row["problem"])
+            for row in connection.execute(
+                "SELECT line, problem FROM import_rows WHERE problem IS NOT NULL"
+            )
+        )
+
+    problems.sort(key=lambda p: (p.line, p.subreddit or ""))
+
+    return work_count, submission_count, problems
@@ -0,0 +1,170 @@
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Sites by the hosts their pages are on, subdomains included
+SITES = {
+    "artstation.com": "artstation",
+    "artstn.co": "artstation",
+    "deviantart.com": "deviantart",
+    "fav.me": "deviantart",
+    "furaffinity.net": "furaffinity",
+    "hentai-foundry.com": "hentai-foundry",
+    "pixiv.net": "pixiv",
+}
+
+# Sites where one page can hold several works, told apart by --index
+ALBUM_SITES = frozenset(("pixiv",))
+
+# Query parameters added by whoever shared a link, never by the site
+TRACKING = re.compile(r"utm_\w+|fbclid|gclid")
+
+DEVIATION_ID = re.compile(r"-(\d+)$")
+
+
+def site(url):
+    """The extractor name for ``url``'s site, or None."""
+    try:
+        host = (urlsplit(url).hostname or "").rstrip(".")
+    except ValueError:
+        return None
+
+    while host:
+        if host in SITES:
+            return SITES[host]
+
+        host = host.partition(".")[2]
+
+    return None
+
+
+def base36(number):
+    digits = ""
+
+    while True:
+        number, digit = divmod(number, 36)
+        digits = "0123456789abcdefghijklmnopqrstuvwxyz"[digit] + digits
+
+        if not number:
+            return digits
+
+
+def artstation(host, parts, query):
+    # /artwork/ID, /projects/ID on portfolio subdomains, or artstn.co/p/ID
+    if len(parts) == 2 and parts[0] in ("artwork", "projects", "p"):
+        return "https://www.artstation.com/artwork/{}".format(parts[1])
+
+
+def deviantart(host, parts, query):
+    # The short form is the only one built from the ID alone; it's what
+    # fav.me links already are and the oEmbed endpoint takes it as is
+    if host == "fav.me":
+        if len(parts) == 1 and re.fullmatch(r"d[0-9a-z]+", parts[0].lower()):
+            return "https://fav.me/" + parts[0].lower()
+
+        return None
+
+    if len(parts) == 2 and parts[0] == "deviation" and parts[1].isdigit():
+        ident = int(parts[1])
+    elif len(parts) >= 2 and parts[-2] == "art" and DEVIATION_ID.search(parts[-1]):
+        ident = int(DEVIATION_ID.search(parts[-1])[1])
+    else:
+        return None
+
+    return "https://fav.me/d" + base36(ident)
+
+
+def furaffinity(host, parts, query):
+    if len(parts) == 2 and parts[0] in ("view", "full") and parts[1].isdigit():
+        return "https://www.furaffinity.net/view/{}/".format(parts[1])
+
+
+def hentai_foundry(host, parts, query):
+    if len(parts) >= 4 and parts[:2] == ["pictures", "user"] and parts[3].isdigit():
+        return "https://www.hentai-foundry.com/" + "/".join(parts)
+
+
+def pixiv(host, parts, query):
+    # /artworks/ID, with or without a language, /i/ID, or the old
+    # member_illust.php?illust_id=ID
+    if parts[-2:-1] in (["artworks"], ["i"]) and parts[-1].isdigit():
+        ident = parts[-1]
+    elif parts == ["member_illust.php"] and query.get("illust_id", "").isdigit():
+        ident = query["illust_id"]
+    else:
+        return None
+
+    return "https://www.pixiv.net/artworks/{}".format(ident)
+
+
+RULES = {
+    "artstation": artstation,
+    "deviantart": deviantart,
+    "furaffinity": furaffinity,
+    "hentai-foundry": hentai_foundry,
+    "pixiv": pixiv,
+}
+
+
+def work_page(url):
+    """``url`` rebuilt from the ID of the work it shows, or None.
+
+    None for other sites, and for pages of theirs that aren't a single work,
+    like a profile.
+
+    """
+    name = site(url)
+
+    if name is None:
+        return None
+
+    parsed = urlsplit(url.strip())
+    parts = [part for part in parsed.path.split("/") if part]
+
+    if not parts:
+        return None
+
+    return RULES[name](
+        parsed.hostname.rstrip("."), parts, dict(parse_qsl(parsed.query))
+    )
+
+
+def canonical(url):
+    """One spelling of ``url`` for every URL that shows the same page.
+
+    Work pages on supported sites are rebuilt from their IDs. Anything else
+    only loses its fragment, tracking parameters and the case of its scheme
+    and host, since whether ``www.`` or a trailing slash matters is up to the
+    site. Malformed URLs, like one with a port that isn't a number, are
+    returned unchanged.
+
+    """
+    rebuilt = work_page(url)
+
+    if rebuilt:
+        return rebuilt
+
+    try:
+        parsed = urlsplit(url.strip())
+        port = parsed.port
+    except ValueError:
+        return url
+
+    pairs = parse_qsl(parsed.query, keep_blank_values=True)
+    query = parsed.query
+
+    if any(TRACKING.fullmatch(key) for key, value in pairs):
+        query = urlencode(
+            [(key, value) for key, value in pairs if not TRACKING.fullmatch(key)]
+        )
+
+    netloc = parsed.netloc.lower()
+
+    if (parsed.scheme.lower(), port) in (("http", 80), ("https", 443)):
+        netloc = netloc.rpartition(":")[0]
+
+    return urlunsplit((parsed.scheme.lower(), netloc, parsed.path or "/", query, ""))
+
+
+def one_work(url):
+    """Whether a page is a work's and can only ever be added as one work."""
+    return site(url) not in ALBUM_SITES and work_page(url) is not None
@@ -0,0 +1,220 @@
+import base64
+import gzip
+import hashlib
+import io
+import json
+import os
+import threading
+from datetime import timedelta
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from . import exceptions as exc
+
+# Response headers that only mean something to the connection they came on
+DROPPED_HEADERS = frozenset(
+    ("set-cookie", "content-encoding", "transfer-encoding", "content-length")
+)
+
+# JSON fields whose values are never written to a cassette
+SECRET_FIELDS = ("access_token", "refresh_token")
+REDACTED = "redacted"
+
+
+class CassetteMiss(exc.EBException):
+    def __init__(self, method, url):
+        self.method = method
+        self.url = url
+
+        self.args = ("No recorded response for {} {}".format(method, url),)
+
+
+def digest(body):
+    if body is None:
+        return None
+
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    elif not isinstance(body, bytes):
+        # A streamed upload; only its method and URL can be matched
+        return None
+
+    return hashlib.sha256(body).hexdigest()
+
+
+def redact(content):
+    """``content`` with any tokens in a JSON body replaced."""
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return content
+
+    if not isinstance(data, dict) or not any(f in data for f in SECRET_FIELDS):
+        return content
+
+    for field in SECRET_FIELDS:
+        if field in data:
+            data[field] = REDACTED
+
+    return json.dumps(data).encode("utf-8")
+
+
+class Cassette:
+    """Every HTTP exchange of a run, kept in a gzipped JSON lines file.
+
+    Recording appends to what the file already holds, so several runs can
+    build up one cassette. Replaying answers each request with the next
+    response recorded for the same method, URL and body, or failing that the
+    same method and URL; once those run out, the last one is repeated.
+
+    Only responses are kept, with tokens in them redacted; request headers,
+    where credentials travel, are never written. A streamed response is kept
+    as far as its caller read it, once it's closed.
+
+    """
+
+    def __init__(self, path, replay=False):
+        self.path = path
+        self.replaying = replay
+        self.lock = threading.Lock()
+        self.entries = []
+        self.exact = {}
+        self.loose = {}
+
+        if replay:
+            for entry in self.load():
+                self.exact.setdefault(
+                    (entry["method"], entry["url"], entry["body"]), []
+                ).append(entry)
+                self.loose.setdefault((entry["method"], entry["url"]), []).append(entry)
+
+    def load(self):
+        try:
+            with gzip.open(self.path, mode="rt", encoding="utf-8") as cassette_file:
+                return [json.loads(line) for line in cassette_file if line.strip()]
+        except FileNotFoundError:
+            if self.replaying:
+                raise
+
+            return []
+
+    def record(self, method, url, body, response, content=None):
+        dropped = DROPPED_HEADERS
+
+        if content is None:
+            content = response.content
+        elif "Content-Encoding" not in response.headers:
+            # Only part of a stream may have been read; the size of the whole
+            # is still the server's to tell
+            dropped = DROPPED_HEADERS - {"content-length"}
+
+        content = redact(content)
+
+        entry = {
+            "method": method,
+            "url": url,
+            "body": digest(body),
+            "status": response.status_code,
+            "reason": response.reason,
+            "headers": {
+                name: value
+                for name, value in response.headers.items()
+                if name.lower() not in dropped
+            },
+        }
+
+        try:
+            entry["content"] = content.decode("utf-8")
+        except UnicodeDecodeError:
+            entry["content_base64"] = base64.b64encode(content).decode("ascii")
+
+        with self.lock:
+            self.entries.append(entry)
+
+    def record_stream(self, method, url, body, response):
+        """Record a streamed response once it's closed, with only what was read.
+
+        Reading it all here would download what the caller meant to stop
+        short of.
+
+        """
+        read = []
+        recorded = threading.Event()
+        iter_content = response.iter_content
+        close = response.close
+
+        def tee(*args, **kwargs):
+            for chunk in iter_content(*args, **kwargs):
+                if isinstance(chunk, str):
+                    read.append(chunk.encode(response.encoding or "utf-8"))
+                else:
+                    read.append(chunk)
+
+                yield chunk
+
+        def record_and_close():
+            close()
+
+            if not recorded.is_set():
+                recorded.set()
+                self.record(method, url, body, response, b"".join(read))
+
+        # Instance attributes, so content and the context manager use them too
+        response.iter_content = tee
+        response.close = record_and_close
+
+    def next_entry(self, queues, key):
+        queue = queues.get(key)
+
+        if not queue:
+            return None
+
+        return queue.pop(0) if len(queue) > 1 else queue[0]
+
+    def play(self, request):
+        """The recorded response to ``request``, built as requests would."""
+        with self.lock:
+            entry = self.next_entry(
+                self.exact, (request.method, request.url, digest(request.body))
+            ) or self.next_entry(self.loose, (request.method, request.url))
+
+        if entry is None:
+            raise CassetteMiss(request.method, request.url)
+
+        response = requests.Response()
+        response.status_code = entry["status"]
+        response.reason = entry["reason"]
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.url = request.url
+        response.request = request
+        response.elapsed = timedelta(0)
+
+        if "content_base64" in entry:
+            content = base64.b64decode(entry["content_base64"])
+        else:
+            content = entry["content"].encode("utf-8")
+
+        # Already read, so streamed callers iterate over it too
+        response._content = content
+        response._content_consumed = True
+        response.raw = io.BytesIO(content)
+
+        return response
+
+    def save(self):
+        """Write the recorded exchanges after any the file already held."""
+        if self.replaying or not self.entries:
+            return
+
+        with self.lock:
+            entries = self.load() + self.entries
+
+        temp = self.path + ".tmp"
+
+        with gzip.open(temp, mode="wt", encoding="utf-8") as cassette_file:
+            for entry in entries:
+                cassette_file.write(json.dumps(entry) + "\n")
+
+        os.replace(temp, self.path)
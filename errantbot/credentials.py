@@ -0,0 +1,144 @@
+import fcntl
+import json
+import os
+import time
+from contextlib import contextmanager
+
+# Seconds before expiry that an access token is refreshed, so no request is
+# sent with a token that runs out on the way
+REFRESH_MARGIN = 300
+
+
+class TokenStore:
+    """An account's OAuth tokens in a JSON file, shared between processes.
+
+    A refresh holds an exclusive lock on a file beside it from reading the
+    cached token to saving the new one, so runs that start together refresh
+    once and the others pick up the result.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @contextmanager
+    def locked(self):
+        with open(self.path + ".lock", mode="a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load(self):
+        try:
+            with open(self.path) as token_file:
+                return json.load(token_file)
+        except FileNotFoundError:
+            return None
+
+    def save(self, token):
+        temp = self.path + ".tmp"
+
+        fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, mode="w") as token_file:
+            json.dump(token, token_file)
+
+        os.replace(temp, self.path)
+
+
+def fresh(token):
+    """Whether a cached token's access token outlasts the refresh margin."""
+    return bool(
+        token
+        and token.get("access_token")
+        and token.get("expires_at", 0) > time.time() + REFRESH_MARGIN
+    )
+
+
+def early(token):
+    """A copy of ``token`` that expires when it's due to be refreshed."""
+    if "expires_at" not in token:
+        return token
+
+    return dict(token, expires_at=token["expires_at"] - REFRESH_MARGIN)
+
+
+def share_reddit_token(reddit, store, token=None):
+    """Have an authorised praw client use, and keep, the access token in ``store``.
+
+    praw only takes a refresh token, so this works on its authorizer directly:
+    a cached access token that's still fresh is used as is, and refreshes go
+    through the store's lock.
+
+    """
+    authorizer = reddit._authorized_core._authorizer
+    refresh = authorizer.refresh
+
+    def adopt(token):
+        authorizer.access_token = token["access_token"]
+        authorizer.scopes = set(token["scope"].split())
+
+        # praw keeps expiry on the monotonic clock
+        authorizer._expiration_timestamp_ns = time.monotonic_ns() + int(
+            (token["expires_at"] - REFRESH_MARGIN - time.time()) * 1e9
+        )
+
+    def current():
+        return {
+            "refresh_token": authorizer.refresh_token,
+            "access_token": authorizer.access_token,
+            "scope": " ".join(sorted(authorizer.scopes)),
+            "expires_at": time.time()
+            + (authorizer._expiration_timestamp_ns - time.monotonic_ns()) / 1e9,
+        }
+
+    def shared_refresh():
+        with store.locked():
+            token = store.load()
+
+            if not fresh(token):
+                refresh()
+                token = current()
+                store.save(token)
+
+        adopt(token)
+
+    if token is None:
+        # Just authorised, so the client holds a new token
+        token = current()
+        store.save(token)
+
+    if fresh(token):
+        adopt(token)
+
+    authorizer.refresh = shared_refresh
+
+
+def share_oauth2_token(session, store):
+    """Have a requests-oauthlib session refresh through ``store``'s lock.
+
+    The session is given tokens that expire early, so it refreshes before the
+    real expiry; the store keeps the real one.
+
+    """
+    refresh = session.refresh_token
+
+    def shared_refresh(token_url, **kwargs):
+        with store.locked():
+            token = store.load()
+
+            if not fresh(token):
+                token = refresh(token_url, **kwargs)
+                store.save(token)
+
+        session.token = early(token)
+
+        return session.token
+
+    session.token = early(session.token)
+    session.refresh_token = shared_refresh
+
+    # The refresh has already saved the token; an updater only has to be set
+    # for requests-oauthlib not to raise TokenUpdated
+    session.token_updater = lambda token: None
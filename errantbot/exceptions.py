@@ -7,3 +7,15 @@ class UnsupportedSite(EBException):
         self.page = page
 
         self.args = ("The page '{}' is not from a supported site".format(page),)
+
+
+class UnknownAccount(EBException):
+    def __init__(self, service, account):
+        self.service = service
+        self.account = account
+
+        self.args = (
+            "There's no {} account named '{}' in secrets.toml".format(
+                service.title(), account
+            ),
+        )
@@ -2,14 +2,16 @@ from collections import namedtuple
 from urllib.parse import parse_qs, quote, urlparse
 
 import click
-import regex
-import requests
-
-import tldextract
-from bs4 import BeautifulSoup
 
 from . import exceptions as exc
-from . import helper as h
+from .lazy import lazy_import
+
+bs4 = lazy_import("bs4")
+canonical = lazy_import("errantbot.canonical")
+h = lazy_import("errantbot.helper")
+metrics = lazy_import("errantbot.metrics")
+net = lazy_import("errantbot.net")
+regex = lazy_import("regex")
 
 Work = namedtuple(
     "Work", ["title", "artists", "series", "nsfw", "image_url", "source_url"]
@@ -23,7 +25,7 @@ def artstation(page_url, options):
 
     json_url = "https://artstation.com/projects/{}.json".format(ident)
 
-    res = requests.get(json_url)
+    res = net.session().get(json_url)
 
     json = res.json()
 
@@ -84,11 +86,11 @@ def pixiv(page_url, options):
 
 
 def hentai_foundry(page_url, options):
-    res = requests.get(page_url + "?enterAgree=1")
+    res = net.session().get(page_url + "?enterAgree=1")
 
     res.raise_for_status()
 
-    soup = BeautifulSoup(res.text, features="html.parser")
+    soup = bs4.BeautifulSoup(res.text, features="html.parser")
 
     image_url = "https:" + soup.find(id="picBox").find(class_="boxbody").img["src"]
 
@@ -112,7 +114,7 @@ def hentai_foundry(page_url, options):
 
 
 def deviantart(page_url, options):
-    oe_req = requests.get(
+    oe_req = net.session().get(
         "https://backend.deviantart.com/oembed?url={}".format(quote(page_url))
     )
 
@@ -139,11 +141,11 @@ def deviantart(page_url, options):
 def furaffinity(page_url, options):
     cookies = h.get_secrets()["furaffinity"]["cookies"]
 
-    res = requests.get(page_url, cookies=cookies)
+    res = net.session().get(page_url, cookies=cookies)
 
     res.raise_for_status()
 
-    soup = BeautifulSoup(res.text, features="html.parser")
+    soup = bs4.BeautifulSoup(res.text, features="html.parser")
 
     body_id = soup.body["id"]
 
@@ -186,11 +188,11 @@ def auto(page_url, **kwargs):
         "furaffinity": furaffinity,
     }
 
-    no_fetch_extract = tldextract.TLDExtract(suffix_list_urls=None)
-
-    domain = no_fetch_extract(page_url).domain
+    page_url = canonical.canonical(page_url)
+    domain = canonical.site(page_url)
 
     if domain in domains:
-        return domains[domain](page_url, kwargs)
+        with metrics.timed("extract", site=domain):
+            return domains[domain](page_url, kwargs)
 
     raise exc.UnsupportedSite(page_url)
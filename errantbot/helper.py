@@ -1,18 +1,28 @@
 import enum
 import logging
+import threading
 from collections import namedtuple
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-
-import tomlkit
-
-import praw
-from prawcore import exceptions
-from psycopg2 import errorcodes
-from sqlalchemy import MetaData, create_engine, exc, sql
-from sqlalchemy.sql import bindparam as bp
-from sqlalchemy.sql import select
-
-from . import apis
+from functools import lru_cache
+
+from . import exceptions as exc
+from .lazy import lazy_import
+
+accounts = lazy_import("errantbot.accounts")
+apis = lazy_import("errantbot.apis")
+canonical = lazy_import("errantbot.canonical")
+jobs = lazy_import("errantbot.jobs")
+metrics = lazy_import("errantbot.metrics")
+postgresql = lazy_import("sqlalchemy.dialects.postgresql")
+praw = lazy_import("praw")
+prawcore = lazy_import("prawcore")
+probe = lazy_import("errantbot.probe")
+profiling = lazy_import("errantbot.profiling")
+requests = lazy_import("requests")
+rules = lazy_import("errantbot.rules")
+sa = lazy_import("sqlalchemy")
+tomlkit = lazy_import("tomlkit")
 
 log = logging.getLogger(__name__)
 
@@ -39,12 +49,20 @@ class Submissions:
         self.length = len(self.n_f_t)
 
 
+# Read once per process; every connection and account lookup goes through it
+@lru_cache(maxsize=None)
 def get_secrets():
     with open("secrets.toml") as secrets_file:
         return tomlkit.parse(secrets_file.read())
 
 
 class Connections:
+    def __init__(self):
+        self.local = threading.local()
+        self.artist_cache = ArtistCache()
+        self.reddits = {}
+        self.lock = threading.Lock()
+
     def __getattr__(self, name):
         if name == "imgur":
             self.connect_imgur()
@@ -52,49 +70,228 @@ class Connections:
         elif name == "reddit":
             self.connect_reddit()
             return self.reddit
-        elif name == "db" or name == "meta" or name == "engine":
+        elif name == "meta" or name == "engine":
             self.connect_db()
             return getattr(self, name)
         else:
             raise AttributeError("{} is not a valid connection name".format(name))
 
+    @property
+    def db(self):
+        """The connection of the current transaction, or the engine outside of one."""
+        connection = getattr(self.local, "connection", None)
+
+        return self.engine if connection is None else connection
+
+    @contextmanager
+    def transaction(self):
+        """Run everything in the block in one transaction on one pooled connection.
+
+        Commits when the block exits normally and rolls back if it raises. Nested
+        blocks join the outermost transaction.
+
+        """
+        if getattr(self.local, "connection", None) is not None:
+            yield self.local.connection
+            return
+
+        committed = []
+
+        with self.engine.begin() as connection:
+            self.local.connection = connection
+            self.local.committed = committed
+            try:
+                yield connection
+            finally:
+                self.local.connection = None
+                self.local.committed = None
+
+        # Only reached once the transaction has committed
+        for callback in committed:
+            callback()
+
+    def after_commit(self, callback):
+        """Call ``callback`` once the current transaction commits, or now if none.
+
+        For anything kept outside the database that must not outlive a rollback.
+
+        """
+        committed = getattr(self.local, "committed", None)
+
+        if committed is None:
+            callback()
+        else:
+            committed.append(callback)
+
     def connect_imgur(self):
-        log.info("Connecting to Imgur")
-        secrets = get_secrets()["imgur"]
+        pool = accounts.ImgurPool(get_secrets())
+
+        log.info("Connecting to Imgur with %s account(s)", len(pool))
 
-        self.imgur = apis.Imgur(secrets["client_id"], secrets["client_secret"])
+        with profiling.stage("imgur auth"):
+            pool.authenticate()
 
-        self.imgur.authenticate()
+        self.imgur = pool
 
     def connect_reddit(self):
-        log.info("Connecting to Reddit")
+        self.reddit = self.reddit_for()
 
-        reddit = apis.Reddit(get_secrets()["reddit"])
+    def reddit_for(self, account=None):
+        """The praw client of a Reddit account from secrets.toml, None being the default.
 
-        reddit.authenticate()
+        Each account has its own token file and rate limit; clients connect on
+        first use and are shared between threads.
 
-        self.reddit = reddit.reddit
+        """
+        with self.lock:
+            if account not in self.reddits:
+                found = accounts.credentials(get_secrets(), "reddit")
+
+                if account not in found:
+                    raise exc.UnknownAccount("reddit", account)
+
+                log.info("Connecting to Reddit as %s", account or "the default account")
+
+                reddit = apis.Reddit(
+                    found[account], accounts.token_file("reddit", account)
+                )
+
+                with profiling.stage("reddit auth"):
+                    self.reddits[account] = reddit.authenticate()
+
+        return self.reddits[account]
 
     def connect_db(self):
         log.info("Connecting to database")
 
         secrets = get_secrets()["database"]
 
-        self.db = create_engine(
-            "postgresql://{user}:{password}@{host}/{name}".format(**secrets)
+        self.engine = sa.create_engine(
+            "postgresql://{user}:{password}@{host}/{name}".format(**secrets),
+            pool_pre_ping=True,
         )
 
-        self.meta = MetaData(bind=self.db)
-        self.meta.reflect()
+        if metrics.enabled:
+            metrics.instrument(self.engine)
+        if profiling.enabled or profiling.slow_query is not None:
+            profiling.watch_queries(self.engine)
+
+        self.meta = sa.MetaData(bind=self.engine)
+
+        with profiling.stage("reflect"):
+            self.meta.reflect()
 
 
 def get_last(con, table):
     return con.db.execute(
-        con.meta.tables[table].select().order_by(sql.desc("id")).limit(1)
+        con.meta.tables[table].select().order_by(sa.desc("id")).limit(1)
     ).first()["id"]
 
 
+# Rows fetched per round trip when working through a backlog
+CHUNK_SIZE = 100
+
+
+def get_checkpoint(con, name):
+    row = con.db.execute(
+        sa.text("SELECT last_id FROM checkpoints WHERE name = :name"), name=name
+    ).first()
+
+    return row["last_id"] if row else None
+
+
+def set_checkpoint(con, name, last_id):
+    con.db.execute(
+        sa.text(
+            """INSERT INTO checkpoints (name, last_id) VALUES (:name, :last_id)
+            ON CONFLICT (name) DO UPDATE SET last_id = excluded.last_id,
+                updated_on = excluded.updated_on"""
+        ),
+        name=name,
+        last_id=last_id,
+    )
+
+
+def clear_checkpoint(con, name):
+    con.db.execute(sa.text("DELETE FROM checkpoints WHERE name = :name"), name=name)
+
+
+def chunks(con, query, key, checkpoint=None, size=CHUNK_SIZE, **params):
+    """Yield lists of at most ``size`` rows, walking ``query`` by keyset.
+
+    ``query`` must select ``key``, filter on ``key > :after`` and end with
+    ``ORDER BY key LIMIT :size``. Given a ``checkpoint`` name, the last key of
+    each finished chunk is saved, so an interrupted run resumes after it; the
+    checkpoint is cleared once the backlog is exhausted.
+
+    """
+    after = (get_checkpoint(con, checkpoint) if checkpoint else None) or 0
+
+    if after:
+        log.info("Resuming from checkpoint %s after ID %s", checkpoint, after)
+
+    while True:
+        rows = con.db.execute(query, after=after, size=size, **params).fetchall()
+
+        if not rows:
+            break
+
+        yield rows
+
+        after = rows[-1][key]
+
+        if checkpoint:
+            set_checkpoint(con, checkpoint, after)
+
+    if checkpoint:
+        clear_checkpoint(con, checkpoint)
+
+
+class PostOutcome(enum.Enum):
+    POSTED = "posted"
+    WAITING = "waiting"
+    DISABLED = "disabled"
+    REJECTED = "rejected"
+
+    def __bool__(self):
+        return self is __class__.POSTED
+
+
+@contextmanager
+def post_lock(con, submission_id):
+    """Hold the lock that serialises posting to a submission's subreddit.
+
+    It's a session lock on a connection of its own rather than a transaction's,
+    so what's posted under it is committed as soon as it's posted. A process
+    that dies drops it with its connection.
+
+    """
+    statement = """SELECT {}(hashtext('errantbot.post'), subreddit_id)
+        FROM submissions WHERE id = :id"""
+
+    def call(function):
+        # Committed, so the connection doesn't sit in a transaction meanwhile
+        connection.execute(
+            sa.text(statement.format(function)).execution_options(autocommit=True),
+            id=submission_id,
+        )
+
+    with con.engine.connect() as connection:
+        call("pg_advisory_lock")
+
+        try:
+            yield
+        finally:
+            call("pg_advisory_unlock")
+
+
 def do_post(con, row, wait):
+    """Submit one pending submission; returns a PostOutcome.
+
+    Call it under post_lock, outside of any transaction: the post is recorded
+    in a transaction of its own as soon as Reddit has it.
+
+    """
     wait = timedelta(hours=wait)
     has_keys(
         row,
@@ -115,91 +312,289 @@ def do_post(con, row, wait):
     )
 
     sr_row = con.db.execute(
-        sql.text(
+        sa.text(
             """SELECT last_submission_on, space_out, name, tag_series,
-        flair_id, disabled FROM subreddits WHERE id = :id"""
+        flair_id, disabled, account FROM subreddits WHERE id = :id"""
         ),
         id=row["subreddit_id"],
     ).first()
 
-    if sr_row["disabled"]:
-        log.warning("/r/%s is disabled", sr_row["name"])
-        return False
+    with metrics.timed("post", subreddit=sr_row["name"]) as labels:
+        if sr_row["disabled"]:
+            log.warning("/r/%s is disabled", sr_row["name"])
+            labels["outcome"] = "disabled"
+            return PostOutcome.DISABLED
+
+        if wait and sr_row["space_out"] and sr_row["last_submission_on"] is not None:
+            since = datetime.utcnow() - sr_row["last_submission_on"]
+            if since < wait:
+                until = wait - since
+                until = timedelta(until.days, until.seconds)
+                log.warning(
+                    "Submitted to /r/%s less than one day ago; you can try again in %s",
+                    sr_row["name"],
+                    until,
+                )
 
-    if wait and sr_row["space_out"] and sr_row["last_submission_on"] is not None:
-        since = datetime.utcnow() - sr_row["last_submission_on"]
-        if since < wait:
-            until = wait - since
-            until = timedelta(until.days, until.seconds)
-            log.warning(
-                "Submitted to /r/%s less than one day ago; you can try again in %s",
+                labels["outcome"] = "waiting"
+                return PostOutcome.WAITING
+
+        reddit = con.reddit_for(sr_row["account"])
+
+        sub = reddit.subreddit(sr_row["name"])
+
+        if sr_row["tag_series"]:
+            series_tag = " [" + (row["series"] or "Original") + "]"
+        else:
+            series_tag = ""
+
+        title = "{title} ({artist}){series_tag}{tag}".format(
+            series_tag=series_tag,
+            tag=" " + row["custom_tag"] if row["custom_tag"] else "",
+            **row
+        )
+
+        url = row["imgur_url"]
+
+        try:
+            xpost_id = row["crosspost_id"]
+            if xpost_id:
+                orig = reddit.submission(id=xpost_id)
+                submission = orig.crosspost(
+                    sr_row["name"],
+                    title=title,
+                    flair_id=row["flair_id"] or sr_row["flair_id"],
+                )
+            else:
+                submission = sub.submit(
+                    title, url=url, flair_id=row["flair_id"] or sr_row["flair_id"]
+                )
+        except praw.exceptions.RedditAPIException as e:
+            for item in e.items:
+                log.warning(
+                    "Couldn't submit to /r/%s - got error %s: '%s'",
+                    sr_row["name"],
+                    item.error_type,
+                    item.message,
+                )
+
+            labels["outcome"] = "rejected"
+            return PostOutcome.REJECTED
+        else:
+            # Before anything else can fail, so the submission is never posted
+            # twice; the post's own time would take fetching it
+            with con.engine.begin() as connection:
+                connection.execute(
+                    sa.text(
+                        """UPDATE submissions SET reddit_id = :reddit_id,
+                        submitted_on = now() AT TIME ZONE 'utc' WHERE id = :id"""
+                    ),
+                    reddit_id=submission.id,
+                    id=row["submission_id"],
+                )
+
+            log.info(
+                "Submitted to /r/%s at https://redd.it/%s",
                 sr_row["name"],
-                until,
+                submission.id,
             )
 
-            return False
+            try:
+                if row["nsfw"]:
+                    submission.mod.nsfw()
 
-    sub = con.reddit.subreddit(sr_row["name"])
+                comment = submission.reply("[Source]({})".format(row["source_url"]))
+            except item_errors() as e:
+                log.warning("Couldn't finish https://redd.it/%s: %s", submission.id, e)
+            else:
+                if comment:
+                    con.db.execute(
+                        sa.text(
+                            """UPDATE submissions SET source_comment_id = :comment_id
+                            WHERE id = :id"""
+                        ),
+                        comment_id=comment.id,
+                        id=row["submission_id"],
+                    )
+
+            return PostOutcome.POSTED
+
+
+def delete_source_comment(reddit, submission, row, me):
+    if row["source_comment_id"]:
+        praw.models.Comment(reddit, id=row["source_comment_id"]).delete()
+        return
 
-    if sr_row["tag_series"]:
-        series_tag = " [" + (row["series"] or "Original") + "]"
-    else:
-        series_tag = ""
+    if row["account"] not in me:
+        me[row["account"]] = reddit.user.me()
 
-    title = "{title} ({artist}){series_tag}{tag}".format(
-        series_tag=series_tag,
-        tag=" " + row["custom_tag"] if row["custom_tag"] else "",
-        **row
-    )
+    for comment in submission.comments:
+        if isinstance(comment, praw.models.Comment) and (
+            comment.author == me[row["account"]]
+        ):
+            comment.delete()
+
+
+def delete_posts(con, submission_ids=(), reddit_ids=(), from_reddit=False):
+    """Forget the Reddit posts of many submissions, optionally deleting them.
+
+    Each post and its source comment are deleted by ID, without being fetched
+    first; the database is then updated in one statement. Posts made before
+    comment IDs were recorded fall back to scanning top-level comments once.
+
+    """
+    rows = con.db.execute(
+        sa.text(
+            """SELECT submissions.id, reddit_id, source_comment_id, account
+            FROM submissions INNER JOIN subreddits ON subreddits.id = subreddit_id
+            WHERE reddit_id IS NOT NULL
+            AND (submissions.id = ANY(:ids) OR reddit_id = ANY(:reddit_ids))"""
+        ),
+        ids=list(submission_ids),
+        reddit_ids=list(reddit_ids),
+    ).fetchall()
+
+    missing = set(submission_ids) - {row["id"] for row in rows}
+    missing |= set(reddit_ids) - {row["reddit_id"] for row in rows}
+
+    for post_id in sorted(missing, key=str):
+        log.warning("%s is not a posted submission", post_id)
 
-    url = row["imgur_url"]
+    done = []
+    me = {}
+
+    errors = item_errors()
 
     try:
-        xpost_id = row["crosspost_id"]
-        if xpost_id:
-            orig = con.reddit.submission(id=xpost_id)
-            submission = orig.crosspost(
-                sr_row["name"],
-                title=title,
-                flair_id=row["flair_id"] or sr_row["flair_id"],
-            )
-        else:
-            submission = sub.submit(
-                title, url=url, flair_id=row["flair_id"] or sr_row["flair_id"]
+        for row in rows:
+            if from_reddit:
+                # Only the account that made a post can delete it
+                reddit = con.reddit_for(row["account"])
+                submission = praw.models.Submission(reddit, id=row["reddit_id"])
+
+                try:
+                    submission.delete()
+                except errors as e:
+                    log.warning("Couldn't delete %s: %s", row["reddit_id"], e)
+                    continue
+
+                log.info("Deleted https://redd.it/%s", row["reddit_id"])
+
+                # The post is gone whatever becomes of its comment
+                done.append(row["id"])
+
+                try:
+                    delete_source_comment(reddit, submission, row, me)
+                except errors as e:
+                    log.warning(
+                        "Couldn't delete the source comment on %s: %s",
+                        row["reddit_id"],
+                        e,
+                    )
+            else:
+                done.append(row["id"])
+    finally:
+        # Whatever was deleted before an unexpected error is still forgotten
+        if done:
+            con.db.execute(
+                sa.text(
+                    """UPDATE submissions SET reddit_id = NULL, submitted_on = NULL,
+                    source_comment_id = NULL, score = NULL, removed = NULL,
+                    deleted = NULL, synced_on = NULL
+                    WHERE id = ANY(:ids)"""
+                ),
+                ids=done,
             )
-    except praw.exceptions.APIException as e:
-        log.warning(
-            "Couldn't submit to /r/%s - got error %s: '%s'",
-            sr_row["name"],
-            e.error_type,
-            e.message,
-        )
 
-        return False
-    else:
-        log.info(
-            "Submitted to /r/%s at https://reddit.com%s",
-            sr_row["name"],
-            submission.permalink,
-        )
+    log.info("Cleared %s submissions", len(done))
 
-        if row["nsfw"]:
-            submission.mod.nsfw()
+    return done
 
-        submission.reply("[Source]({})".format(row["source_url"]))
 
-        con.db.execute(
-            sql.text(
-                """UPDATE submissions SET reddit_id = :reddit_id,
-            submitted_on = to_timestamp(:time) AT TIME ZONE 'utc'
-            WHERE id = :id"""
-            ),
-            reddit_id=submission.id,
-            time=int(submission.created_utc),
-            id=row["submission_id"],
-        )
+def item_errors():
+    """Failures that only concern one item, so a batch can move past it.
+
+    Besides network trouble and busy or failing hosts, that's any request the
+    service turns down for that item alone, like a post to a subreddit that
+    has banned the account or a crosspost of a deleted post.
+
+    """
+    return (
+        requests.exceptions.RequestException,
+        praw.exceptions.PRAWException,
+        prawcore.exceptions.PrawcoreException,
+    )
+
 
-        return True
+def skip(con, kind, work_id, error):
+    """Hand a failed item to the job queue and let the batch carry on.
+
+    The failure counts as one of the job's attempts, so an item that keeps
+    failing is eventually left alone.
+
+    """
+    log.warning("Skipping work %s: %s", work_id, error)
+    metrics.inc("skipped", kind=kind)
+
+    jobs.enqueue(con, (kind,), [work_id])
+    jobs.record_failure(con, kind, work_id, str(error))
+
+
+# Unposted submissions, one per work; callers append to the last join condition
+PENDING_POST_WORKS = """SELECT DISTINCT work_id FROM submissions
+    WHERE reddit_id IS NULL AND work_id > :after"""
+
+PENDING_POSTS = """SELECT DISTINCT ON (works.id) works.id AS work_id, title, series,
+    source_url, imgur_url, nsfw,
+    source_image_url, custom_tag, submissions.id AS submission_id,
+    source_image_urls, subreddit_id, submissions.flair_id, reddit_id,
+    artists.name AS artist, subreddits.name,
+    (SELECT reddit_id FROM subreddits AS subreddits_xpost
+        INNER JOIN submissions AS submissions_xpost
+        ON submissions.work_id = submissions_xpost.work_id
+        AND submissions_xpost.subreddit_id = subreddits_xpost.id
+        AND subreddits_xpost.crosspost_from) AS crosspost_id
+    FROM works
+    INNER JOIN submissions
+    ON reddit_id IS NULL
+    AND work_id = works.id
+    INNER JOIN artists
+    ON artists.id = artist_id
+    INNER JOIN subreddits ON
+    subreddits.id = subreddit_id
+    AND NOT disabled
+    AND NOT EXISTS(SELECT FROM submissions AS submissions2 INNER JOIN subreddits ON work_id = works.id
+        AND submissions.id != submissions2.id
+        AND subreddits.id = submissions2.subreddit_id
+        AND crosspost_from AND submissions2.reddit_id IS NULL)"""
+
+
+def pending_post_queries(by_work=False, by_name=False):
+    """The statements post_submissions walks the backlog with.
+
+    The first gives the next ``:size`` IDs after ``:after`` of works with
+    anything left to post, which an index hands out in order; the second is
+    the full query for those ``:ids`` alone, so no chunk costs more than the
+    last as the backlog is walked. Either can be limited to ``:work_ids`` and
+    to subreddits by ``:names``.
+
+    """
+    names_filter = " AND subreddits.name = ANY(:names)" if by_name else ""
+
+    candidates = sa.text(
+        PENDING_POST_WORKS
+        + (" AND work_id = ANY(:work_ids)" if by_work else "")
+        + " AND subreddit_id IN (SELECT id FROM subreddits WHERE NOT disabled"
+        + names_filter
+        + ") ORDER BY work_id LIMIT :size"
+    )
+    query = sa.text(
+        PENDING_POSTS
+        + names_filter
+        + " AND submissions.work_id = ANY(:ids) ORDER BY works.id"
+    )
+
+    return candidates, query
 
 
 def post_submissions(
@@ -221,45 +616,49 @@ def post_submissions(
 
     submissions = False if do_all else submissions
 
-    query = sql.text(
-        """SELECT DISTINCT ON (works.id) title, series, source_url, imgur_url, nsfw,
-        source_image_url, custom_tag, submissions.id AS submission_id,
-        source_image_urls, subreddit_id, submissions.flair_id, reddit_id,
-        artists.name AS artist, subreddits.name,
-        (SELECT reddit_id FROM subreddits AS subreddits_xpost
-            INNER JOIN submissions AS submissions_xpost
-            ON submissions.work_id = submissions_xpost.work_id
-            AND submissions_xpost.subreddit_id = subreddits_xpost.id
-            AND subreddits_xpost.crosspost_from) AS crosspost_id
-        FROM works
-        INNER JOIN submissions
-        ON reddit_id IS NULL
-        AND work_id = works.id
-        INNER JOIN artists
-        ON artists.id = artist_id
-        INNER JOIN subreddits ON
-        subreddits.id = subreddit_id
-        AND NOT disabled
-        AND NOT EXISTS(SELECT FROM submissions AS submissions2 INNER JOIN subreddits ON work_id = works.id
-            AND submissions.id != submissions2.id
-            AND subreddits.id = submissions2.subreddit_id
-            AND crosspost_from AND submissions2.reddit_id IS NULL)"""
-        + (" AND works.id = ANY(:work_ids)" if not do_all else "")
-        + (""" AND subreddits.name = ANY(:names)""" if submissions else "")
-    )
+    candidates, query = pending_post_queries(not do_all, bool(submissions))
 
-    rows = con.db.execute(
-        query,
+    found = False
+
+    for chunk in chunks(
+        con,
+        candidates,
+        "work_id",
+        checkpoint="retry-all" if do_all else None,
         work_ids=work_ids if not do_all else None,
         names=list(submissions.names) if submissions else None,
-    ).fetchall()
-
-    if len(rows) == 0:
+    ):
+        rows = con.db.execute(
+            query,
+            ids=[row["work_id"] for row in chunk],
+            names=list(submissions.names) if submissions else None,
+        ).fetchall()
+
+        found = found or bool(rows)
+
+        for row in rows:
+            # The same lock as workers take, so overlapping runs can't both post
+            with post_lock(con, row["submission_id"]):
+                posted = con.db.execute(
+                    sa.text("SELECT reddit_id FROM submissions WHERE id = :id"),
+                    id=row["submission_id"],
+                ).scalar()
+
+                if posted:
+                    continue
+
+                try:
+                    do_post(con, row, wait)
+                except item_errors() as e:
+                    skip(con, "post", row["work_id"], e)
+
+    if not found:
         log.info("No works require posting")
-        return
 
-    for row in rows:
-        do_post(con, row, wait)
+
+PENDING_UPLOADS = """SELECT title, artists.name as artist, source_image_url,
+    source_image_urls, source_url, imgur_url, works.id, is_album
+    FROM works INNER JOIN artists ON imgur_id IS NULL AND artist_id = artists.id"""
 
 
 def upload_to_imgur(con, work_ids=[], last=False, do_all=False):
@@ -275,26 +674,43 @@ def upload_to_imgur(con, work_ids=[], last=False, do_all=False):
         if last:
             work_ids.append(get_last(con, "works"))
 
-    rows = con.db.execute(
-        sql.text(
-            """SELECT title, artists.name as artist, source_image_url, source_image_urls,
-        source_url, imgur_url, works.id, is_album
-        FROM works INNER JOIN artists ON imgur_id IS NULL AND artist_id = artists.id"""
-            + ("" if do_all else " AND works.id = ANY(:work_ids)")
-        ),
+    query = sa.text(
+        PENDING_UPLOADS
+        + ("" if do_all else " AND works.id = ANY(:work_ids)")
+        + " WHERE works.id > :after ORDER BY works.id LIMIT :size"
+    )
+
+    found = False
+
+    for rows in chunks(
+        con,
+        query,
+        "id",
+        checkpoint="retry-all-uploads" if do_all else None,
         work_ids=None if do_all else work_ids,
-    ).fetchall()
+    ):
+        found = True
+
+        for row in rows:
+            try:
+                upload_work(con, works, row)
+            except item_errors() as e:
+                skip(con, "upload", row["id"], e)
 
-    if not rows:
+    if not found:
         log.info("No works require uploading")
-        return
 
-    for row in rows:
-        title = "{title} ({artist})".format(**row)
-        description = "Source: {source_url}".format(**row)
+
+def upload_work(con, works, row):
+    title = "{title} ({artist})".format(**row)
+    description = "Source: {source_url}".format(**row)
+
+    with metrics.timed("upload", kind="album" if row["is_album"] else "image"):
+        # An album and its images have to belong to the same account
+        imgur = con.imgur.pick()
 
         if row["is_album"]:
-            resp = con.imgur.session.post(
+            resp = imgur.session.post(
                 "https://api.imgur.com/3/album",
                 {"title": title, "description": description},
             )
@@ -312,11 +728,11 @@ def upload_to_imgur(con, work_ids=[], last=False, do_all=False):
             con.db.execute(
                 works.update()
                 .values(imgur_id=album_id, imgur_url=link)
-                .where(works["id"] == row["id"])
+                .where(works.c.id == row["id"])
             )
 
             for index, image_url in enumerate(row["source_image_urls"]):
-                resp = con.imgur.upload_url(image_url, album_id=album_id)
+                resp = imgur.upload_url(image_url, album_id=album_id)
 
                 resp.raise_for_status()
 
@@ -325,7 +741,7 @@ def upload_to_imgur(con, work_ids=[], last=False, do_all=False):
                 log.info("Uploaded image %s to %s", index, data["link"])
 
         else:
-            resp = con.imgur.upload_url(row["source_image_url"], title, description)
+            resp = imgur.upload_url(row["source_image_url"], title, description)
 
             resp.raise_for_status()
 
@@ -340,34 +756,145 @@ def upload_to_imgur(con, work_ids=[], last=False, do_all=False):
             log.info("Uploaded at %s", data["link"])
 
 
+# Longest alias chain followed before giving up; guards against cycles
+MAX_ALIAS_DEPTH = 32
+
+
+class ArtistCache:
+    """Maps artist names, aliases included, to their canonical artist ID.
+
+    Only ever filled from the database, and only once what was read has
+    committed, so a hit can skip the upsert entirely.
+
+    """
+
+    def __init__(self):
+        self.ids = {}
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def __getitem__(self, name):
+        return self.ids[name]
+
+    def lookup(self, names):
+        """Return the canonical ID shared by all names, or None if any are unknown."""
+        ids = {self.ids.get(name) for name in names}
+
+        if len(ids) == 1:
+            return ids.pop()
+
+    def store(self, names, artist_id):
+        for name in names:
+            self.ids[name] = artist_id
+
+    def load(self, con, names):
+        """Resolve all known names to canonical IDs in one query and cache them."""
+        names = [name for name in set(names) if name not in self.ids]
+
+        if not names:
+            return
+
+        rows = con.db.execute(
+            sa.text(
+                """WITH RECURSIVE chain AS (
+                    SELECT name AS start, id, alias_of, 1 AS depth
+                    FROM artists WHERE name = ANY(:names)
+                    UNION ALL
+                    SELECT chain.start, artists.id, artists.alias_of, chain.depth + 1
+                    FROM artists INNER JOIN chain ON artists.id = chain.alias_of
+                    WHERE chain.depth < :max_depth
+                ) SELECT start, id FROM chain WHERE alias_of IS NULL"""
+            ),
+            names=names,
+            max_depth=MAX_ALIAS_DEPTH,
+        )
+
+        found = {row["start"]: row["id"] for row in rows}
+
+        con.after_commit(lambda: self.ids.update(found))
+
+
 def do_artists(con, artists):
-    a_upsert = sql.text(
-        """INSERT INTO artists (name, alias_of) VALUES (:name, :alias_of)
-        ON CONFLICT (name) DO UPDATE SET alias_of=NULLIF(:alias_of, artists.id) RETURNING id"""
+    """Upsert an artist and its aliases, returning the canonical artist's ID.
+
+    The first name is the preferred one; if it is already an alias, its chain is
+    followed to the canonical artist and the other names are attached there.
+
+    """
+    artists = tuple(artists)
+
+    pa_id = con.artist_cache.lookup(artists)
+
+    if pa_id is not None:
+        return pa_id
+
+    query = sa.text(
+        """WITH RECURSIVE names AS (
+            SELECT DISTINCT name FROM unnest(CAST(:names AS varchar[])) AS n(name)
+        ), chain AS (
+            SELECT id, name, alias_of, 1 AS depth FROM artists WHERE name = :preferred
+            UNION ALL
+            SELECT artists.id, artists.name, artists.alias_of, chain.depth + 1
+            FROM artists INNER JOIN chain ON artists.id = chain.alias_of
+            WHERE chain.depth < :max_depth
+        ), created AS (
+            INSERT INTO artists (name) SELECT :preferred
+            WHERE NOT EXISTS (SELECT FROM chain)
+            ON CONFLICT (name) DO NOTHING
+            RETURNING id, name
+        ), canonical AS (
+            SELECT id, name FROM chain WHERE alias_of IS NULL
+            UNION ALL
+            SELECT id, name FROM created
+        ), aliased AS (
+            INSERT INTO artists (name, alias_of)
+            SELECT names.name, canonical.id FROM names, canonical
+            WHERE names.name <> :preferred AND names.name <> canonical.name
+            ON CONFLICT (name) DO UPDATE SET alias_of = EXCLUDED.alias_of
+        ) SELECT id FROM canonical"""
     )
-    by_id = sql.text("""SELECT id, name FROM artists WHERE id = :id""")
-    by_name = sql.text("""SELECT id, alias_of FROM artists WHERE name = :name""")
-
-    row = con.db.execute(by_name, name=artists[0]).first()
 
-    preferred_id = None
+    # A concurrent insert of the preferred name leaves nothing to return; the
+    # second attempt then finds it through the chain
+    for _ in range(2):
+        # Engine autocommit doesn't recognise a WITH ... INSERT as a write
+        with con.transaction():
+            row = con.db.execute(
+                query,
+                names=list(artists[1:]),
+                preferred=artists[0],
+                max_depth=MAX_ALIAS_DEPTH,
+            ).first()
 
-    if row and row["alias_of"]:
-        if row["alias_of"]:
-            pa_id = row["alias_of"]
-            artist = con.db.execute(by_id, id=pa_id).first()["name"]
-        else:
-            pa_id = row["id"]
-            artist = artists[0]
+        if row is not None:
+            break
     else:
-        pa_id = con.db.execute(a_upsert, name=artists[0], alias_of=None).first()["id"]
-        artist = artists[0]
+        raise ValueError("Couldn't resolve artist {}".format(artists[0]))
+
+    # IDs from a transaction that's later rolled back would no longer exist
+    artist_id = row["id"]
+    con.after_commit(lambda: con.artist_cache.store(artists, artist_id))
 
-    for a_name in artists[1:]:
-        if a_name != artist:
-            con.db.execute(a_upsert, name=a_name, alias_of=pa_id)
+    return artist_id
 
-    return pa_id
+
+def find_work(con, source_url):
+    """The ID of the work already added from this page, without fetching it.
+
+    Only pages that hold a single work can be told apart this way; for the
+    rest, duplicates are still caught by their image URL when saved.
+
+    """
+    source_url = canonical.canonical(source_url)
+
+    if not canonical.one_work(source_url):
+        return None
+
+    return con.db.execute(
+        sa.text("SELECT id FROM works WHERE source_url = :url ORDER BY id LIMIT 1"),
+        url=source_url,
+    ).scalar()
 
 
 def save_work(con, title, series, artists, source_url, nsfw, source_image_url):
@@ -381,7 +908,7 @@ def save_work(con, title, series, artists, source_url, nsfw, source_image_url):
         "title": title,
         "series": series,
         "artist_id": artist_id,
-        "source_url": source_url,
+        "source_url": canonical.canonical(source_url),
         "nsfw": nsfw,
     }
 
@@ -390,21 +917,59 @@ def save_work(con, title, series, artists, source_url, nsfw, source_image_url):
     else:
         values["source_image_url"] = source_image_url
 
-    query = works.insert(values=values).returning(works.c.id)
+    # Conflicts leave the transaction usable, unlike a failed INSERT
+    query = (
+        postgresql.insert(works)
+        .values(values)
+        .on_conflict_do_nothing(constraint="works_source_image_url_key")
+        .returning(works.c.id)
+    )
 
-    try:
-        work_id = con.db.execute(query).first()["id"]
-    except exc.IntegrityError as e:
-        if e.orig.diag.constraint_name == "works_source_image_url_key":
-            old_id = con.db.execute(
-                select([works.c.id]).where(works.c.source_image_url == source_image_url)
-            ).first()["id"]
-            log.error("This image URL has already been added with ID %s", old_id)
-        else:
-            raise e
+    row = con.db.execute(query).first()
+
+    if row is None:
+        old_id = con.db.execute(
+            sa.select([works.c.id]).where(works.c.source_image_url == source_image_url)
+        ).first()["id"]
+        log.error("This image URL has already been added with ID %s", old_id)
     else:
-        log.info("Work saved with ID %s", work_id)
-        return work_id
+        log.info("Work saved with ID %s", row["id"])
+        return row["id"]
+
+
+def canonicalize_works(con):
+    """Rewrite the source URLs stored before they were canonicalized.
+
+    Returns how many works changed.
+
+    """
+    query = sa.text(
+        """SELECT id, source_url FROM works WHERE id > :after
+        ORDER BY id LIMIT :size"""
+    )
+    update = sa.text(
+        """UPDATE works SET source_url = changed.source_url
+        FROM unnest(CAST(:ids AS integer[]), CAST(:urls AS varchar[]))
+            AS changed(id, source_url)
+        WHERE works.id = changed.id"""
+    )
+
+    changed = 0
+
+    for rows in chunks(con, query, "id", size=CHUNK_SIZE * 10):
+        urls = {}
+
+        for row in rows:
+            url = canonical.canonical(row["source_url"])
+
+            if url != row["source_url"]:
+                urls[row["id"]] = url
+
+        if urls:
+            con.db.execute(update, ids=list(urls), urls=list(urls.values()))
+            changed += len(urls)
+
+    return changed
 
 
 def edit_subreddits(
@@ -420,11 +985,23 @@ def edit_subreddits(
     space_out=True,
     tag_series=False,
     upsert=True,
+    min_width=None,
+    min_height=None,
+    min_aspect=None,
+    max_aspect=None,
+    max_bytes=None,
+    account=None,
 ):
     if len(names) == 0:
         log.info("No subreddits were supplied")
         return
 
+    if account is not None and account not in accounts.credentials(
+        get_secrets(), "reddit"
+    ):
+        log.error("There's no Reddit account named '%s' in secrets.toml", account)
+        return
+
     for name in names:
         status = subreddit_status(name, con.reddit)
 
@@ -440,17 +1017,25 @@ def edit_subreddits(
                 return
 
         con.db.execute(
-            sql.text(
+            sa.text(
                 """INSERT INTO subreddits (name, tag_series, flair_id,
-          require_flair, require_tag, space_out, disabled, sfw_only)
+          require_flair, require_tag, require_series, space_out, disabled,
+          sfw_only, min_width, min_height, min_aspect, max_aspect, max_bytes,
+          account)
           VALUES (:name, :tag_series, :flair_id, :require_flair,
-          :require_tag, :space_out, :disabled, :sfw_only) ON CONFLICT (name) DO """
+          :require_tag, :require_series, :space_out, :disabled, :sfw_only,
+          :min_width, :min_height, :min_aspect, :max_aspect, :max_bytes,
+          :account)
+          ON CONFLICT (name) DO """
                 + (
                     """UPDATE SET
           tag_series = :tag_series, flair_id = :flair_id,
           require_flair = :require_flair, require_tag = :require_tag,
           require_series = :require_series, space_out = :space_out,
-          disabled = :disabled, sfw_only=:sfw_only"""
+          disabled = :disabled, sfw_only=:sfw_only,
+          min_width = :min_width, min_height = :min_height,
+          min_aspect = :min_aspect, max_aspect = :max_aspect,
+          max_bytes = :max_bytes, account = :account"""
                     if upsert
                     else "NOTHING"
                 )
@@ -464,55 +1049,98 @@ def edit_subreddits(
             space_out=space_out,
             disabled=disabled,
             sfw_only=sfw_only,
+            min_width=min_width,
+            min_height=min_height,
+            min_aspect=min_aspect,
+            max_aspect=max_aspect,
+            max_bytes=max_bytes,
+            account=account,
         )
 
 
-def add_submissions(con, work_id, specifiers):
+def probe_images(con, specifiers, image_urls):
+    """Probe a work's images, if any of the subreddits has rules about them.
+
+    Images are only fetched, and then only their headers, when needed. Done
+    before a work is saved, so no transaction is held open while waiting on
+    the image hosts.
+
+    """
+    if len(specifiers) == 0:
+        return ()
+
+    sr_rules = rules.load(con, specifiers.names)
+
+    if not any(map(rules.checks_images, sr_rules.values())):
+        return ()
+
+    if not isinstance(image_urls, list):
+        image_urls = [image_urls]
+
+    return [image for image in map(probe.probe, image_urls) if image is not None]
+
+
+def add_submissions(con, work_id, specifiers, images=None):
+    """Add a work's submissions, checking them against the subreddits' rules.
+
+    ``images`` are the work's probed images, from probe_images; they're probed
+    here if not given.
+
+    """
     if len(specifiers) == 0:
         log.info("No submissions were given")
         return
 
-    submissions = con.meta.tables["submissions"]
-    subreddits = con.meta.tables["subreddits"]
-
-    query = submissions.insert().values(
-        work_id=work_id,
-        subreddit_id=select([subreddits.c.id]).where(
-            subreddits.c.name == bp("subreddit_name")
+    work = con.db.execute(
+        sa.text(
+            """SELECT series, nsfw, source_image_url, source_image_urls
+            FROM works WHERE id = :id"""
         ),
-        flair_id=bp("flair_id"),
-        custom_tag=bp("custom_tag"),
-    )
+        id=work_id,
+    ).first()
 
-    for triple in specifiers.n_f_t:
-        try:
-            con.db.execute(
-                query,
-                subreddit_name=triple[0],
-                flair_id=triple[1],
-                custom_tag=triple[2],
-            )
+    if work is None:
+        log.error("Work %s does not exist", work_id)
+        return
 
-        except exc.IntegrityError as e:
-            msg = {
-                "check_require_flair": "/r/%s requires a flair",
-                "check_require_series": "/r/%s requires a series",
-                "check_require_tag": "/r/%s requires a tag",
-                "already_exists": "/r/%s already has this work",
-            }.get(e.orig.diag.constraint_name, None)
+    if images is None:
+        images = probe_images(
+            con, specifiers, work["source_image_urls"] or work["source_image_url"]
+        )
 
-            if (
-                e.orig.pgcode == errorcodes.NOT_NULL_VIOLATION
-                and e.orig.diag.column_name == "subreddit_id"
-            ):
-                msg = "/r/%s is unknown"
+    sr_rules = rules.load(con, specifiers.names)
 
-            if not msg:
-                raise e
+    # Rules are checked in memory so every problem is reported at once; the
+    # CHECK constraints stay as a backstop
+    accepted, rejected = rules.validate(
+        sr_rules, work["series"], work["nsfw"], specifiers.n_f_t, images
+    )
 
-            log.warning(msg, triple[0])
-        else:
-            log.info("Added to /r/%s", triple[0])
+    if accepted:
+        result = con.db.execute(
+            sa.text(
+                """INSERT INTO submissions (work_id, subreddit_id, flair_id, custom_tag)
+                SELECT :work_id, * FROM unnest(CAST(:subreddit_ids AS integer[]),
+                    CAST(:flair_ids AS varchar[]), CAST(:tags AS varchar[]))
+                ON CONFLICT ON CONSTRAINT already_exists DO NOTHING
+                RETURNING subreddit_id"""
+            ),
+            work_id=work_id,
+            subreddit_ids=[s.subreddit_id for s in accepted],
+            flair_ids=[s.flair_id for s in accepted],
+            tags=[s.tag for s in accepted],
+        )
+
+        inserted = {row["subreddit_id"] for row in result}
+
+        for submission in accepted:
+            if submission.subreddit_id in inserted:
+                log.info("Added to /r/%s", submission.name)
+            else:
+                rejected.append(rules.Rejected(submission.name, "already_exists"))
+
+    for name, problem in rejected:
+        log.warning("/r/%s %s", name, rules.PROBLEMS[problem])
 
 
 class SubStatus(enum.Enum):
@@ -542,17 +1170,17 @@ def subreddit_status(subreddit, reddit=None):
 
     try:
         subreddit._fetch()
-    except exceptions.PrawcoreException as exp:
+    except prawcore.exceptions.PrawcoreException as exp:
         return subreddit_status_handle(exp)
     return SubStatus.OK
 
 
 def subreddit_status_handle(exp):
-    if isinstance(exp, exceptions.Redirect):
+    if isinstance(exp, prawcore.exceptions.Redirect):
         return SubStatus.NONEXISTENT
-    elif isinstance(exp, exceptions.NotFound):
+    elif isinstance(exp, prawcore.exceptions.NotFound):
         return SubStatus.BANNED
-    elif isinstance(exp, exceptions.Forbidden):
+    elif isinstance(exp, prawcore.exceptions.Forbidden):
         return SubStatus.PRIVATE
 
     raise exp
@@ -0,0 +1,296 @@
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from .lazy import lazy_import
+
+h = lazy_import("errantbot.helper")
+net = lazy_import("errantbot.net")
+sa = lazy_import("sqlalchemy")
+
+log = logging.getLogger(__name__)
+
+KINDS = ("upload", "post")
+
+# A job that fails this many times is left in the table for inspection
+MAX_ATTEMPTS = 5
+
+# Seconds before a failed job is retried, doubled on every further attempt
+RETRY_DELAY = 300
+
+# Seconds to wait before looking at a blocked post again
+BLOCKED_DELAY = 3600
+
+ENQUEUE = {
+    "upload": """INSERT INTO jobs (kind, work_id)
+        SELECT 'upload', id FROM works WHERE imgur_id IS NULL
+        AND (CAST(:work_ids AS integer[]) IS NULL OR id = ANY(:work_ids))
+        ON CONFLICT DO NOTHING""",
+    "post": """INSERT INTO jobs (kind, work_id, submission_id)
+        SELECT 'post', work_id, id FROM submissions WHERE reddit_id IS NULL
+        AND (CAST(:work_ids AS integer[]) IS NULL OR work_id = ANY(:work_ids))
+        ON CONFLICT DO NOTHING""",
+}
+
+# SKIP LOCKED lets any number of workers claim concurrently without blocking on,
+# or handing out, the same row; an expired lease means its worker died
+CLAIM = """UPDATE jobs SET leased_by = :worker, attempts = attempts + 1,
+        leased_until = now() AT TIME ZONE 'utc' + make_interval(secs => :lease)
+    WHERE id = (SELECT id FROM jobs
+        WHERE kind = ANY(:kinds) AND attempts < :max_attempts
+        AND run_after <= now() AT TIME ZONE 'utc'
+        AND (leased_until IS NULL OR leased_until < now() AT TIME ZONE 'utc')
+        ORDER BY run_after, id LIMIT 1 FOR UPDATE SKIP LOCKED)
+    RETURNING id, kind, work_id, submission_id, attempts"""
+
+
+def worker_name():
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+def enqueue(con, kinds=KINDS, work_ids=None):
+    """Queue uploads for works without one and posts for unposted submissions.
+
+    Only ``work_ids`` are considered if given; jobs already queued are kept.
+
+    """
+    count = 0
+
+    with con.transaction() as connection:
+        for kind in kinds:
+            count += connection.execute(
+                sa.text(ENQUEUE[kind]), work_ids=list(work_ids) if work_ids else None
+            ).rowcount
+
+    log.info("Queued %s jobs", count)
+
+    return count
+
+
+def claim(con, worker, kinds=KINDS, lease=300):
+    return con.db.execute(
+        sa.text(CLAIM),
+        worker=worker,
+        lease=lease,
+        kinds=list(kinds),
+        max_attempts=MAX_ATTEMPTS,
+    ).first()
+
+
+def finish(con, job, worker):
+    con.db.execute(
+        sa.text("DELETE FROM jobs WHERE id = :id AND leased_by = :worker"),
+        id=job["id"],
+        worker=worker,
+    )
+
+
+def reschedule(con, job, worker, delay, error=None, count=True):
+    """Release a job to run again after ``delay`` seconds.
+
+    With ``count`` false the attempt isn't held against the job, for when it
+    was only waiting on something else.
+
+    """
+    con.db.execute(
+        sa.text(
+            """UPDATE jobs SET leased_by = NULL, leased_until = NULL,
+                last_error = COALESCE(:error, last_error),
+                attempts = attempts - CASE WHEN :count THEN 0 ELSE 1 END,
+                run_after = now() AT TIME ZONE 'utc' + make_interval(secs => :delay)
+            WHERE id = :id AND leased_by = :worker"""
+        ),
+        id=job["id"],
+        worker=worker,
+        delay=delay,
+        error=error,
+        count=count,
+    )
+
+
+def record_failure(con, kind, work_id, error):
+    """Count a failure outside the queue against a work's unleased jobs.
+
+    They back off as if a worker had failed them.
+
+    """
+    con.db.execute(
+        sa.text(
+            """UPDATE jobs SET attempts = attempts + 1, last_error = :error,
+                run_after = now() AT TIME ZONE 'utc'
+                    + make_interval(secs => :delay * 2 ^ attempts)
+            WHERE kind = :kind AND work_id = :work_id AND leased_by IS NULL"""
+        ),
+        kind=kind,
+        work_id=work_id,
+        error=error,
+        delay=RETRY_DELAY,
+    )
+
+
+class Heartbeat(threading.Thread):
+    """Extends a job's lease while it runs, so a slow job isn't taken for dead."""
+
+    def __init__(self, con, job, worker, lease):
+        super().__init__(daemon=True)
+        self.con = con
+        self.job = job
+        self.worker = worker
+        self.lease = lease
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.lease / 3):
+            self.con.db.execute(
+                sa.text(
+                    """UPDATE jobs SET leased_until = now() AT TIME ZONE 'utc'
+                        + make_interval(secs => :lease)
+                    WHERE id = :id AND leased_by = :worker"""
+                ),
+                id=self.job["id"],
+                worker=self.worker,
+                lease=self.lease,
+            )
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.join()
+
+
+def run_upload(con, job, worker, wait):
+    row = con.db.execute(
+        sa.text(h.PENDING_UPLOADS + " AND works.id = :work_id"), work_id=job["work_id"]
+    ).first()
+
+    if row is not None:
+        h.upload_work(con, con.meta.tables["works"], row)
+
+    finish(con, job, worker)
+
+
+def run_post(con, job, worker, wait):
+    # Posts to one subreddit are serialised, so space_out holds across workers
+    # and alongside retry and retry-all
+    with h.post_lock(con, job["submission_id"]):
+        # Read once the lock is held, so it sees what whoever held it before
+        # committed
+        sr_row = con.db.execute(
+            sa.text(
+                """SELECT subreddits.id, space_out, last_submission_on, reddit_id
+                FROM submissions INNER JOIN subreddits ON subreddits.id = subreddit_id
+                WHERE submissions.id = :id"""
+            ),
+            id=job["submission_id"],
+        ).first()
+
+        if sr_row is None or sr_row["reddit_id"] is not None:
+            finish(con, job, worker)
+            return
+
+        last = sr_row["last_submission_on"]
+        if wait and sr_row["space_out"] and last is not None:
+            remaining = (
+                last + timedelta(hours=wait) - datetime.utcnow()
+            ).total_seconds()
+            if remaining > 0:
+                reschedule(con, job, worker, remaining, count=False)
+                return
+
+        row = con.db.execute(
+            sa.text(h.PENDING_POSTS + " AND submissions.id = :submission_id"),
+            submission_id=job["submission_id"],
+        ).first()
+
+        # Disabled, waiting for a crosspost source or for its upload
+        if row is None or (row["imgur_url"] is None and row["crosspost_id"] is None):
+            reschedule(con, job, worker, BLOCKED_DELAY, count=False)
+            return
+
+        # Records the post itself the moment it's made, so a retry of a job
+        # that fails after that finds it posted
+        outcome = h.do_post(con, row, wait)
+
+        if outcome is h.PostOutcome.POSTED:
+            finish(con, job, worker)
+        elif outcome is h.PostOutcome.REJECTED:
+            reschedule(
+                con,
+                job,
+                worker,
+                RETRY_DELAY * 2 ** (job["attempts"] - 1),
+                "submission was rejected",
+            )
+        else:
+            # Waiting out space_out or disabled since the checks above
+            reschedule(con, job, worker, BLOCKED_DELAY, count=False)
+
+
+RUNNERS = {"upload": run_upload, "post": run_post}
+
+
+def work(con, kinds=KINDS, lease=300, wait=18, poll=30, once=False):
+    """Claim and run jobs until interrupted, or until none are due with ``once``.
+
+    Any number of workers, on any number of machines, can share one queue.
+
+    """
+    worker = worker_name()
+
+    log.info("Worker %s started", worker)
+
+    while True:
+        job = claim(con, worker, kinds, lease)
+
+        if job is None:
+            if once:
+                log.info("No jobs left")
+                return
+
+            time.sleep(poll)
+            continue
+
+        log.info(
+            "Running %s job %s for work %s", job["kind"], job["id"], job["work_id"]
+        )
+
+        try:
+            with Heartbeat(con, job, worker, lease):
+                RUNNERS[job["kind"]](con, job, worker, wait)
+        except KeyboardInterrupt:
+            reschedule(con, job, worker, 0, count=False)
+            raise
+        except Exception as e:
+            log.error("%s job %s failed: %s", job["kind"].title(), job["id"], e)
+
+            circuit = net.circuit_open(e)
+
+            # A host that's known to be down isn't the job's fault
+            if circuit:
+                reschedule(
+                    con, job, worker, circuit.until - time.time(), str(e), count=False
+                )
+            else:
+                reschedule(
+                    con, job, worker, RETRY_DELAY * 2 ** (job["attempts"] - 1), str(e)
+                )
+
+
+def list_jobs(con, failed=False):
+    return con.db.execute(
+        sa.text(
+            """SELECT jobs.id, kind, jobs.work_id, subreddits.name AS subreddit,
+                attempts, run_after, leased_by, last_error
+            FROM jobs LEFT JOIN submissions ON submissions.id = submission_id
+            LEFT JOIN subreddits ON subreddits.id = subreddit_id"""
+            + (" WHERE attempts >= :max_attempts" if failed else "")
+            + " ORDER BY run_after, jobs.id"
+        ),
+        max_attempts=MAX_ATTEMPTS,
+    )
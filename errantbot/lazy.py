@@ -0,0 +1,98 @@
+import _thread
+import importlib.machinery
+import importlib.util
+import sys
+import types
+
+
+class _LazyModule(importlib.util._LazyModule):
+    """Python 3.12's thread-safe lazy module, for the versions before it.
+
+    Earlier versions swap the module's class back before running it, so a
+    second thread touching the module mid-load finds it half initialised.
+    Pipeline stages and audit workers are often the first to touch one.
+
+    """
+
+    def __getattribute__(self, attr):
+        spec = object.__getattribute__(self, "__spec__")
+        loader_state = spec.loader_state
+
+        with loader_state["lock"]:
+            # Only the first thread in loads the module; the others wait here
+            if object.__getattribute__(self, "__class__") is _LazyModule:
+                # The module's own code, while it runs, sees it as it stands
+                if loader_state["is_loading"]:
+                    return types.ModuleType.__getattribute__(self, attr)
+
+                loader_state["is_loading"] = True
+
+                attrs = types.ModuleType.__getattribute__(self, "__dict__")
+                before = loader_state["__dict__"]
+                # Attributes set before the load survive it, as they would
+                # have if the module had been imported first
+                updated = {
+                    key: value
+                    for key, value in attrs.items()
+                    if key not in before or value is not before[key]
+                }
+
+                spec.loader.exec_module(self)
+                attrs.update(updated)
+                self.__class__ = types.ModuleType
+
+        return getattr(self, attr)
+
+
+class _LazyLoader(importlib.util.LazyLoader):
+    def exec_module(self, module):
+        super().exec_module(module)
+
+        # Past this point any other attribute access would load the module
+        module.__class__ = _LazyModule
+        spec = object.__getattribute__(module, "__spec__")
+        spec.loader_state.update(lock=_thread.RLock(), is_loading=False)
+
+
+LazyLoader = importlib.util.LazyLoader if sys.version_info >= (3, 12) else _LazyLoader
+
+
+def lazy_import(name):
+    """Return a module whose import runs on first attribute access.
+
+    Keeps heavy dependencies (SQLAlchemy, praw, bs4...) off the startup path of
+    commands that never touch them. Safe to first touch from several threads.
+    Submodules leave their packages unloaded too.
+
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    parent_name, _, child = name.rpartition(".")
+
+    if parent_name:
+        # find_spec would import the package to learn where its submodules
+        # are, but its spec already knows without running it
+        parent = lazy_import(parent_name)
+        path = object.__getattribute__(parent, "__spec__").submodule_search_locations
+        spec = importlib.machinery.PathFinder.find_spec(name, path)
+    else:
+        spec = importlib.util.find_spec(name)
+
+    loader = LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+
+    if parent_name:
+        # As the import system would, and which sqlalchemy's dialect lookup
+        # relies on
+        setattr(parent, child, module)
+
+    return module
+
+
+def loaded(module):
+    """Whether ``module`` has run, found without running it if it hasn't."""
+    return not issubclass(type(module), importlib.util._LazyModule)
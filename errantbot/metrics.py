@@ -0,0 +1,299 @@
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+log = logging.getLogger(__name__)
+
+PREFIX = "errantbot_"
+
+# Upper bounds in seconds, from a quick query to a slow upload
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+DESCRIPTIONS = {
+    "extract": "Extracting a work from its source page, by site",
+    "upload": "Uploading a work to Imgur",
+    "post": "Submitting to a subreddit",
+    "db": "Executing a database statement, by statement type",
+    "http": "One HTTP request attempt, by host and status",
+    "skipped": "Items handed to the job queue after a transient failure",
+    "links": "Stored links audited, by kind and result",
+}
+
+# Nothing is recorded until a CLI option turns this on, so instrumented code
+# pays for one global lookup
+enabled = False
+
+lock = threading.Lock()
+counters = {}
+histograms = {}
+
+
+class Histogram:
+    __slots__ = ("buckets", "sum", "count")
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.buckets[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the ``q`` quantile.
+
+        None if it's past the last bucket.
+
+        """
+        rank = q * self.count
+        seen = 0
+
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+
+        return None
+
+
+def key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    if not enabled:
+        return
+
+    with lock:
+        series = counters.setdefault(name, {})
+        series[key(labels)] = series.get(key(labels), 0) + amount
+
+
+def observe(name, seconds, **labels):
+    if not enabled:
+        return
+
+    with lock:
+        series = histograms.setdefault(name, {})
+        histogram = series.get(key(labels))
+
+        if histogram is None:
+            histogram = series[key(labels)] = Histogram()
+
+        histogram.observe(seconds)
+
+
+class Timer:
+    """Times a block into a histogram, labelled with its outcome.
+
+    The block gets the labels as a dict, so it can set its own ``outcome``;
+    otherwise it's "ok", or "error" if the block raised.
+
+    """
+
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self.labels
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.labels.setdefault("outcome", "ok" if exc_type is None else "error")
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+class NullTimer:
+    def __enter__(self):
+        return {}
+
+    def __exit__(self, exc_type, exc, traceback):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def timed(name, **labels):
+    if not enabled:
+        return NULL_TIMER
+
+    return Timer(name, labels)
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+
+    if not pairs:
+        return ""
+
+    return (
+        "{"
+        + ",".join(
+            '{}="{}"'.format(name, str(value).replace("\\", r"\\").replace('"', r"\""))
+            for name, value in pairs
+        )
+        + "}"
+    )
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+
+    with lock:
+        for name, series in sorted(counters.items()):
+            full = PREFIX + name + "_total"
+
+            lines.append("# HELP {} {}".format(full, DESCRIPTIONS.get(name, name)))
+            lines.append("# TYPE {} counter".format(full))
+
+            for labels, value in sorted(series.items()):
+                lines.append("{}{} {}".format(full, format_labels(labels), value))
+
+        for name, series in sorted(histograms.items()):
+            full = PREFIX + name + "_seconds"
+
+            lines.append("# HELP {} {}".format(full, DESCRIPTIONS.get(name, name)))
+            lines.append("# TYPE {} histogram".format(full))
+
+            for labels, histogram in sorted(series.items()):
+                cumulative = 0
+
+                for bound, count in zip(BUCKETS + ("+Inf",), histogram.buckets):
+                    cumulative += count
+                    lines.append(
+                        "{}_bucket{} {}".format(
+                            full, format_labels(labels, le=bound), cumulative
+                        )
+                    )
+
+                lines.append(
+                    "{}_sum{} {}".format(full, format_labels(labels), histogram.sum)
+                )
+                lines.append(
+                    "{}_count{} {}".format(full, format_labels(labels), histogram.count)
+                )
+
+    return "\n".join(lines) + "\n"
+
+
+def summary():
+    """Counts and latencies as plain data, for a JSON report."""
+    with lock:
+        return {
+            "counters": [
+                dict(labels, name=name, value=value)
+                for name, series in sorted(counters.items())
+                for labels, value in sorted(series.items())
+            ],
+            "timings": [
+                dict(
+                    labels,
+                    name=name,
+                    count=histogram.count,
+                    seconds=round(histogram.sum, 6),
+                    mean=round(histogram.sum / histogram.count, 6),
+                    p50=histogram.quantile(0.5),
+                    p95=histogram.quantile(0.95),
+                )
+                for name, series in sorted(histograms.items())
+                for labels, histogram in sorted(series.items())
+            ],
+        }
+
+
+def write(path):
+    """Write the metrics to ``path``, replacing it atomically.
+
+    Paths ending in .prom get the Prometheus format, for node_exporter's
+    textfile collector; anything else gets the JSON summary.
+
+    """
+    if path.endswith(".prom"):
+        text = render()
+    else:
+        text = json.dumps(summary(), indent=2, default=str) + "\n"
+
+    temp = path + ".tmp"
+
+    with open(temp, mode="w") as metrics_file:
+        metrics_file.write(text)
+
+    os.replace(temp, path)
+
+
+def instrument(engine):
+    """Time every statement ``engine`` executes, by its first keyword."""
+    from sqlalchemy import event
+
+    def kind(statement):
+        return statement.lstrip().split(None, 1)[0].upper()
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["metrics_started"].pop()
+
+        observe(
+            "db", time.perf_counter() - started, statement=kind(statement), outcome="ok"
+        )
+
+    @event.listens_for(engine, "handle_error")
+    def error(context):
+        started = context.connection and context.connection.info.get("metrics_started")
+
+        if started:
+            observe(
+                "db",
+                time.perf_counter() - started.pop(),
+                statement=kind(context.statement or "?"),
+                outcome="error",
+            )
+
+
+def serve(port, host=""):
+    """Serve /metrics for Prometheus from a background thread."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+
+            body = render().encode("utf-8")
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+
+    log.info("Serving metrics at http://%s:%s/metrics", host or "localhost", port)
+
+    return server
@@ -0,0 +1,320 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import exceptions as exc
+from .lazy import lazy_import
+
+metrics = lazy_import("errantbot.metrics")
+profiling = lazy_import("errantbot.profiling")
+
+log = logging.getLogger(__name__)
+
+# Statuses worth another try; a POST is only repeated when the server
+# certainly didn't act on it
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+RETRY_POST_STATUSES = frozenset((429, 503))
+
+MAX_RETRIES = 4
+
+# Seconds; each delay is drawn uniformly below base * 2 ** attempt, up to the cap
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+
+# Connect and read timeouts for requests that don't set their own
+TIMEOUT = (10, 60)
+
+# Consecutive failures that open a host's breaker, and how long it stays open;
+# the cooldown doubles each time a trial request fails, up to the cap
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 60
+BREAKER_MAX_COOLDOWN = 3600
+
+# Kept next to the token files so every run shares what earlier runs learned
+BREAKER_FILE = "breakers.json"
+
+# Sends requests for some hosts elsewhere, as "host=http://127.0.0.1:8000,..."
+# with * for every host; the original host goes in the Host header. Used by the
+# benchmarks to point all clients at local stand-ins
+REMAP_ENV = "ERRANTBOT_REMAP"
+
+
+class CircuitOpen(exc.EBException, requests.exceptions.ConnectionError):
+    def __init__(self, host, until):
+        self.host = host
+        self.until = until
+
+        self.args = (
+            "{} is failing; not contacting it for another {:.0f}s".format(
+                host, until - time.time()
+            ),
+        )
+
+
+class Breakers:
+    """Per-host circuit breakers, persisted in a JSON file between runs."""
+
+    def __init__(self, path=BREAKER_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        self.state = None
+
+    def load(self):
+        if self.state is None:
+            try:
+                with open(self.path) as breaker_file:
+                    self.state = json.load(breaker_file)
+            except (OSError, ValueError):
+                self.state = {}
+
+        return self.state
+
+    def save(self):
+        temp = self.path + ".tmp"
+
+        with open(temp, mode="w") as breaker_file:
+            json.dump(self.state, breaker_file)
+
+        os.replace(temp, self.path)
+
+    def check(self, host):
+        """Raise CircuitOpen if ``host`` shouldn't be contacted yet.
+
+        Once the cooldown is over requests go through again; the next failure
+        reopens the breaker straight away.
+
+        """
+        with self.lock:
+            host_state = self.load().get(host)
+
+        if host_state and host_state["open_until"] > time.time():
+            raise CircuitOpen(host, host_state["open_until"])
+
+    def success(self, host):
+        with self.lock:
+            if self.load().pop(host, None) is not None:
+                log.info("%s is responding again", host)
+                self.save()
+
+    def failure(self, host):
+        with self.lock:
+            host_state = self.load().setdefault(
+                host, {"failures": 0, "cooldown": 0, "open_until": 0}
+            )
+
+            host_state["failures"] += 1
+
+            if host_state["failures"] >= BREAKER_THRESHOLD:
+                host_state["cooldown"] = min(
+                    max(host_state["cooldown"] * 2, BREAKER_COOLDOWN),
+                    BREAKER_MAX_COOLDOWN,
+                )
+                host_state["open_until"] = time.time() + host_state["cooldown"]
+
+                log.warning(
+                    "%s failed %s times in a row; pausing requests for %ss",
+                    host,
+                    host_state["failures"],
+                    host_state["cooldown"],
+                )
+
+                self.save()
+
+
+breakers = Breakers()
+
+# Host -> [count, seconds] of every request attempt this process made
+calls = {}
+
+
+def backoff(attempt):
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+
+
+def retry_after(response):
+    """Seconds asked for by a Retry-After header, if it's sensible."""
+    value = response.headers.get("Retry-After")
+
+    if value is None:
+        return None
+
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            delay = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+
+    return max(delay, 0)
+
+
+_remap = None
+
+
+def remap(request):
+    """Point ``request`` at the stand-in configured for its host, if any."""
+    global _remap
+
+    if _remap is None:
+        _remap = dict(
+            entry.split("=", 1)
+            for entry in os.environ.get(REMAP_ENV, "").split(",")
+            if entry
+        )
+
+    if not _remap:
+        return
+
+    parts = urlparse(request.url)
+    target = _remap.get(parts.hostname) or _remap.get("*")
+
+    if target:
+        request.headers["Host"] = parts.netloc
+        request.url = target.rstrip("/") + request.path_url
+
+
+def record(host, start, outcome):
+    seconds = time.perf_counter() - start
+
+    profiling.record(calls, host, seconds)
+    metrics.observe("http", seconds, host=host, outcome=outcome)
+
+
+# Set from the CLI to record every response to, or replay them all from, a
+# cassette.Cassette
+cassette = None
+
+
+class ResilientAdapter(HTTPAdapter):
+    """Retries transient failures with jittered backoff behind a host's breaker."""
+
+    def send(self, request, **kwargs):
+        if cassette is None:
+            return self.send_with_retries(request, **kwargs)
+
+        # Replays skip the network, retries and breakers altogether
+        if cassette.replaying:
+            return cassette.play(request)
+
+        method, url, body = request.method, request.url, request.body
+
+        response = self.send_with_retries(request, **kwargs)
+
+        if kwargs.get("stream"):
+            cassette.record_stream(method, url, body, response)
+        else:
+            cassette.record(method, url, body, response)
+
+        return response
+
+    def send_with_retries(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = TIMEOUT
+
+        host = urlparse(request.url).hostname
+        idempotent = request.method not in ("POST", "PATCH")
+
+        remap(request)
+
+        for attempt in range(MAX_RETRIES + 1):
+            breakers.check(host)
+
+            start = time.perf_counter()
+
+            try:
+                response = super().send(request, **kwargs)
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ) as e:
+                record(host, start, type(e).__name__)
+                breakers.failure(host)
+
+                retryable = idempotent or isinstance(
+                    e, requests.exceptions.ConnectTimeout
+                )
+
+                if attempt == MAX_RETRIES or not retryable:
+                    raise
+
+                reason = type(e).__name__
+                delay = backoff(attempt)
+            else:
+                record(host, start, response.status_code)
+
+                if response.status_code not in RETRY_STATUSES:
+                    breakers.success(host)
+                    return response
+
+                # A host that limits our rate is up, only busy with us
+                if response.status_code != 429:
+                    breakers.failure(host)
+
+                retryable = idempotent or response.status_code in RETRY_POST_STATUSES
+
+                if attempt == MAX_RETRIES or not retryable:
+                    return response
+
+                reason = response.status_code
+                delay = retry_after(response)
+                if delay is None:
+                    delay = backoff(attempt)
+                elif delay > BACKOFF_MAX:
+                    # Too long to wait here, and asking sooner would only be
+                    # refused again; the item is skipped and queued instead
+                    return response
+
+                response.close()
+
+            log.warning(
+                "%s %s got %s; retrying in %.1fs", request.method, host, reason, delay
+            )
+
+            time.sleep(delay)
+
+
+def mount(session, **kwargs):
+    """Route a session's requests through a ResilientAdapter.
+
+    ``kwargs`` go to the adapter, to size its connection pools.
+
+    """
+    adapter = ResilientAdapter(**kwargs)
+
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return session
+
+
+_session = None
+
+
+def session():
+    """The requests session shared by extractors and API clients."""
+    global _session
+
+    if _session is None:
+        _session = mount(requests.Session())
+
+    return _session
+
+
+def circuit_open(error):
+    """The CircuitOpen behind ``error``, even when a client library wrapped it."""
+    while error is not None:
+        if isinstance(error, CircuitOpen):
+            return error
+
+        error = getattr(error, "original_exception", None) or error.__context__
+
+    return None
@@ -0,0 +1,62 @@
+import csv
+import io
+import json
+from decimal import Decimal
+
+import click
+
+from .lazy import lazy_import
+
+tabulate = lazy_import("tabulate")
+
+FORMATS = ("table", "json", "csv")
+
+
+def write_rows(rows, headers, fmt="table"):
+    """Write rows to stdout as a table, a JSON array or CSV.
+
+    JSON and CSV are written a row at a time, so a streamed result is never held
+    in memory; a table has to be measured first, so it is buffered.
+
+    """
+    if fmt == "table":
+        click.echo(tabulate.tabulate(list(map(tuple, rows)), headers=headers))
+    elif fmt == "json":
+        write_json(rows, headers)
+    elif fmt == "csv":
+        write_csv(rows, headers)
+    else:
+        raise ValueError("Unknown output format {}".format(fmt))
+
+
+def json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+def write_json(rows, headers):
+    separator = "["
+
+    for row in rows:
+        click.echo(separator, nl=False)
+        click.echo(json.dumps(dict(zip(headers, row)), default=json_default), nl=False)
+        separator = ",\n "
+
+    click.echo("[]" if separator == "[" else "]")
+
+
+def write_csv(rows, headers):
+    out = io.StringIO()
+    writer = csv.writer(out)
+
+    writer.writerow(headers)
+
+    for row in rows:
+        click.echo(out.getvalue(), nl=False)
+        out.seek(0)
+        out.truncate()
+
+        writer.writerow(row)
+
+    click.echo(out.getvalue(), nl=False)
@@ -1,7 +1,17 @@
-import regex
-import validators as val
+from functools import lru_cache
+
 from click import ParamType
 
+from .lazy import lazy_import
+
+regex = lazy_import("regex")
+val = lazy_import("validators")
+
+
+@lru_cache(maxsize=None)
+def compiled(pattern):
+    return regex.compile(pattern)
+
 
 class URL(ParamType):
     name = "URL"
@@ -16,13 +26,13 @@ class URL(ParamType):
 class FlairID(ParamType):
     name = "flair ID"
 
-    val_flair_id = regex.compile(r"([a-f0-9]){8}-(?1){4}-(?1){4}-(?1){4}-(?1){12}")
+    val_flair_id = r"([a-f0-9]){8}-(?1){4}-(?1){4}-(?1){4}-(?1){12}"
 
     @classmethod
     def process(cls, value, ctx=None):
         value = value.lower()
 
-        if cls.val_flair_id.fullmatch(value):
+        if compiled(cls.val_flair_id).fullmatch(value):
             return value
         else:
             return False
@@ -39,13 +49,13 @@ class Subreddit(ParamType):
     name = "subreddit"
 
     # Found in Reddit's old source code - RIP
-    val_subreddit_name = regex.compile(r"[A-Za-z0-9][A-Za-z0-9_]{2,20}")
+    val_subreddit_name = r"[A-Za-z0-9][A-Za-z0-9_]{2,20}"
 
     @classmethod
     def process(cls, value):
         value = value.replace("/r/", "")
 
-        if not cls.val_subreddit_name.fullmatch(value):
+        if not compiled(cls.val_subreddit_name).fullmatch(value):
             return False
         else:
             return value.lower()
@@ -61,12 +71,12 @@ class Subreddit(ParamType):
 class Submission(ParamType):
     name = "submission specifier"
 
-    find_name = regex.compile(r"^[^@+]*")
-    find_flair_id = regex.compile(r"@((?:(?:%\+)|[^+])*)")
-    find_tag = regex.compile(r"\+(.*)$")
+    find_name = r"^[^@+]*"
+    find_flair_id = r"@((?:(?:%\+)|[^+])*)"
+    find_tag = r"\+(.*)$"
 
     def convert(self, value, param, ctx):
-        name = self.find_name.search(value)
+        name = compiled(self.find_name).search(value)
         if not name:
             self.fail("Subreddit name not found in '{}'".format(value), param, ctx)
 
@@ -74,7 +84,7 @@ class Submission(ParamType):
         if not name:
             self.fail("'{}' is not a valid subreddit name".format(name), param, ctx)
 
-        flair_id = self.find_flair_id.search(value)
+        flair_id = compiled(self.find_flair_id).search(value)
 
         if flair_id:
             flair_id = flair_id[1]
@@ -97,7 +107,7 @@ class Submission(ParamType):
                         ctx,
                     )
 
-        tag = self.find_tag.search(value)
+        tag = compiled(self.find_tag).search(value)
         if tag:
             tag = tag[1]
 
@@ -0,0 +1,209 @@
+import logging
+import queue
+import threading
+from collections import namedtuple
+
+from .lazy import lazy_import
+
+bulk = lazy_import("errantbot.bulk")
+extract = lazy_import("errantbot.extract")
+h = lazy_import("errantbot.helper")
+jobs = lazy_import("errantbot.jobs")
+sa = lazy_import("sqlalchemy")
+val = lazy_import("validators")
+
+log = logging.getLogger(__name__)
+
+Item = namedtuple("Item", ["line", "url", "specifiers", "work_id"])
+
+# Marks the end of the input as it passes from stage to stage
+DONE = object()
+
+
+def read_lines(stream):
+    """Parse ``URL name@flair_id+tag ...`` lines, skipping blanks and comments.
+
+    Like import, specifiers are read offline, so flairs must be given by ID.
+
+    """
+    for line, text in enumerate(stream, start=1):
+        fields = text.split()
+
+        if not fields or fields[0].startswith("#"):
+            continue
+
+        url, values = fields[0], fields[1:]
+
+        if not val.url(url):
+            log.error("Line %s: '%s' is not a valid URL", line, url)
+            continue
+
+        try:
+            specifiers = [bulk.parse_specifier(value) for value in values]
+        except ValueError as e:
+            log.error("Line %s: %s", line, e)
+            continue
+
+        yield Item(line, url, specifiers, None)
+
+
+class Stage(threading.Thread):
+    """Runs ``func`` on each item from ``inbox`` and passes results to ``outbox``.
+
+    A full ``outbox`` blocks the stage, so a slow stage holds back the ones
+    before it instead of letting work pile up in memory.
+
+    """
+
+    def __init__(self, name, func, inbox, outbox=None):
+        super().__init__(name=name, daemon=True)
+        self.func = func
+        self.inbox = inbox
+        self.outbox = outbox
+        self.count = 0
+        self.error = None
+
+    def run(self):
+        item = None
+
+        try:
+            while True:
+                item = self.inbox.get()
+
+                if item is DONE:
+                    break
+
+                try:
+                    item = self.func(item)
+                except Exception as e:
+                    log.error("Line %s: %s failed: %s", item.line, self.name, e)
+                    continue
+
+                if item is None:
+                    continue
+
+                self.count += 1
+
+                if self.outbox is not None:
+                    self.outbox.put(item)
+        except BaseException as e:
+            log.error("The %s stage stopped: %r", self.name, e)
+            self.error = e
+
+            # Whatever is still coming is dropped, so nothing before this
+            # stage blocks on its full inbox
+            while item is not DONE:
+                item = self.inbox.get()
+        finally:
+            # However the stage ended, the ones after it are released
+            if self.outbox is not None:
+                self.outbox.put(DONE)
+
+
+def add_batch(con, items, post=True, wait=18, queue_size=4):
+    """Add, upload and post works with every step running at once.
+
+    Each step has its own thread, with bounded queues in between, so one
+    work is extracted while the one before it uploads and the one before that
+    posts; the whole batch takes about as long as its slowest step.
+
+    """
+
+    def save(item):
+        old_id = h.find_work(con, item.url)
+
+        if old_id:
+            log.error("Line %s: already added with ID %s", item.line, old_id)
+            return None
+
+        work = extract.auto(item.url)
+        submissions = h.Submissions(item.specifiers)
+        images = h.probe_images(con, submissions, work.image_url)
+
+        with con.transaction():
+            work_id = h.save_work(
+                con,
+                work.title,
+                work.series,
+                work.artists,
+                work.source_url,
+                work.nsfw,
+                work.image_url,
+            )
+
+            if not work_id:
+                return None
+
+            h.add_submissions(con, work_id, submissions, images)
+
+        return item._replace(work_id=work_id)
+
+    def upload(item):
+        h.upload_to_imgur(con, item.work_id)
+
+        uploaded = con.db.execute(
+            sa.text("SELECT imgur_id IS NOT NULL FROM works WHERE id = :id"),
+            id=item.work_id,
+        ).scalar()
+
+        if not uploaded:
+            # The upload was queued as a job; a worker posts once it's done
+            if post:
+                jobs.enqueue(con, ("post",), [item.work_id])
+            return None
+
+        return item
+
+    def submit(item):
+        h.post_submissions(con, item.work_id, wait=wait)
+
+        return item
+
+    # Authenticate up front, since it can prompt on the terminal, which the
+    # stages' threads mustn't do; every account the batch posts with is needed
+    con.imgur
+    if post:
+        items = list(items)
+        names = {spec[0] for item in items for spec in item.specifiers}
+
+        for account in con.db.execute(
+            sa.text("SELECT DISTINCT account FROM subreddits WHERE name = ANY(:names)"),
+            names=list(names),
+        ):
+            con.reddit_for(account[0])
+
+    inbox = queue.Queue(queue_size)
+
+    stages = [Stage("extract", save, inbox, queue.Queue(queue_size))]
+    stages.append(
+        Stage(
+            "upload",
+            upload,
+            stages[-1].outbox,
+            queue.Queue(queue_size) if post else None,
+        )
+    )
+    if post:
+        stages.append(Stage("post", submit, stages[-1].outbox))
+
+    for stage in stages:
+        stage.start()
+
+    for item in items:
+        inbox.put(item)
+
+    inbox.put(DONE)
+
+    for stage in stages:
+        stage.join()
+
+    for stage in stages:
+        if stage.error is not None:
+            raise stage.error
+
+    log.info(
+        "Finished: %s",
+        ", ".join("{} {}".format(stage.count, stage.name) for stage in stages),
+    )
+
+    return tuple(stage.count for stage in stages)
@@ -0,0 +1,134 @@
+import heapq
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+
+Planned = namedtuple(
+    "Planned", ["planned_on", "subreddit", "work_id", "title", "submission_id"]
+)
+
+SUBREDDITS = """SELECT id, name, space_out, disabled, crosspost_from,
+        last_submission_on
+    FROM subreddits WHERE id IN (
+        SELECT DISTINCT subreddit_id FROM submissions WHERE reddit_id IS NULL)"""
+
+PENDING = """SELECT submissions.id, work_id, subreddit_id, title
+    FROM submissions INNER JOIN works ON works.id = work_id
+    WHERE reddit_id IS NULL"""
+
+
+def simulate(subreddits, pending, now, wait):
+    """Project when each pending submission gets posted.
+
+    Mirrors post_submissions: a spaced-out subreddit takes one post per
+    ``wait``, works in ID order, and a work waits for its posts to crosspost
+    sources. Events are popped from a heap of subreddits keyed by the time
+    each can next post, so the cost is O(n log n) in pending submissions.
+    Yields Planned rows in time order, then the ones that will never post.
+
+    """
+    wait = timedelta(hours=wait)
+
+    queues = defaultdict(list)
+    titles = {}
+    sources = defaultdict(int)
+
+    for row in pending:
+        sr = subreddits[row["subreddit_id"]]
+
+        heapq.heappush(queues[sr["id"]], (row["work_id"], row["id"]))
+        titles[row["work_id"]] = row["title"]
+
+        # As in the real query, a source in a disabled subreddit holds its
+        # work back for good
+        if sr["crosspost_from"]:
+            sources[row["work_id"]] += 1
+
+    # Submissions held back until their work's crosspost sources are posted
+    blocked = defaultdict(list)
+    available = {}
+    events = []
+
+    for sr in subreddits.values():
+        if sr["disabled"] or not queues[sr["id"]]:
+            continue
+
+        last = sr["last_submission_on"]
+        start = now if not sr["space_out"] or last is None else max(now, last + wait)
+
+        available[sr["id"]] = start
+        heapq.heappush(events, (start, sr["id"]))
+
+    idle = set()
+
+    while events:
+        time, sr_id = heapq.heappop(events)
+        sr = subreddits[sr_id]
+        queue = queues[sr_id]
+
+        while queue:
+            work_id, submission_id = heapq.heappop(queue)
+
+            if not sr["crosspost_from"] and sources[work_id]:
+                blocked[work_id].append((sr_id, submission_id))
+                continue
+
+            yield Planned(time, sr["name"], work_id, titles[work_id], submission_id)
+
+            if sr["crosspost_from"]:
+                sources[work_id] -= 1
+
+                if not sources[work_id]:
+                    for other_id, other_submission in blocked.pop(work_id, ()):
+                        heapq.heappush(queues[other_id], (work_id, other_submission))
+
+                        if other_id in idle:
+                            idle.discard(other_id)
+                            heapq.heappush(
+                                events, (max(time, available[other_id]), other_id)
+                            )
+
+            available[sr_id] = time + wait if sr["space_out"] else time
+            break
+
+        if queue:
+            heapq.heappush(events, (available[sr_id], sr_id))
+        else:
+            idle.add(sr_id)
+
+    for sr_id, queue in queues.items():
+        for work_id, submission_id in sorted(queue):
+            yield Planned(
+                None, subreddits[sr_id]["name"], work_id, titles[work_id], submission_id
+            )
+
+    for work_id, held in blocked.items():
+        for sr_id, submission_id in held:
+            yield Planned(
+                None, subreddits[sr_id]["name"], work_id, titles[work_id], submission_id
+            )
+
+
+def plan(con, wait=18):
+    """Load the backlog and spacing state in two queries and simulate it."""
+    with con.transaction() as connection:
+        now = connection.execute("SELECT now() AT TIME ZONE 'utc'").scalar()
+        subreddits = {row["id"]: row for row in connection.execute(SUBREDDITS)}
+        pending = connection.execute(PENDING).fetchall()
+
+    return simulate(subreddits, pending, now, wait)
+
+
+def summarize(planned):
+    """Per subreddit: how many posts are planned, and the first and last."""
+    summary = {}
+
+    for row in planned:
+        count, first, last = summary.get(row.subreddit, (0, None, None))
+
+        if row.planned_on is not None:
+            first = first or row.planned_on
+            last = row.planned_on
+
+        summary[row.subreddit] = (count + 1, first, last)
+
+    return [(name,) + summary[name] for name in sorted(summary)]
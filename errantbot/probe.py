@@ -0,0 +1,183 @@
+import logging
+import re
+import struct
+from collections import namedtuple
+
+from .lazy import lazy_import
+
+net = lazy_import("errantbot.net")
+requests = lazy_import("requests")
+
+log = logging.getLogger(__name__)
+
+Image = namedtuple("Image", ["url", "format", "width", "height", "size"])
+
+# Enough for PNG, GIF and WebP, and for most JPEGs; a JPEG whose frame header
+# sits behind large metadata is read further, up to MAX_BYTES
+CHUNK_BYTES = 16384
+MAX_BYTES = 262144
+
+# JPEG start-of-frame markers, which carry the dimensions
+SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def png(data):
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and len(data) >= 24:
+        return struct.unpack(">II", data[16:24])
+
+
+def gif(data):
+    if data[:6] in (b"GIF87a", b"GIF89a") and len(data) >= 10:
+        return struct.unpack("<HH", data[6:10])
+
+
+def webp(data):
+    if data[:4] != b"RIFF" or data[8:12] != b"WEBP" or len(data) < 30:
+        return None
+
+    chunk = data[12:16]
+
+    if chunk == b"VP8 ":
+        width, height = struct.unpack("<HH", data[26:30])
+        return width & 0x3FFF, height & 0x3FFF
+    if chunk == b"VP8L":
+        bits = int.from_bytes(data[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        return (
+            int.from_bytes(data[24:27], "little") + 1,
+            int.from_bytes(data[27:30], "little") + 1,
+        )
+
+
+def jpeg(data):
+    """Walk the JPEG segments to the frame header.
+
+    Returns None if ``data`` isn't a JPEG, or False if it's cut short first.
+
+    """
+    if data[:2] != b"\xff\xd8":
+        return None
+
+    offset = 2
+
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+
+        marker = data[offset + 1]
+
+        # Fill bytes and markers without a length
+        if marker == 0xFF:
+            offset += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            offset += 2
+            continue
+
+        (length,) = struct.unpack(">H", data[offset + 2 : offset + 4])
+
+        if marker in SOF_MARKERS:
+            if offset + 9 > len(data):
+                return False
+
+            height, width = struct.unpack(">HH", data[offset + 5 : offset + 9])
+            return width, height
+
+        offset += 2 + length
+
+    return False
+
+
+FORMATS = (("png", png), ("gif", gif), ("webp", webp), ("jpeg", jpeg))
+
+
+def dimensions(data):
+    """Return ``(format, width, height)`` read from the start of an image.
+
+    False means more bytes are needed, and None that the format is unknown.
+
+    """
+    for name, parse in FORMATS:
+        found = parse(data)
+
+        if found:
+            return (name,) + tuple(found)
+        if found is False:
+            return False
+
+    return None
+
+
+def total_size(response):
+    content_range = response.headers.get("Content-Range", "")
+
+    match = re.search(r"/(\d+)$", content_range)
+    if match:
+        return int(match[1])
+
+    if response.status_code == 200 and "Content-Length" in response.headers:
+        return int(response.headers["Content-Length"])
+
+    return None
+
+
+def probe(url):
+    """Find an image's format, dimensions and size from its first few KB.
+
+    Bytes are asked for in ranges, doubling only while a JPEG's frame header
+    hasn't been reached; a server that ignores ranges is read only as far as
+    needed before the connection is dropped. Returns None when the image can't
+    be read.
+
+    """
+    data = b""
+    size = None
+
+    try:
+        while True:
+            end = min(max(2 * len(data), CHUNK_BYTES), MAX_BYTES) - 1
+
+            with net.session().get(
+                url,
+                headers={"Range": "bytes={}-{}".format(len(data), end)},
+                stream=True,
+            ) as response:
+                response.raise_for_status()
+
+                if size is None:
+                    size = total_size(response)
+
+                ranged = response.status_code == 206
+                if not ranged:
+                    data = b""
+
+                for chunk in response.iter_content(CHUNK_BYTES):
+                    data += chunk
+
+                    if not ranged and (
+                        dimensions(data) is not False or len(data) >= MAX_BYTES
+                    ):
+                        break
+
+            if not ranged or dimensions(data) is not False:
+                break
+
+            # Out of budget, or the server has nothing more to give
+            if (
+                len(data) >= MAX_BYTES
+                or len(data) <= end
+                or (size is not None and len(data) >= size)
+            ):
+                break
+    except requests.exceptions.RequestException as e:
+        log.warning("Couldn't probe %s: %s", url, e)
+        return None
+
+    found = dimensions(data)
+
+    if not found:
+        log.warning("Couldn't read the dimensions of %s", url)
+        return None
+
+    return Image(url, *found, size)
@@ -0,0 +1,147 @@
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from . import lazy
+
+log = logging.getLogger(__name__)
+
+# Longest statement text a slow query warning shows
+STATEMENT_CHARS = 200
+
+# Set from the CLI; statements slower than this many seconds are logged
+slow_query = None
+
+# Set by Profile; stages are only timed while a command is being profiled
+enabled = False
+
+# Name -> [count, seconds]
+lock = threading.Lock()
+stages = {}
+queries = {}
+slow_queries = 0
+
+
+def record(table, name, seconds):
+    with lock:
+        entry = table.setdefault(name, [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+
+@contextmanager
+def stage(name):
+    """Time a stage of the command, such as reflecting the schema."""
+    if not enabled:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stages, name, time.perf_counter() - start)
+
+
+def watch_queries(engine):
+    """Time every statement ``engine`` executes, logging the slow ones."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("profiling_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        global slow_queries
+
+        seconds = time.perf_counter() - conn.info["profiling_started"].pop()
+
+        record(queries, statement.lstrip().split(None, 1)[0].upper(), seconds)
+
+        if slow_query is not None and seconds >= slow_query:
+            with lock:
+                slow_queries += 1
+
+            text = " ".join(statement.split())
+            if len(text) > STATEMENT_CHARS:
+                text = text[:STATEMENT_CHARS] + "..."
+
+            log.warning("Slow query (%.3fs): %s", seconds, text)
+
+    @event.listens_for(engine, "handle_error")
+    def error(context):
+        started = context.connection and context.connection.info.get(
+            "profiling_started"
+        )
+
+        if started:
+            started.pop()
+
+
+def format_table(table):
+    return ", ".join(
+        "{} {}x {:.3f}s".format(name, count, seconds)
+        for name, (count, seconds) in sorted(
+            table.items(), key=lambda item: item[1][1], reverse=True
+        )
+    )
+
+
+def report(total, http_calls):
+    """Log where a command's time went, stage by stage."""
+    log.info("Took %.3fs", total)
+
+    if stages:
+        log.info("Stages: %s", format_table(stages))
+
+    if queries:
+        count = sum(entry[0] for entry in queries.values())
+        seconds = sum(entry[1] for entry in queries.values())
+
+        log.info(
+            "SQL: %s statements in %.3fs (%s); %s slow",
+            count,
+            seconds,
+            format_table(queries),
+            slow_queries,
+        )
+
+    if http_calls:
+        log.info("HTTP: %s", format_table(http_calls))
+
+
+class Profile:
+    """cProfile over a whole command, saved for pstats or snakeviz at the end."""
+
+    def __init__(self, path):
+        import cProfile
+
+        self.path = path
+        self.profiler = cProfile.Profile()
+        self.start = time.perf_counter()
+
+    def __enter__(self):
+        global enabled
+        enabled = True
+
+        self.profiler.enable()
+
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.profiler.disable()
+        self.profiler.dump_stats(self.path)
+
+        # Commands that never went online haven't loaded it, though the CLI
+        # has lazily imported it; reading its calls would load it for nothing
+        net = sys.modules.get("errantbot.net")
+
+        report(
+            time.perf_counter() - self.start,
+            net.calls if net is not None and lazy.loaded(net) else {},
+        )
+
+        log.info("Profile saved to %s; view it with python -m pstats", self.path)
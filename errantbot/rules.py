@@ -0,0 +1,137 @@
+from collections import namedtuple
+
+from .lazy import lazy_import
+
+sa = lazy_import("sqlalchemy")
+
+Rules = namedtuple(
+    "Rules",
+    [
+        "id",
+        "name",
+        "flair_id",
+        "require_flair",
+        "require_tag",
+        "require_series",
+        "sfw_only",
+        "min_width",
+        "min_height",
+        "min_aspect",
+        "max_aspect",
+        "max_bytes",
+    ],
+)
+
+Accepted = namedtuple("Accepted", ["subreddit_id", "name", "flair_id", "tag"])
+
+Rejected = namedtuple("Rejected", ["name", "problem"])
+
+PROBLEMS = {
+    "unknown": "is unknown",
+    "duplicate": "is listed more than once",
+    "require_flair": "requires a flair",
+    "require_series": "requires a series",
+    "require_tag": "requires a tag",
+    "sfw_only": "only allows SFW works",
+    "too_small": "requires larger images",
+    "aspect": "doesn't allow this aspect ratio",
+    "too_large": "doesn't allow files this large",
+    "already_exists": "already has this work",
+}
+
+
+def load(con, names=None):
+    """Fetch posting rules for the named subreddits, or all of them, in one query."""
+    query = "SELECT {} FROM subreddits".format(", ".join(Rules._fields))
+
+    if names is None:
+        rows = con.db.execute(query)
+    else:
+        rows = con.db.execute(
+            sa.text(query + " WHERE name = ANY(:names)"), names=list(set(names))
+        )
+
+    return {row["name"]: Rules(*row) for row in rows}
+
+
+def checks_images(rules):
+    return any(
+        value is not None
+        for value in (
+            rules.min_width,
+            rules.min_height,
+            rules.min_aspect,
+            rules.max_aspect,
+            rules.max_bytes,
+        )
+    )
+
+
+def image_problem(rules, image):
+    if (rules.min_width and image.width < rules.min_width) or (
+        rules.min_height and image.height < rules.min_height
+    ):
+        return "too_small"
+
+    aspect = image.width / image.height if image.height else 0
+
+    if (rules.min_aspect and aspect < rules.min_aspect) or (
+        rules.max_aspect and aspect > rules.max_aspect
+    ):
+        return "aspect"
+
+    if rules.max_bytes and image.size is not None and image.size > rules.max_bytes:
+        return "too_large"
+
+
+def problem(rules, series, nsfw, flair_id, tag, images=()):
+    """Return the first rule a specifier breaks, or None; mirrors the CHECKs.
+
+    Image constraints are checked against every probed image of the work, and
+    skipped for images that couldn't be probed.
+
+    """
+    if rules.require_flair and flair_id is None and rules.flair_id is None:
+        return "require_flair"
+    if rules.require_series and series is None:
+        return "require_series"
+    if rules.require_tag and tag is None:
+        return "require_tag"
+    if rules.sfw_only and nsfw:
+        return "sfw_only"
+
+    for image in images:
+        found = image_problem(rules, image)
+        if found:
+            return found
+
+
+def validate(rules, series, nsfw, specifiers, images=()):
+    """Check a batch of (name, flair_id, tag) specifiers for one work in memory.
+
+    Returns ``(accepted, rejected)``, so every problem can be reported at once
+    and only rows that will pass are sent to the database.
+
+    """
+    accepted = []
+    rejected = []
+    seen = set()
+
+    for name, flair_id, tag in specifiers:
+        sr_rules = rules.get(name)
+
+        if sr_rules is None:
+            rejected.append(Rejected(name, "unknown"))
+        elif name in seen:
+            rejected.append(Rejected(name, "duplicate"))
+        else:
+            found = problem(sr_rules, series, nsfw, flair_id, tag, images)
+
+            if found:
+                rejected.append(Rejected(name, found))
+            else:
+                accepted.append(Accepted(sr_rules.id, name, flair_id, tag))
+
+        seen.add(name)
+
+    return accepted, rejected
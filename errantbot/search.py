@@ -0,0 +1,60 @@
+from .lazy import lazy_import
+
+h = lazy_import("errantbot.helper")
+sa = lazy_import("sqlalchemy")
+
+# Every arm is answered by an index: trigram ones for the names, and the one
+# on works.artist_id for the matched artists' works. Artist matches on an
+# alias are credited to the canonical artist at the end of its chain
+QUERY = """WITH RECURSIVE matched_artists AS (
+        SELECT id, alias_of, word_similarity(:query, name) AS score, 1 AS depth
+        FROM artists WHERE :query <% name
+        UNION ALL
+        SELECT artists.id, artists.alias_of, matched_artists.score,
+            matched_artists.depth + 1
+        FROM artists INNER JOIN matched_artists ON artists.id = matched_artists.alias_of
+        WHERE matched_artists.depth < :max_depth
+    ), artist_scores AS (
+        SELECT id, max(score) AS score FROM matched_artists
+        WHERE alias_of IS NULL GROUP BY id
+    ), candidates AS (
+        SELECT id, word_similarity(:query, title) AS score
+        FROM works WHERE :query <% title
+        UNION ALL
+        SELECT id, word_similarity(:query, series) FROM works WHERE :query <% series
+        UNION ALL
+        SELECT works.id, artist_scores.score
+        FROM works INNER JOIN artist_scores ON works.artist_id = artist_scores.id
+    ), ranked AS (
+        SELECT id, max(score) AS score FROM candidates
+        GROUP BY id ORDER BY score DESC, id DESC LIMIT :limit
+    )
+    SELECT works.id, round(ranked.score::numeric, 2) AS score, title,
+        artists.name AS artist, series, imgur_url
+    FROM ranked INNER JOIN works ON works.id = ranked.id
+    INNER JOIN artists ON artists.id = works.artist_id
+    ORDER BY ranked.score DESC, works.id DESC"""
+
+
+def search(con, query, limit=20, threshold=None):
+    """Find works whose title, series or artist (aliases included) match ``query``.
+
+    Returns the column names and the best ``limit`` works, ranked by trigram word
+    similarity. A lower ``threshold`` (0-1) makes matching fuzzier.
+
+    """
+    with con.transaction() as connection:
+        if threshold is not None:
+            connection.execute(
+                sa.text(
+                    "SELECT set_config('pg_trgm.word_similarity_threshold', "
+                    ":threshold, true)"
+                ),
+                threshold=str(threshold),
+            )
+
+        result = connection.execute(
+            sa.text(QUERY), query=query, limit=limit, max_depth=h.MAX_ALIAS_DEPTH
+        )
+
+        return result.keys(), result.fetchall()
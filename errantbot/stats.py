@@ -0,0 +1,83 @@
+import logging
+
+from .lazy import lazy_import
+
+sa = lazy_import("sqlalchemy")
+
+log = logging.getLogger(__name__)
+
+# Recomputes every counter from scratch, returning the rows that changed
+BACKFILL = (
+    """UPDATE subreddits SET submission_count = actual.submissions,
+        posted_count = actual.posted
+    FROM (SELECT subreddits.id, count(submissions.id) AS submissions,
+            count(submissions.reddit_id) AS posted
+        FROM subreddits LEFT JOIN submissions ON subreddit_id = subreddits.id
+        GROUP BY subreddits.id) AS actual
+    WHERE subreddits.id = actual.id
+    AND (submission_count, posted_count) <> (actual.submissions, actual.posted)""",
+    """UPDATE artists SET work_count = actual.works
+    FROM (SELECT artists.id, count(works.id) AS works
+        FROM artists LEFT JOIN works ON artist_id = artists.id
+        GROUP BY artists.id) AS actual
+    WHERE artists.id = actual.id AND work_count <> actual.works""",
+)
+
+CHECK = """SELECT 'subreddit' AS kind, subreddits.name, 'submissions' AS counter,
+        submission_count AS stored, count(submissions.id) AS actual
+    FROM subreddits LEFT JOIN submissions ON subreddit_id = subreddits.id
+    GROUP BY subreddits.id HAVING submission_count <> count(submissions.id)
+    UNION ALL
+    SELECT 'subreddit', subreddits.name, 'posted', posted_count,
+        count(submissions.reddit_id)
+    FROM subreddits LEFT JOIN submissions ON subreddit_id = subreddits.id
+    GROUP BY subreddits.id HAVING posted_count <> count(submissions.reddit_id)
+    UNION ALL
+    SELECT 'artist', artists.name, 'works', work_count, count(works.id)
+    FROM artists LEFT JOIN works ON artist_id = artists.id
+    GROUP BY artists.id HAVING work_count <> count(works.id)"""
+
+
+def backfill(con):
+    """Bring the trigger-maintained counters in line with the tables.
+
+    Needed once after the counter columns are added, or if check() finds drift.
+
+    """
+    with con.transaction() as connection:
+        # Stop concurrent writers from racing the recount
+        connection.execute("LOCK TABLE submissions, works IN SHARE MODE")
+
+        changed = sum(connection.execute(query).rowcount for query in BACKFILL)
+
+    log.info("Backfilled %s counters", changed)
+
+
+def check(con):
+    """Return (kind, name, counter, stored, actual) for every counter that's off."""
+    return con.db.execute(CHECK).fetchall()
+
+
+def subreddits(con, wait):
+    """Per-subreddit counters and readiness, read without touching submissions."""
+    return con.db.execute(
+        sa.text(
+            """SELECT name, submission_count AS submissions, posted_count AS posted,
+                submission_count - posted_count AS pending, last_submission_on,
+                NOT disabled AND (NOT space_out OR last_submission_on IS NULL
+                    OR last_submission_on < now() AT TIME ZONE 'utc'
+                        - make_interval(hours => :wait)) AS ready
+            FROM subreddits ORDER BY pending DESC, name"""
+        ),
+        wait=wait,
+    )
+
+
+def artists(con, limit):
+    return con.db.execute(
+        sa.text(
+            """SELECT name, work_count AS works FROM artists
+            WHERE alias_of IS NULL ORDER BY work_count DESC, name LIMIT :limit"""
+        ),
+        limit=limit,
+    )
@@ -0,0 +1,92 @@
+import logging
+
+from .lazy import lazy_import
+
+sa = lazy_import("sqlalchemy")
+
+log = logging.getLogger(__name__)
+
+# Most fullnames Reddit's info endpoint takes at once
+BATCH_SIZE = 100
+
+# How long a post's state is trusted depends on its age, since new posts are
+# the ones whose score and moderation status still change
+STALE = """synced_on IS NULL OR synced_on < now() AT TIME ZONE 'utc' - CASE
+        WHEN submitted_on > now() AT TIME ZONE 'utc' - INTERVAL '1 day'
+            THEN INTERVAL '1 hour'
+        WHEN submitted_on > now() AT TIME ZONE 'utc' - INTERVAL '7 days'
+            THEN INTERVAL '6 hours'
+        ELSE INTERVAL '7 days' END"""
+
+
+def state(submission):
+    """Return (score, removed, deleted) for a submission from the info endpoint.
+
+    Read from the data Reddit returned, so no attribute access triggers a fetch.
+
+    """
+    data = vars(submission)
+    category = data.get("removed_by_category")
+
+    deleted = category in ("deleted", "author") or data.get("author") is None
+
+    return data.get("score"), category is not None and not deleted, deleted
+
+
+def sync(con, limit=None, everything=False):
+    """Refresh score, removal and deletion of posted submissions, newest first.
+
+    Only posts whose state has gone stale are fetched, unless ``everything``,
+    at 100 per request. Returns the number of submissions synced.
+
+    """
+    started = con.db.execute("SELECT now() AT TIME ZONE 'utc'").scalar()
+    synced = removed = deleted = 0
+
+    query = sa.text(
+        """SELECT id, reddit_id FROM submissions WHERE reddit_id IS NOT NULL AND ("""
+        + ("synced_on IS NULL OR synced_on < :started" if everything else STALE)
+        + """) ORDER BY submitted_on DESC NULLS LAST, id LIMIT :size"""
+    )
+
+    while limit is None or synced < limit:
+        size = BATCH_SIZE if limit is None else min(BATCH_SIZE, limit - synced)
+
+        rows = con.db.execute(query, started=started, size=size).fetchall()
+
+        if not rows:
+            break
+
+        found = {
+            submission.id: state(submission)
+            for submission in con.reddit.info(
+                fullnames=["t3_" + row["reddit_id"] for row in rows]
+            )
+        }
+
+        # A post missing from the response no longer exists
+        states = [found.get(row["reddit_id"], (None, False, True)) for row in rows]
+
+        con.db.execute(
+            sa.text(
+                """UPDATE submissions SET score = COALESCE(s.score, submissions.score),
+                    removed = s.removed, deleted = s.deleted,
+                    synced_on = now() AT TIME ZONE 'utc'
+                FROM unnest(CAST(:ids AS integer[]), CAST(:scores AS integer[]),
+                    CAST(:removed AS boolean[]), CAST(:deleted AS boolean[]))
+                    AS s(id, score, removed, deleted)
+                WHERE submissions.id = s.id"""
+            ),
+            ids=[row["id"] for row in rows],
+            scores=[s[0] for s in states],
+            removed=[s[1] for s in states],
+            deleted=[s[2] for s in states],
+        )
+
+        synced += len(rows)
+        removed += sum(s[1] for s in states)
+        deleted += sum(s[2] for s in states)
+
+    log.info("Synced %s submissions; %s removed, %s deleted", synced, removed, deleted)
+
+    return synced
@@ -15,6 +15,20 @@ SET check_function_bodies = false;
 SET client_min_messages = warning;
 SET row_security = off;
 
+--
+-- Name: pg_trgm; Type: EXTENSION; Schema: -; Owner: -
+--
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm WITH SCHEMA public;
+
+
+--
+-- Name: EXTENSION pg_trgm; Type: COMMENT; Schema: -; Owner: -
+--
+
+COMMENT ON EXTENSION pg_trgm IS 'text similarity measurement and index searching based on trigrams';
+
+
 --
 -- Name: artist_not_alias(integer); Type: FUNCTION; Schema: public; Owner: -
 --
@@ -70,6 +84,48 @@ CREATE FUNCTION public.check_require_tag(new_custom_tag character varying, subre
 $$;
 
 
+--
+-- Name: check_sfw_only(integer, integer); Type: FUNCTION; Schema: public; Owner: -
+--
+
+CREATE FUNCTION public.check_sfw_only(work_id integer, subreddit_id integer) RETURNS boolean
+    LANGUAGE sql
+    AS $$
+    SELECT NOT EXISTS(SELECT FROM subreddits WHERE id = subreddit_id AND sfw_only) OR NOT (SELECT nsfw FROM works WHERE id = work_id);
+$$;
+
+
+--
+-- Name: update_artist_counts(); Type: FUNCTION; Schema: public; Owner: -
+--
+
+CREATE FUNCTION public.update_artist_counts() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE artists SET work_count = work_count + delta.works
+            FROM (SELECT artist_id, count(*) AS works FROM new_rows GROUP BY artist_id) AS delta
+            WHERE id = delta.artist_id;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE artists SET work_count = work_count - delta.works
+            FROM (SELECT artist_id, count(*) AS works FROM old_rows GROUP BY artist_id) AS delta
+            WHERE id = delta.artist_id;
+    ELSE
+        UPDATE artists SET work_count = work_count + delta.works
+            FROM (SELECT artist_id, sum(works) AS works FROM (
+                SELECT artist_id, 1 AS works FROM new_rows
+                UNION ALL
+                SELECT artist_id, -1 FROM old_rows) AS changes
+            GROUP BY artist_id HAVING sum(works) <> 0) AS delta
+            WHERE id = delta.artist_id;
+    END IF;
+
+    RETURN NULL;
+END;
+$$;
+
+
 --
 -- Name: update_last_submission_on(); Type: FUNCTION; Schema: public; Owner: -
 --
@@ -78,17 +134,66 @@ CREATE FUNCTION public.update_last_submission_on() RETURNS trigger
     LANGUAGE plpgsql
     AS $$
 DECLARE
-    old_last_post TIMESTAMP;
+    sr_id INTEGER;
 BEGIN
+    -- Rows that haven't been posted yet can't move the last submission
+    IF TG_OP = 'INSERT' AND NEW.submitted_on IS NULL THEN
+        RETURN NEW;
+    END IF;
+
+    IF TG_OP = 'DELETE' THEN
+        sr_id := OLD.subreddit_id;
+    ELSE
+        sr_id := NEW.subreddit_id;
+    END IF;
+
     UPDATE subreddits SET last_submission_on = 
-        (SELECT submitted_on FROM submissions WHERE subreddit_id = NEW.subreddit_id ORDER BY submitted_on DESC NULLS LAST LIMIT 1)
-        WHERE id = NEW.subreddit_id;
+        (SELECT submitted_on FROM submissions WHERE subreddit_id = sr_id ORDER BY submitted_on DESC NULLS LAST LIMIT 1)
+        WHERE id = sr_id;
 
     RETURN NEW;
 END;
 $$;
 
 
+--
+-- Name: update_subreddit_counts(); Type: FUNCTION; Schema: public; Owner: -
+--
+
+CREATE FUNCTION public.update_subreddit_counts() RETURNS trigger
+    LANGUAGE plpgsql
+    AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE subreddits SET submission_count = submission_count + delta.submissions,
+            posted_count = posted_count + delta.posted
+            FROM (SELECT subreddit_id, count(*) AS submissions, count(reddit_id) AS posted
+                FROM new_rows GROUP BY subreddit_id) AS delta
+            WHERE id = delta.subreddit_id;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE subreddits SET submission_count = submission_count - delta.submissions,
+            posted_count = posted_count - delta.posted
+            FROM (SELECT subreddit_id, count(*) AS submissions, count(reddit_id) AS posted
+                FROM old_rows GROUP BY subreddit_id) AS delta
+            WHERE id = delta.subreddit_id;
+    ELSE
+        UPDATE subreddits SET submission_count = submission_count + delta.submissions,
+            posted_count = posted_count + delta.posted
+            FROM (SELECT subreddit_id, sum(submissions) AS submissions, sum(posted) AS posted
+                FROM (SELECT subreddit_id, 1 AS submissions,
+                        (reddit_id IS NOT NULL)::integer AS posted FROM new_rows
+                    UNION ALL
+                    SELECT subreddit_id, -1, -(reddit_id IS NOT NULL)::integer FROM old_rows
+                ) AS changes
+                GROUP BY subreddit_id HAVING sum(submissions) <> 0 OR sum(posted) <> 0) AS delta
+            WHERE id = delta.subreddit_id;
+    END IF;
+
+    RETURN NULL;
+END;
+$$;
+
+
 SET default_tablespace = '';
 
 SET default_with_oids = false;
@@ -101,6 +206,7 @@ CREATE TABLE public.artists (
     id integer NOT NULL,
     name character varying NOT NULL,
     alias_of integer,
+    work_count integer DEFAULT 0 NOT NULL,
     CONSTRAINT artists_not_reflexive CHECK ((id <> alias_of))
 );
 
@@ -125,6 +231,74 @@ CREATE SEQUENCE public.artists_id_seq1
 ALTER SEQUENCE public.artists_id_seq1 OWNED BY public.artists.id;
 
 
+--
+-- Name: checkpoints; Type: TABLE; Schema: public; Owner: -
+--
+
+CREATE TABLE public.checkpoints (
+    name character varying NOT NULL,
+    last_id integer NOT NULL,
+    updated_on timestamp without time zone DEFAULT timezone('utc'::text, now()) NOT NULL
+);
+
+
+--
+-- Name: jobs; Type: TABLE; Schema: public; Owner: -
+--
+
+CREATE TABLE public.jobs (
+    id integer NOT NULL,
+    kind character varying NOT NULL,
+    work_id integer NOT NULL,
+    submission_id integer,
+    attempts integer DEFAULT 0 NOT NULL,
+    run_after timestamp without time zone DEFAULT timezone('utc'::text, now()) NOT NULL,
+    leased_by character varying,
+    leased_until timestamp without time zone,
+    last_error character varying,
+    CONSTRAINT jobs_kind_check CHECK (((kind)::text = ANY ((ARRAY['upload'::character varying, 'post'::character varying])::text[]))),
+    CONSTRAINT jobs_post_has_submission CHECK ((((kind)::text = 'post'::text) = (submission_id IS NOT NULL)))
+);
+
+
+--
+-- Name: jobs_id_seq; Type: SEQUENCE; Schema: public; Owner: -
+--
+
+CREATE SEQUENCE public.jobs_id_seq
+    AS integer
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1;
+
+
+--
+-- Name: jobs_id_seq; Type: SEQUENCE OWNED BY; Schema: public; Owner: -
+--
+
+ALTER SEQUENCE public.jobs_id_seq OWNED BY public.jobs.id;
+
+
+--
+-- Name: link_checks; Type: TABLE; Schema: public; Owner: -
+--
+
+CREATE TABLE public.link_checks (
+    work_id integer NOT NULL,
+    url character varying NOT NULL,
+    kind character varying NOT NULL,
+    status integer,
+    healthy boolean,
+    error character varying,
+    etag character varying,
+    last_modified character varying,
+    checked_on timestamp without time zone DEFAULT timezone('utc'::text, now()) NOT NULL,
+    CONSTRAINT link_checks_kind_check CHECK (((kind)::text = ANY ((ARRAY['imgur'::character varying, 'source'::character varying])::text[])))
+);
+
+
 --
 -- Name: submissions; Type: TABLE; Schema: public; Owner: -
 --
@@ -137,9 +311,15 @@ CREATE TABLE public.submissions (
     custom_tag character varying,
     submitted_on timestamp without time zone,
     flair_id character varying,
+    score integer,
+    removed boolean,
+    deleted boolean,
+    synced_on timestamp without time zone,
+    source_comment_id character varying,
     CONSTRAINT check_require_flair CHECK (public.check_require_flair(flair_id, subreddit_id)),
     CONSTRAINT check_require_series CHECK (public.check_require_series(work_id, subreddit_id)),
-    CONSTRAINT check_require_tag CHECK (public.check_require_tag(custom_tag, subreddit_id))
+    CONSTRAINT check_require_tag CHECK (public.check_require_tag(custom_tag, subreddit_id)),
+    CONSTRAINT check_sfw_only CHECK (public.check_sfw_only(work_id, subreddit_id))
 );
 
 
@@ -178,7 +358,16 @@ CREATE TABLE public.subreddits (
     space_out boolean DEFAULT true NOT NULL,
     require_series boolean DEFAULT false NOT NULL,
     disabled boolean DEFAULT false NOT NULL,
-    sfw_only boolean DEFAULT false NOT NULL
+    sfw_only boolean DEFAULT false NOT NULL,
+    submission_count integer DEFAULT 0 NOT NULL,
+    posted_count integer DEFAULT 0 NOT NULL,
+    min_width integer,
+    min_height integer,
+    min_aspect real,
+    max_aspect real,
+    max_bytes integer,
+    crosspost_from boolean DEFAULT false NOT NULL,
+    account character varying
 );
 
 
@@ -250,6 +439,13 @@ ALTER SEQUENCE public.works_id_seq OWNED BY public.works.id;
 ALTER TABLE ONLY public.artists ALTER COLUMN id SET DEFAULT nextval('public.artists_id_seq1'::regclass);
 
 
+--
+-- Name: jobs id; Type: DEFAULT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.jobs ALTER COLUMN id SET DEFAULT nextval('public.jobs_id_seq'::regclass);
+
+
 --
 -- Name: submissions id; Type: DEFAULT; Schema: public; Owner: -
 --
@@ -295,6 +491,30 @@ ALTER TABLE ONLY public.artists
     ADD CONSTRAINT artists_pkey PRIMARY KEY (id);
 
 
+--
+-- Name: checkpoints checkpoints_pkey; Type: CONSTRAINT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.checkpoints
+    ADD CONSTRAINT checkpoints_pkey PRIMARY KEY (name);
+
+
+--
+-- Name: jobs jobs_pkey; Type: CONSTRAINT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.jobs
+    ADD CONSTRAINT jobs_pkey PRIMARY KEY (id);
+
+
+--
+-- Name: link_checks link_checks_pkey; Type: CONSTRAINT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.link_checks
+    ADD CONSTRAINT link_checks_pkey PRIMARY KEY (work_id, url);
+
+
 --
 -- Name: submissions submissions_pkey; Type: CONSTRAINT; Schema: public; Owner: -
 --
@@ -335,6 +555,69 @@ ALTER TABLE ONLY public.works
     ADD CONSTRAINT works_source_image_url_key UNIQUE (source_image_url);
 
 
+--
+-- Name: artists_name_trgm_idx; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX artists_name_trgm_idx ON public.artists USING gin (name public.gin_trgm_ops);
+
+
+--
+-- Name: jobs_kind_work_id_submission_id_idx; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE UNIQUE INDEX jobs_kind_work_id_submission_id_idx ON public.jobs USING btree (kind, work_id, COALESCE(submission_id, 0));
+
+
+--
+-- Name: jobs_run_after_idx; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX jobs_run_after_idx ON public.jobs USING btree (run_after, id);
+
+
+--
+-- Name: submissions_submitted_on_idx; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX submissions_submitted_on_idx ON public.submissions USING btree (submitted_on DESC NULLS LAST, id) WHERE (reddit_id IS NOT NULL);
+
+
+--
+-- Name: submissions_subreddit_id_submitted_on_idx; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX submissions_subreddit_id_submitted_on_idx ON public.submissions USING btree (subreddit_id, submitted_on DESC NULLS LAST);
+
+
+--
+-- Name: works_artist_id_idx; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX works_artist_id_idx ON public.works USING btree (artist_id);
+
+
+--
+-- Name: works_series_trgm_idx; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX works_series_trgm_idx ON public.works USING gin (series public.gin_trgm_ops);
+
+
+--
+-- Name: works_source_url_idx; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX works_source_url_idx ON public.works USING btree (source_url);
+
+
+--
+-- Name: works_title_trgm_idx; Type: INDEX; Schema: public; Owner: -
+--
+
+CREATE INDEX works_title_trgm_idx ON public.works USING gin (title public.gin_trgm_ops);
+
+
 --
 -- Name: submissions update_last_submission_on; Type: TRIGGER; Schema: public; Owner: -
 --
@@ -342,6 +625,48 @@ ALTER TABLE ONLY public.works
 CREATE TRIGGER update_last_submission_on AFTER INSERT OR DELETE OR UPDATE OF submitted_on ON public.submissions FOR EACH ROW EXECUTE PROCEDURE public.update_last_submission_on();
 
 
+--
+-- Name: submissions update_subreddit_counts_delete; Type: TRIGGER; Schema: public; Owner: -
+--
+
+CREATE TRIGGER update_subreddit_counts_delete AFTER DELETE ON public.submissions REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE PROCEDURE public.update_subreddit_counts();
+
+
+--
+-- Name: submissions update_subreddit_counts_insert; Type: TRIGGER; Schema: public; Owner: -
+--
+
+CREATE TRIGGER update_subreddit_counts_insert AFTER INSERT ON public.submissions REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE public.update_subreddit_counts();
+
+
+--
+-- Name: submissions update_subreddit_counts_update; Type: TRIGGER; Schema: public; Owner: -
+--
+
+CREATE TRIGGER update_subreddit_counts_update AFTER UPDATE ON public.submissions REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE public.update_subreddit_counts();
+
+
+--
+-- Name: works update_artist_counts_delete; Type: TRIGGER; Schema: public; Owner: -
+--
+
+CREATE TRIGGER update_artist_counts_delete AFTER DELETE ON public.works REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE PROCEDURE public.update_artist_counts();
+
+
+--
+-- Name: works update_artist_counts_insert; Type: TRIGGER; Schema: public; Owner: -
+--
+
+CREATE TRIGGER update_artist_counts_insert AFTER INSERT ON public.works REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE public.update_artist_counts();
+
+
+--
+-- Name: works update_artist_counts_update; Type: TRIGGER; Schema: public; Owner: -
+--
+
+CREATE TRIGGER update_artist_counts_update AFTER UPDATE ON public.works REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE PROCEDURE public.update_artist_counts();
+
+
 --
 -- Name: artists artists_alias_of_fkey; Type: FK CONSTRAINT; Schema: public; Owner: -
 --
@@ -350,6 +675,30 @@ ALTER TABLE ONLY public.artists
     ADD CONSTRAINT artists_alias_of_fkey FOREIGN KEY (alias_of) REFERENCES public.artists(id);
 
 
+--
+-- Name: jobs jobs_submission_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.jobs
+    ADD CONSTRAINT jobs_submission_id_fkey FOREIGN KEY (submission_id) REFERENCES public.submissions(id) ON DELETE CASCADE;
+
+
+--
+-- Name: jobs jobs_work_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.jobs
+    ADD CONSTRAINT jobs_work_id_fkey FOREIGN KEY (work_id) REFERENCES public.works(id) ON DELETE CASCADE;
+
+
+--
+-- Name: link_checks link_checks_work_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: -
+--
+
+ALTER TABLE ONLY public.link_checks
+    ADD CONSTRAINT link_checks_work_id_fkey FOREIGN KEY (work_id) REFERENCES public.works(id) ON DELETE CASCADE;
+
+
 --
 -- Name: submissions submissions_subreddit_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: -
 --
@@ -0,0 +1,37 @@
+import io
+
+import pytest
+
+from errantbot import bulk
+
+VALID = (
+    '{"title": "Title", "artist": "Artist", "source_url": "https://example.com/1",'
+    ' "source_image_url": "https://example.com/1.png"}\n'
+)
+
+
+def normalize_all(text):
+    problems = []
+    rows = [
+        bulk.normalize(line, record, {}, problems)
+        for line, record in bulk.read_jsonl(io.StringIO(text))
+    ]
+
+    return rows, problems
+
+
+def test_invalid_json_is_reported():
+    rows, problems = normalize_all(VALID + '{"title": "Title",\n' + VALID)
+
+    assert [row and row["line"] for row in rows] == [1, None, 3]
+    assert [(p.line, p.subreddit) for p in problems] == [(2, None)]
+    assert problems[0].problem.startswith("invalid JSON")
+
+
+@pytest.mark.parametrize("value", ["[1, 2]", '"a string"', "null", "3"])
+def test_values_other_than_objects_are_reported(value):
+    rows, problems = normalize_all(VALID + value + "\n")
+
+    assert rows[0]["title"] == "Title"
+    assert rows[1] is None
+    assert problems == [bulk.Problem(2, None, "not a JSON object")]
@@ -0,0 +1,11 @@
+import pytest
+
+from errantbot import canonical
+
+
+@pytest.mark.parametrize(
+    "url", ["http://example.com:abc/", "http://example.com:99999/", "http://[abc/"]
+)
+def test_malformed_urls_are_left_alone(url):
+    assert canonical.canonical(url) == url
+    assert not canonical.one_work(url)
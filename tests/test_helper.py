@@ -0,0 +1,123 @@
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+import praw.exceptions
+import pytest
+
+from errantbot import helper as h
+
+ROW = {
+    "series": None,
+    "title": "Title",
+    "artist": "Artist",
+    "custom_tag": None,
+    "imgur_url": "https://i.imgur.com/abc.png",
+    "source_image_url": "https://example.com/abc.png",
+    "source_image_urls": None,
+    "flair_id": None,
+    "nsfw": False,
+    "source_url": "https://example.com/abc",
+    "submission_id": 1,
+    "subreddit_id": 1,
+    "crosspost_id": None,
+}
+
+SUBREDDIT = {
+    "last_submission_on": None,
+    "space_out": False,
+    "name": "test",
+    "tag_series": False,
+    "flair_id": None,
+    "disabled": False,
+    "account": None,
+}
+
+
+class Result:
+    def __init__(self, row=None):
+        self.row = row
+
+    def first(self):
+        return self.row
+
+
+class Connections:
+    """Answers every statement with the subreddit, and records them."""
+
+    def __init__(self, reddit):
+        self.reddit = reddit
+        self.statements = []
+        self.db = SimpleNamespace(execute=self.execute)
+        self.engine = SimpleNamespace(begin=self.begin)
+
+    def execute(self, statement, **params):
+        self.statements.append((str(statement), params))
+
+        return Result(SUBREDDIT)
+
+    @contextmanager
+    def begin(self):
+        self.statements.append(("BEGIN", {}))
+        yield self.db
+        self.statements.append(("COMMIT", {}))
+
+    def reddit_for(self, account):
+        return self.reddit
+
+
+class Submission:
+    id = "abc123"
+
+    def reply(self, body):
+        raise praw.exceptions.ClientException("Couldn't comment")
+
+
+class Subreddit:
+    def __init__(self, error=None):
+        self.error = error
+
+    def submit(self, title, **kwargs):
+        if self.error:
+            raise self.error
+
+        return Submission()
+
+
+def reddit_raising(error=None):
+    return SimpleNamespace(subreddit=lambda name: Subreddit(error))
+
+
+@pytest.mark.parametrize(
+    "items",
+    [
+        [["RATELIMIT", "you are doing that too much", "ratelimit"]],
+        [
+            ["SUBMIT_VALIDATION_FLAIR_REQUIRED", "flair is required", "flair"],
+            ["NO_SELFS", "no text posts", "kind"],
+        ],
+    ],
+)
+def test_do_post_rejected(items, caplog):
+    con = Connections(reddit_raising(praw.exceptions.RedditAPIException(items)))
+
+    assert h.do_post(con, ROW, 0) is h.PostOutcome.REJECTED
+
+    for error_type, message, field in items:
+        assert error_type in caplog.text
+        assert message in caplog.text
+
+    # Nothing was recorded as posted
+    assert not any("UPDATE" in statement for statement, params in con.statements)
+
+
+def test_do_post_records_before_replying(caplog):
+    con = Connections(reddit_raising())
+
+    assert h.do_post(con, ROW, 0) is h.PostOutcome.POSTED
+
+    # The post is committed on its own, and a failed reply doesn't undo it
+    statements = [statement for statement, params in con.statements]
+    begin = statements.index("BEGIN")
+    assert "reddit_id = :reddit_id" in statements[begin + 1]
+    assert statements[begin + 2] == "COMMIT"
+    assert "Couldn't comment" in caplog.text
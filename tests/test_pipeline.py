@@ -0,0 +1,35 @@
+import queue
+
+from errantbot.pipeline import DONE, Item, Stage
+
+
+class Died(BaseException):
+    pass
+
+
+def test_a_dead_stage_releases_the_others():
+    def die_on_second(item):
+        if item.line == 2:
+            raise Died()
+        return item
+
+    inbox = queue.Queue(1)
+    first = Stage("first", die_on_second, inbox, queue.Queue(1))
+    second = Stage("second", lambda item: item, first.outbox)
+
+    first.start()
+    second.start()
+
+    # More than the queues hold, so a stage that stopped taking them would
+    # block this thread
+    for line in range(1, 10):
+        inbox.put(Item(line, "https://example.com", [], None))
+    inbox.put(DONE)
+
+    first.join(5)
+    second.join(5)
+
+    assert not first.is_alive() and not second.is_alive()
+    assert isinstance(first.error, Died)
+    assert (first.count, second.count) == (1, 1)
+    assert second.error is None